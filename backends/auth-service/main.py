@@ -4,10 +4,10 @@ MakrX Auth Service - Central Authentication & User Management
 FastAPI service that orchestrates authentication across MakrX ecosystem
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+import hmac
 import httpx
 import os
 import jwt
@@ -16,13 +16,16 @@ import logging
 from datetime import datetime, timedelta
 from pydantic import BaseModel, Field
 import asyncio
+import time
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 
 # Import security middleware
 from security_middleware import (
     RateLimitMiddleware,
     SecurityHeadersMiddleware,
-    InputValidationMiddleware
+    InputValidationMiddleware,
+    SlidingWindowLimiter
 )
 
 # Configure logging
@@ -41,6 +44,33 @@ if not KEYCLOAK_CLIENT_SECRET:
 MAKRCAVE_API_URL = os.getenv("MAKRCAVE_API_URL", "http://makrcave-backend:8000")
 STORE_API_URL = os.getenv("STORE_API_URL", "http://makrx-store-backend:8000")
 
+# Per-service deadlines (seconds) for profile aggregation and user sync
+SERVICE_DEADLINES = {
+    "makrcave": float(os.getenv("MAKRCAVE_PROFILE_TIMEOUT", "1.0")),
+    "store": float(os.getenv("STORE_PROFILE_TIMEOUT", "1.0"))
+}
+SYNC_DEADLINE = float(os.getenv("USER_SYNC_TIMEOUT", "10"))
+
+# Aggregated per-user service data, reused across page loads
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "30"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+
+# Shared secret the event-service sends with events for /events/receive
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN")
+
+# Per-IP rate limit; counts are shared across workers through Redis when enabled
+RATE_LIMIT_CALLS = int(os.getenv("RATE_LIMIT_CALLS", "100"))
+RATE_LIMIT_PERIOD = int(os.getenv("RATE_LIMIT_PERIOD", "3600"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "false").lower() == "true"
+RATE_LIMIT_REDIS_URL = os.getenv("REDIS_URL") if RATE_LIMIT_SHARED else None
+
+# Request bodies above this size (bytes) are rejected before they are parsed
+REQUEST_SIZE_LIMIT = int(os.getenv("REQUEST_SIZE_LIMIT", "1048576"))
+# Routes whose bodies skip HTML sanitization: admin-only, validated by their
+# models and forwarded to services that sanitize on their side
+SANITIZE_EXEMPT_PATHS = {"/auth/sync/user"}
+
 # Security
 security = HTTPBearer()
 
@@ -56,6 +86,8 @@ class UserProfile(BaseModel):
     preferences: Dict[str, Any] = {}
     created_at: datetime
     last_login: Optional[datetime] = None
+    # Services that did not answer within their deadline
+    unavailable_services: list[str] = []
 
 class TokenExchange(BaseModel):
     access_token: str
@@ -76,13 +108,49 @@ class UserSyncRequest(BaseModel):
 # Global HTTP client
 http_client: Optional[httpx.AsyncClient] = None
 
+class ProfileCache:
+    """Short-lived LRU of per-user service data, invalidated by user.* events"""
+    
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+    
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return data
+    
+    def set(self, user_id: str, data: Dict[str, Any]):
+        self.entries[user_id] = (time.monotonic() + self.ttl, data)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def invalidate(self, user_id: str):
+        self.entries.pop(user_id, None)
+
+profile_cache = ProfileCache(PROFILE_CACHE_TTL, PROFILE_CACHE_MAX_ENTRIES)
+
+# Created here rather than by the middleware so shutdown can close it
+rate_limiter = SlidingWindowLimiter(max_keys=RATE_LIMIT_MAX_KEYS, redis_url=RATE_LIMIT_REDIS_URL)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global http_client
     http_client = httpx.AsyncClient(timeout=30.0)
+    rotation_task = asyncio.create_task(jwks_keys.run_rotation())
     logger.info("Auth Service started")
     yield
+    rotation_task.cancel()
     await http_client.aclose()
+    await rate_limiter.close()
     logger.info("Auth Service shutdown")
 
 # FastAPI app
@@ -95,8 +163,17 @@ app = FastAPI(
 
 # Security middleware (order matters!)
 app.add_middleware(SecurityHeadersMiddleware)
-app.add_middleware(InputValidationMiddleware)
-app.add_middleware(RateLimitMiddleware, calls=100, period=3600)  # 100 calls per hour
+app.add_middleware(
+    InputValidationMiddleware,
+    max_body_size=REQUEST_SIZE_LIMIT,
+    exempt_paths=SANITIZE_EXEMPT_PATHS
+)
+app.add_middleware(
+    RateLimitMiddleware,
+    calls=RATE_LIMIT_CALLS,
+    period=RATE_LIMIT_PERIOD,
+    limiter=rate_limiter
+)
 
 # CORS configuration
 app.add_middleware(
@@ -115,37 +192,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global JWKS cache
-jwks_cache = {}
-jwks_cache_time = None
+# JWKS key cache
 JWKS_CACHE_DURATION = 3600  # 1 hour
-
-async def get_jwks_key(token: str) -> str:
-    """Get the appropriate public key from Keycloak JWKS endpoint"""
-    global jwks_cache, jwks_cache_time
-
-    # Check cache validity
-    if jwks_cache_time and (datetime.utcnow() - jwks_cache_time).seconds < JWKS_CACHE_DURATION:
-        jwks = jwks_cache
-    else:
-        # Fetch JWKS from Keycloak
-        keycloak_config_url = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}/.well-known/openid_configuration"
-
-        async with http_client.get(keycloak_config_url) as config_response:
+# Keys are refreshed in the background before they expire
+JWKS_ROTATION_INTERVAL = JWKS_CACHE_DURATION * 0.8
+# Minimum seconds between refetches triggered by an unknown key ID
+JWKS_UNKNOWN_KID_INTERVAL = 30
+
+class JWKSKeyCache:
+    """
+    Keycloak signing keys parsed once per fetch and indexed by kid.
+    Concurrent refreshes share a single in-flight fetch.
+    """
+    
+    def __init__(self):
+        self.keys: Dict[str, Any] = {}
+        self.fetched_at: Optional[float] = None
+        self.jwks_uri: Optional[str] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._last_unknown_kid_refetch = 0.0
+    
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at if self.fetched_at is not None else float("inf")
+    
+    async def _fetch(self):
+        if not self.jwks_uri:
+            # Discovery document only needs to be read once
+            keycloak_config_url = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}/.well-known/openid-configuration"
+            config_response = await http_client.get(keycloak_config_url)
             if config_response.status_code != 200:
                 raise HTTPException(status_code=401, detail="Cannot fetch Keycloak configuration")
-
-            config = config_response.json()
-            jwks_uri = config["jwks_uri"]
-
-        async with http_client.get(jwks_uri) as jwks_response:
-            if jwks_response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Cannot fetch JWKS")
-
-            jwks = jwks_response.json()
-            jwks_cache = jwks
-            jwks_cache_time = datetime.utcnow()
-
+            self.jwks_uri = config_response.json()["jwks_uri"]
+        
+        jwks_response = await http_client.get(self.jwks_uri)
+        if jwks_response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Cannot fetch JWKS")
+        
+        keys = {}
+        for jwk in jwks_response.json().get("keys", []):
+            if jwk.get("kty") != "RSA" or "kid" not in jwk:
+                continue
+            try:
+                keys[jwk["kid"]] = jwt.algorithms.RSAAlgorithm.from_jwk(jwk)
+            except Exception as e:
+                logger.warning(f"Skipping unusable JWK {jwk['kid']}: {e}")
+        
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+    
+    async def refresh(self):
+        """Refetch the key set; callers arriving mid-fetch wait for the same fetch"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        # Shielded so one cancelled request does not abort the fetch for everyone
+        await asyncio.shield(self._refresh_task)
+    
+    async def get_key(self, kid: str) -> Optional[Any]:
+        if self.age >= JWKS_CACHE_DURATION:
+            try:
+                await self.refresh()
+            except Exception:
+                if not self.keys:
+                    raise
+                logger.warning("JWKS refresh failed, using previously fetched keys")
+        
+        key = self.keys.get(kid)
+        if key is None and time.monotonic() - self._last_unknown_kid_refetch >= JWKS_UNKNOWN_KID_INTERVAL:
+            # Possibly a newly rotated key: refetch, but at most once per interval
+            self._last_unknown_kid_refetch = time.monotonic()
+            await self.refresh()
+            key = self.keys.get(kid)
+        return key
+    
+    async def run_rotation(self):
+        """Background task keeping the key set fresh ahead of expiry"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Background JWKS refresh failed: {e}")
+            await asyncio.sleep(JWKS_ROTATION_INTERVAL)
+
+jwks_keys = JWKSKeyCache()
+
+async def get_jwks_key(token: str) -> Any:
+    """Get the public key object for the token's key ID from the Keycloak JWKS cache"""
     # Decode token header to get key ID
     unverified_header = jwt.get_unverified_header(token)
     kid = unverified_header.get("kid")
@@ -153,33 +285,10 @@ async def get_jwks_key(token: str) -> str:
     if not kid:
         raise HTTPException(status_code=401, detail="Token missing key ID")
 
-    # Find matching key
-    for key in jwks["keys"]:
-        if key["kid"] == kid:
-            # Convert JWK to PEM format
-            from cryptography.hazmat.primitives import serialization
-            from cryptography.hazmat.primitives.asymmetric import rsa
-            import base64
-
-            # Extract RSA components
-            n = base64.urlsafe_b64decode(key["n"] + "====")
-            e = base64.urlsafe_b64decode(key["e"] + "====")
-
-            # Create RSA public key
-            public_numbers = rsa.RSAPublicNumbers(
-                int.from_bytes(e, 'big'),
-                int.from_bytes(n, 'big')
-            )
-            public_key = public_numbers.public_key()
-
-            # Convert to PEM
-            pem = public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
-            return pem.decode('utf-8')
-
-    raise HTTPException(status_code=401, detail="Unable to find appropriate key")
+    key = await jwks_keys.get_key(kid)
+    if key is None:
+        raise HTTPException(status_code=401, detail="Unable to find appropriate key")
+    return key
 
 # Authentication Dependencies
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
@@ -253,8 +362,9 @@ async def get_user_profile(user_data: Dict[str, Any] = Depends(verify_token)):
         username = user_data.get("preferred_username", email)
         
         # Aggregate data from all services
-        makrcave_data = await get_user_from_service("makrcave", user_id)
-        store_data = await get_user_from_service("store", user_id)
+        service_data, unavailable = await get_user_from_services(user_id)
+        makrcave_data = service_data.get("makrcave")
+        store_data = service_data.get("store")
         
         # Extract roles from token and services
         realm_roles = user_data.get("realm_access", {}).get("roles", [])
@@ -277,10 +387,11 @@ async def get_user_profile(user_data: Dict[str, Any] = Depends(verify_token)):
             preferences={
                 "theme": "system",
                 "notifications": True,
-                **store_data.get("preferences", {}) if store_data else {}
+                **(store_data.get("preferences", {}) if store_data else {})
             },
             created_at=datetime.utcnow(),
-            last_login=datetime.utcnow()
+            last_login=datetime.utcnow(),
+            unavailable_services=unavailable
         )
         
     except Exception as e:
@@ -296,15 +407,22 @@ async def sync_user_across_services(sync_request: UserSyncRequest, user_data: Di
         if "admin" not in roles and "super-admin" not in roles:
             raise HTTPException(status_code=403, detail="Insufficient permissions for user sync")
         
-        results = {}
+        services = [
+            service for service in ("makrcave", "store")
+            if sync_request.portal in ["all", service]
+        ]
         
-        # Sync to MakrCave
-        if sync_request.portal in ["all", "makrcave"]:
-            results["makrcave"] = await sync_user_to_service("makrcave", sync_request)
-            
-        # Sync to Store  
-        if sync_request.portal in ["all", "store"]:
-            results["store"] = await sync_user_to_service("store", sync_request)
+        # Sync to all selected services concurrently
+        outcomes = await asyncio.gather(*(
+            run_with_deadline(
+                sync_user_to_service(service, sync_request),
+                SYNC_DEADLINE,
+                {"success": False, "error": "timeout"}
+            )
+            for service in services
+        ))
+        results = {service: outcome for service, (outcome, _) in zip(services, outcomes)}
+        profile_cache.invalidate(sync_request.user_id)
         
         return {
             "message": "User sync completed",
@@ -335,30 +453,68 @@ async def generate_portal_token(user_id: str, portal: str) -> str:
         raise ValueError("JWT_SECRET environment variable is required")
     return jwt.encode(payload, secret, algorithm="HS256")
 
-async def get_user_from_service(service: str, user_id: str) -> Optional[Dict[str, Any]]:
-    """Fetch user data from specific service"""
+async def run_with_deadline(coro, deadline: float, default: Any = None) -> tuple[Any, bool]:
+    """
+    Await coro for at most deadline seconds; returns (result or default, completed).
+    A coro that raises counts as not completed, like one that timed out.
+    """
     try:
-        service_urls = {
-            "makrcave": f"{MAKRCAVE_API_URL}/api/v1/users/{user_id}",
-            "store": f"{STORE_API_URL}/users/{user_id}"
-        }
-        
-        if service not in service_urls:
-            return None
-            
-        url = service_urls[service]
-        async with http_client.get(url) as response:
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 404:
-                return None
-            else:
-                logger.warning(f"Failed to fetch user from {service}: {response.status_code}")
-                return None
-                
+        return await asyncio.wait_for(coro, timeout=deadline), True
+    except asyncio.TimeoutError:
+        return default, False
     except Exception as e:
-        logger.error(f"Error fetching user from {service}: {e}")
+        logger.warning(f"Service call failed: {e}")
+        return default, False
+
+async def get_user_from_services(user_id: str) -> tuple[Dict[str, Any], list[str]]:
+    """
+    Fetch a user's data from every service concurrently, each within its deadline.
+    Returns (data by service, services that timed out). Complete results are cached.
+    """
+    cached = profile_cache.get(user_id)
+    if cached is not None:
+        return cached, []
+    
+    services = list(SERVICE_DEADLINES)
+    outcomes = await asyncio.gather(*(
+        run_with_deadline(get_user_from_service(service, user_id), SERVICE_DEADLINES[service])
+        for service in services
+    ))
+    
+    data = {}
+    unavailable = []
+    for service, (result, completed) in zip(services, outcomes):
+        data[service] = result
+        if not completed:
+            logger.warning(f"Profile fetch from {service} failed or exceeded {SERVICE_DEADLINES[service]}s")
+            unavailable.append(service)
+    
+    # Only cache complete answers so a slow or failing service is retried on the next load
+    if not unavailable:
+        profile_cache.set(user_id, data)
+    return data, unavailable
+
+async def get_user_from_service(service: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Fetch user data from specific service. Returns None when the service has no
+    such user; raises on errors so the service is reported as unavailable.
+    """
+    service_urls = {
+        "makrcave": f"{MAKRCAVE_API_URL}/api/v1/users/{user_id}",
+        "store": f"{STORE_API_URL}/users/{user_id}"
+    }
+    
+    if service not in service_urls:
+        return None
+        
+    url = service_urls[service]
+    response = await http_client.get(url)
+    if response.status_code == 200:
+        return response.json()
+    elif response.status_code == 404:
         return None
+    else:
+        raise RuntimeError(f"Failed to fetch user from {service}: {response.status_code}")
 
 async def sync_user_to_service(service: str, sync_request: UserSyncRequest) -> Dict[str, Any]:
     """Sync user data to specific service"""
@@ -372,16 +528,29 @@ async def sync_user_to_service(service: str, sync_request: UserSyncRequest) -> D
             return {"success": False, "error": f"Unknown service: {service}"}
             
         url = service_urls[service]
-        async with http_client.post(url, json=sync_request.dict()) as response:
-            if response.status_code in [200, 201]:
-                return {"success": True, "data": response.json()}
-            else:
-                return {"success": False, "error": f"HTTP {response.status_code}"}
+        response = await http_client.post(url, json=sync_request.model_dump())
+        if response.status_code in [200, 201]:
+            return {"success": True, "data": response.json()}
+        else:
+            return {"success": False, "error": f"HTTP {response.status_code}"}
                 
     except Exception as e:
         logger.error(f"Error syncing user to {service}: {e}")
         return {"success": False, "error": str(e)}
 
+# Event receiver (called by the event-service for target "auth")
+@app.post("/events/receive")
+async def receive_event(event: Dict[str, Any], x_service_token: Optional[str] = Header(None)):
+    """Drop cached profile data when a user.* event arrives for that user"""
+    if not SERVICE_TOKEN or not x_service_token or not hmac.compare_digest(x_service_token, SERVICE_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid service token")
+    
+    event_type = event.get("type", "")
+    user_id = event.get("user_id") or event.get("payload", {}).get("user_id")
+    if event_type.startswith("user.") and user_id:
+        profile_cache.invalidate(user_id)
+    return {"message": "Event received"}
+
 # Portal Navigation Endpoints
 @app.get("/portals/makrcave/url")
 async def get_makrcave_url(user_data: Dict[str, Any] = Depends(verify_token)):
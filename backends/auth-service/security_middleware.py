@@ -4,46 +4,161 @@ Rate limiting, input validation, and security headers
 """
 
 import asyncio
+import html
+import json
+import math
 import time
-from collections import defaultdict
-from typing import Dict, Any
-from fastapi import Request, Response, HTTPException, status
-from fastapi.middleware.base import BaseHTTPMiddleware
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, NamedTuple, Optional
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.middleware.base import BaseHTTPMiddleware
 import logging
 
 logger = logging.getLogger(__name__)
 
+# SLIDING_WINDOW_SCRIPT, RateLimitResult and SlidingWindowLimiter are
+# deliberately duplicated in makrcave-backend/middleware/security.py (only the key prefix
+# differs): each service is built from its own directory, so there is no
+# shared module to import. Apply any fix to the script or window math to both.
+
+# Shared-state check: reads the previous and current window counts and
+# increments the current one only if the request is allowed.
+# KEYS: current window, previous window. ARGV: previous weight, limit, ttl.
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[1]) + current >= tonumber(ARGV[2]) then
+    return {0, current, previous}
+end
+current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return {1, current, previous}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # seconds until the next request would be allowed (0 if allowed)
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding-window counter per key.
+
+    Each key keeps only the counts of the current and previous fixed
+    windows; the previous count is weighted by how much of it still
+    overlaps the sliding window. That makes every check O(1) in time and
+    memory, and at most max_keys keys are tracked (least recently seen
+    keys are dropped first).
+
+    With a redis_url the counts live in Redis, so all workers share one
+    limit. If Redis is unreachable the worker falls back to its own counts.
+    """
+
+    def __init__(self, max_keys: int = 100000, redis_url: Optional[str] = None,
+                 prefix: str = "makrx:auth:ratelimit"):
+        self.max_keys = max_keys
+        self.prefix = prefix
+        # key -> [window index, previous window count, current window count]
+        self.windows: "OrderedDict[str, list]" = OrderedDict()
+        self.redis = None
+        if redis_url:
+            # Imported here so single-worker deployments don't need the redis package
+            import redis.asyncio as aioredis
+            self.redis = aioredis.from_url(redis_url)
+            self._script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+
+    @staticmethod
+    def _result(allowed: bool, previous: int, current: int, limit: int,
+                period: int, elapsed: float) -> RateLimitResult:
+        if allowed:
+            used = previous * (1 - elapsed / period) + current
+            return RateLimitResult(True, max(0, int(limit - used)), 0.0)
+
+        if current < limit:
+            # Wait until enough of the previous window has slid out
+            retry_after = period * (1 - (limit - current) / previous) - elapsed
+        else:
+            # Wait for the next window, where this window's count becomes the previous one
+            retry_after = period - elapsed + max(0.0, period * (1 - limit / current))
+        return RateLimitResult(False, 0, max(retry_after, 0.0))
+
+    def hit(self, key: str, limit: int, period: int, now: Optional[float] = None) -> RateLimitResult:
+        """Count a request for key against this worker's counts"""
+        now = time.time() if now is None else now
+        window = int(now // period)
+        entry = self.windows.get(key)
+        if entry is None:
+            entry = self.windows[key] = [window, 0, 0]
+            if len(self.windows) > self.max_keys:
+                self.windows.popitem(last=False)
+        else:
+            self.windows.move_to_end(key)
+            if entry[0] != window:
+                entry[1] = entry[2] if entry[0] == window - 1 else 0
+                entry[2] = 0
+                entry[0] = window
+
+        elapsed = now - window * period
+        allowed = entry[1] * (1 - elapsed / period) + entry[2] < limit
+        if allowed:
+            entry[2] += 1
+        return self._result(allowed, entry[1], entry[2], limit, period, elapsed)
+
+    async def acquire(self, key: str, limit: int, period: int) -> RateLimitResult:
+        """Count a request for key, against shared counts when Redis is configured"""
+        if self.redis is None:
+            return self.hit(key, limit, period)
+
+        now = time.time()
+        window = int(now // period)
+        elapsed = now - window * period
+        base = f"{self.prefix}:{{{key}}}"
+        try:
+            allowed, current, previous = await self._script(
+                keys=[f"{base}:{window}", f"{base}:{window - 1}"],
+                args=[1 - elapsed / period, limit, period * 2]
+            )
+        except Exception as e:
+            logger.warning(f"Shared rate limit unavailable, using local counts: {e}")
+            return self.hit(key, limit, period, now)
+        return self._result(bool(allowed), int(previous), int(current), limit, period, elapsed)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """Rate limiting middleware to prevent brute force attacks"""
     
-    def __init__(self, app, calls: int = 100, period: int = 3600):
+    def __init__(self, app, calls: int = 100, period: int = 3600,
+                 max_keys: int = 100000, redis_url: Optional[str] = None,
+                 limiter: Optional[SlidingWindowLimiter] = None):
         super().__init__(app)
         self.calls = calls
         self.period = period
-        self.clients = defaultdict(list)
+        # Pass a limiter in to close its Redis connection on shutdown
+        self.limiter = limiter or SlidingWindowLimiter(max_keys=max_keys, redis_url=redis_url)
         
     async def dispatch(self, request: Request, call_next):
         # Get client IP
-        client_ip = request.client.host
-        
-        # Clean old entries
-        now = time.time()
-        self.clients[client_ip] = [
-            call_time for call_time in self.clients[client_ip]
-            if now - call_time < self.period
-        ]
+        client_ip = request.client.host if request.client else "unknown"
         
         # Check rate limit
-        if len(self.clients[client_ip]) >= self.calls:
+        result = await self.limiter.acquire(client_ip, self.calls, self.period)
+        if not result.allowed:
             logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            raise HTTPException(
+            return JSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded. Please try again later."
+                content={"detail": "Rate limit exceeded. Please try again later."},
+                headers={"Retry-After": str(max(1, math.ceil(result.retry_after)))}
             )
         
-        # Record this call
-        self.clients[client_ip].append(now)
-        
         # Process request
         response = await call_next(request)
         return response
@@ -77,7 +192,6 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
 def sanitize_input(data: Any) -> Any:
     """Sanitize input data to prevent XSS"""
     if isinstance(data, str):
-        import html
         return html.escape(data.strip())
     elif isinstance(data, dict):
         return {key: sanitize_input(value) for key, value in data.items()}
@@ -85,31 +199,122 @@ def sanitize_input(data: Any) -> Any:
         return [sanitize_input(item) for item in data]
     return data
 
-class InputValidationMiddleware(BaseHTTPMiddleware):
-    """Validate and sanitize all input data"""
-    
-    async def dispatch(self, request: Request, call_next):
-        # Skip validation for GET requests and health checks
-        if request.method == "GET" or request.url.path == "/health":
-            return await call_next(request)
-        
-        # Read and validate request body if present
-        if hasattr(request, "json"):
+def _sanitize_in_place(container: Any, depth: int, max_depth: int) -> bool:
+    """Escape every string value of a parsed JSON object or array in place; returns whether anything changed"""
+    if depth > max_depth:
+        raise ValueError("JSON nested too deeply")
+    changed = False
+    items = container.items() if isinstance(container, dict) else enumerate(container)
+    for key, value in items:
+        if isinstance(value, str):
+            clean = html.escape(value.strip())
+            if clean != value:
+                container[key] = clean
+                changed = True
+        elif isinstance(value, (dict, list)):
+            changed = _sanitize_in_place(value, depth + 1, max_depth) or changed
+    return changed
+
+def sanitize_json_body(body: bytes, max_depth: int = 32) -> Optional[bytes]:
+    """
+    Sanitize a JSON request body in one parse and one walk. Returns the
+    re-encoded body, or None when nothing needed escaping (or the body is
+    not JSON) so the original bytes can be passed on untouched.
+    """
+    try:
+        data = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    except RecursionError:
+        raise ValueError("JSON nested too deeply")
+
+    if isinstance(data, str):
+        clean = html.escape(data.strip())
+        return json.dumps(clean).encode() if clean != data else None
+    if isinstance(data, (dict, list)) and _sanitize_in_place(data, 1, max_depth):
+        return json.dumps(data).encode()
+    return None
+
+class InputValidationMiddleware:
+    """
+    Validate and sanitize all input data.
+
+    Written as a plain ASGI middleware so the sanitized body is what the
+    route actually receives. Bodies over max_body_size are rejected while
+    they are read; JSON bodies are parsed once and only re-encoded when
+    sanitizing changed something. Paths in exempt_paths are passed through
+    untouched.
+    """
+
+    SKIP_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(self, app, max_body_size: int = 1048576, max_depth: int = 32,
+                 exempt_paths: Iterable[str] = ()):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.max_depth = max_depth
+        self.exempt_paths = {"/health", *exempt_paths}
+
+    async def __call__(self, scope, receive, send):
+        # Skip validation for safe methods, health checks and opted-out routes
+        if (
+            scope["type"] != "http"
+            or scope["method"] in self.SKIP_METHODS
+            or scope["path"] in self.exempt_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_length = headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            await self._reject(scope, receive, send, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+            return
+
+        # Read the body, giving up as soon as it passes the limit
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self.max_body_size:
+                await self._reject(scope, receive, send, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+                return
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if body and (not content_type or content_type == "application/json" or content_type.endswith("+json")):
             try:
-                body = await request.body()
-                if body:
-                    import json
-                    try:
-                        data = json.loads(body)
-                        sanitized_data = sanitize_input(data)
-                        
-                        # Replace request body with sanitized data
-                        request._body = json.dumps(sanitized_data).encode()
-                    except (json.JSONDecodeError, UnicodeDecodeError):
-                        # If JSON parsing fails, leave as-is
-                        pass
-            except Exception as e:
-                logger.error(f"Input validation error: {e}")
-        
-        response = await call_next(request)
-        return response
+                sanitized = sanitize_json_body(body, self.max_depth)
+            except ValueError as e:
+                await self._reject(scope, receive, send, status.HTTP_400_BAD_REQUEST, str(e))
+                return
+            if sanitized is not None:
+                body = sanitized
+                scope = dict(scope)
+                scope["headers"] = [
+                    (name, value) for name, value in scope["headers"] if name != b"content-length"
+                ] + [(b"content-length", str(len(body)).encode())]
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, replay_receive, send)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str):
+        logger.warning(f"Rejected request body for {scope['path']}: {detail}")
+        response = JSONResponse(status_code=status_code, content={"detail": detail})
+        await response(scope, receive, send)
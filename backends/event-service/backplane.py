@@ -0,0 +1,218 @@
+"""
+Cluster backplane for the MakrX Event Service
+
+Each worker process is a node holding its own WebSocket connections. The
+node that accepts an event runs its durable deliveries (services,
+webhooks) and publishes the event on the backplane; every node, itself
+included, receives it and fans it out to its local sockets. Webhook
+subscriptions and per-node statistics are shared through the backplane
+too, so any node can route events and report cluster-wide numbers.
+
+- LoopbackBackplane: in-process, for single-process deployments and tests
+- RedisStreamsBackplane: Redis Streams, for multiple workers and nodes
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Nodes that have not reported stats for this long are left out of cluster stats
+NODE_STATS_TTL = 30
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Backplane(ABC):
+    """Broadcast channel and shared state between event-service nodes"""
+
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or default_node_id()
+        self.handler: Optional[MessageHandler] = None
+
+    async def start(self, handler: MessageHandler):
+        """Start delivering every published message (from any node) to handler"""
+        self.handler = handler
+
+    async def stop(self):
+        pass
+
+    async def _dispatch(self, message: Dict[str, Any]):
+        try:
+            await self.handler(message)
+        except Exception as e:
+            logger.error(f"Backplane message handling failed: {e}")
+
+    @abstractmethod
+    async def publish(self, message: Dict[str, Any]):
+        """Send a message to all nodes"""
+
+    @abstractmethod
+    async def save_subscription(self, subscription_id: str, data: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    async def delete_subscription(self, subscription_id: str):
+        pass
+
+    @abstractmethod
+    async def load_subscriptions(self) -> Dict[str, Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def report_stats(self, stats: Dict[str, Any]):
+        """Publish this node's statistics"""
+
+    @abstractmethod
+    async def cluster_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Latest statistics of every live node, keyed by node id"""
+
+
+class LoopbackBackplane(Backplane):
+    """
+    In-process backplane. Instances sharing a bus behave like nodes of one
+    cluster, which lets tests run several nodes in one process.
+    """
+
+    class Bus:
+        def __init__(self):
+            self.nodes: List["LoopbackBackplane"] = []
+            self.subscriptions: Dict[str, Dict[str, Any]] = {}
+            self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def __init__(self, node_id: Optional[str] = None, bus: Optional["LoopbackBackplane.Bus"] = None):
+        super().__init__(node_id)
+        self.bus = bus or LoopbackBackplane.Bus()
+
+    async def start(self, handler: MessageHandler):
+        await super().start(handler)
+        self.bus.nodes.append(self)
+
+    async def stop(self):
+        if self in self.bus.nodes:
+            self.bus.nodes.remove(self)
+        self.bus.stats.pop(self.node_id, None)
+
+    async def publish(self, message: Dict[str, Any]):
+        for node in list(self.bus.nodes):
+            await node._dispatch(message)
+
+    async def save_subscription(self, subscription_id: str, data: Dict[str, Any]):
+        self.bus.subscriptions[subscription_id] = data
+
+    async def delete_subscription(self, subscription_id: str):
+        self.bus.subscriptions.pop(subscription_id, None)
+
+    async def load_subscriptions(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self.bus.subscriptions)
+
+    async def report_stats(self, stats: Dict[str, Any]):
+        self.bus.stats[self.node_id] = stats
+
+    async def cluster_stats(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self.bus.stats)
+
+
+class RedisStreamsBackplane(Backplane):
+    """
+    Redis Streams backplane. Every node reads the whole stream from the
+    moment it starts (no consumer group), since every node must fan out
+    every event to its own sockets. The stream is capped at max_length.
+    """
+
+    def __init__(self, redis_url: str, node_id: Optional[str] = None,
+                 prefix: str = "makrx:events", max_length: int = 10000):
+        super().__init__(node_id)
+        # Imported here so single-process deployments don't need the redis package
+        import redis.asyncio as aioredis
+        self.redis = aioredis.from_url(redis_url)
+        self.stream_key = f"{prefix}:stream"
+        self.subscriptions_key = f"{prefix}:subscriptions"
+        self.stats_key = f"{prefix}:nodes"
+        self.max_length = max_length
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, handler: MessageHandler):
+        await super().start(handler)
+        self._reader = asyncio.create_task(self._read_stream())
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        try:
+            await self.redis.hdel(self.stats_key, self.node_id)
+        except Exception as e:
+            logger.warning(f"Could not remove node stats on shutdown: {e}")
+        await self.redis.aclose()
+
+    async def _read_stream(self):
+        last_id = "$"
+        while True:
+            try:
+                response = await self.redis.xread(
+                    {self.stream_key: last_id}, count=500, block=5000
+                )
+                for _, entries in response or []:
+                    for entry_id, fields in entries:
+                        last_id = entry_id
+                        await self._dispatch(json.loads(fields[b"data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane stream read failed: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, message: Dict[str, Any]):
+        await self.redis.xadd(
+            self.stream_key,
+            {"data": json.dumps(message, separators=(",", ":"))},
+            maxlen=self.max_length,
+            approximate=True
+        )
+
+    async def save_subscription(self, subscription_id: str, data: Dict[str, Any]):
+        await self.redis.hset(self.subscriptions_key, subscription_id, json.dumps(data))
+
+    async def delete_subscription(self, subscription_id: str):
+        await self.redis.hdel(self.subscriptions_key, subscription_id)
+
+    async def load_subscriptions(self) -> Dict[str, Dict[str, Any]]:
+        stored = await self.redis.hgetall(self.subscriptions_key)
+        return {key.decode(): json.loads(value) for key, value in stored.items()}
+
+    async def report_stats(self, stats: Dict[str, Any]):
+        await self.redis.hset(
+            self.stats_key, self.node_id, json.dumps({**stats, "reported_at": time.time()})
+        )
+
+    async def cluster_stats(self) -> Dict[str, Dict[str, Any]]:
+        stored = await self.redis.hgetall(self.stats_key)
+        cutoff = time.time() - NODE_STATS_TTL
+        nodes = {}
+        for node_id, value in stored.items():
+            stats = json.loads(value)
+            if stats.get("reported_at", 0) >= cutoff:
+                nodes[node_id.decode()] = stats
+        return nodes
+
+
+def create_backplane(kind: str, redis_url: Optional[str] = None,
+                     node_id: Optional[str] = None) -> Backplane:
+    if kind == "redis":
+        if not redis_url:
+            raise ValueError("REDIS_URL is required for the redis backplane")
+        return RedisStreamsBackplane(redis_url, node_id=node_id)
+    if kind == "loopback":
+        return LoopbackBackplane(node_id=node_id)
+    raise ValueError(f"Unknown backplane: {kind}")
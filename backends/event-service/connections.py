@@ -0,0 +1,201 @@
+"""
+WebSocket connection registry for the MakrX Event Service
+
+Connections are indexed by subscribed event type and user, so routing an
+event only touches the sockets that should receive it. Broadcasting puts
+the pre-encoded frame on each target's bounded outbox; a sender task per
+connection drains it. A client whose outbox fills up or whose send stalls
+past the timeout is disconnected instead of holding up everyone else.
+
+Each connection picks a wire encoding when it connects: JSON text (the
+default), msgpack, or zlib-compressed JSON as binary frames. A message is
+encoded at most once per encoding, however many sockets receive it.
+"""
+
+import asyncio
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+from uuid import uuid4
+
+from fastapi import WebSocket
+
+try:
+    import msgpack
+except ImportError:  # msgpack framing is optional
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+Frame = Union[str, bytes]
+
+ENCODINGS = {"json", "json-deflate"} | ({"msgpack"} if msgpack else set())
+
+# Close code sent to evicted slow consumers ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class FrameSet:
+    """One message with its wire frames, each encoded on first use"""
+
+    __slots__ = ("message", "_frames")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._frames: Dict[str, Frame] = {}
+
+    def get(self, encoding: str) -> Frame:
+        frame = self._frames.get(encoding)
+        if frame is None:
+            if encoding == "msgpack":
+                frame = msgpack.packb(self.message)
+            elif encoding == "json-deflate":
+                frame = zlib.compress(self.get("json").encode(), 6)
+            else:
+                frame = json.dumps(self.message, separators=(",", ":"))
+            self._frames[encoding] = frame
+        return frame
+
+
+class ClientConnection:
+    """One accepted WebSocket with its subscriptions and outbound queue"""
+
+    __slots__ = (
+        "websocket", "user_id", "encoding", "connection_id", "connected_at",
+        "subscriptions", "outbox", "sender_task", "sent"
+    )
+
+    def __init__(self, websocket: WebSocket, user_id: Optional[str], encoding: str, outbox_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.encoding = encoding
+        self.connection_id = str(uuid4())
+        self.connected_at = datetime.utcnow()
+        self.subscriptions: Set[str] = set()
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=outbox_size)
+        self.sender_task: Optional[asyncio.Task] = None
+        self.sent = 0
+
+
+class ConnectionManager:
+    """Subscription index (event type -> user -> connections) with per-connection outboxes"""
+
+    def __init__(self, outbox_size: int = 256, send_timeout: float = 10.0):
+        self.outbox_size = outbox_size
+        self.send_timeout = send_timeout
+        self.connections: Dict[str, ClientConnection] = {}
+        self.index: Dict[str, Dict[Optional[str], Set[ClientConnection]]] = {}
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def connect(self, websocket: WebSocket, user_id: Optional[str], encoding: str = "json") -> ClientConnection:
+        """Register an accepted WebSocket and start its sender"""
+        connection = ClientConnection(websocket, user_id, encoding, self.outbox_size)
+        self.connections[connection.connection_id] = connection
+        connection.sender_task = asyncio.create_task(self._sender(connection))
+        return connection
+
+    def disconnect(self, connection: ClientConnection):
+        """Remove a connection from the registry and the subscription index"""
+        if self.connections.pop(connection.connection_id, None) is None:
+            return
+        self.unsubscribe(connection, list(connection.subscriptions))
+        if connection.sender_task and connection.sender_task is not asyncio.current_task():
+            connection.sender_task.cancel()
+
+    def subscribe(self, connection: ClientConnection, event_types: Iterable[str]):
+        for event_type in event_types:
+            connection.subscriptions.add(event_type)
+            users = self.index.setdefault(event_type, {})
+            users.setdefault(connection.user_id, set()).add(connection)
+
+    def unsubscribe(self, connection: ClientConnection, event_types: Iterable[str]):
+        for event_type in event_types:
+            connection.subscriptions.discard(event_type)
+            users = self.index.get(event_type)
+            if not users:
+                continue
+            targets = users.get(connection.user_id)
+            if targets is not None:
+                targets.discard(connection)
+                if not targets:
+                    del users[connection.user_id]
+            if not users:
+                del self.index[event_type]
+
+    def send(self, connection: ClientConnection, message: Union[FrameSet, Dict[str, Any]]) -> bool:
+        """Queue a message for one connection; evicts the connection if its outbox is full"""
+        if not isinstance(message, FrameSet):
+            message = FrameSet(message)
+        try:
+            connection.outbox.put_nowait(message.get(connection.encoding))
+            return True
+        except asyncio.QueueFull:
+            self._evict(connection, "outbox full")
+            return False
+
+    def broadcast(self, event_type: str, user_id: Optional[str], frames: FrameSet) -> int:
+        """
+        Queue a message for every connection subscribed to event_type,
+        restricted to user_id's connections when given. Returns the number queued.
+        """
+        users = self.index.get(event_type)
+        if not users:
+            return 0
+
+        if user_id is not None:
+            targets: List[ClientConnection] = list(users.get(user_id, ()))
+        else:
+            targets = [connection for connections in users.values() for connection in connections]
+
+        queued = 0
+        for connection in targets:
+            if self.send(connection, frames):
+                queued += 1
+        return queued
+
+    async def _sender(self, connection: ClientConnection):
+        websocket = connection.websocket
+        try:
+            while True:
+                frame = await connection.outbox.get()
+                if isinstance(frame, bytes):
+                    send = websocket.send_bytes(frame)
+                else:
+                    send = websocket.send_text(frame)
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+                connection.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self._evict(connection, f"send blocked for over {self.send_timeout:g}s")
+        except Exception as e:
+            logger.error(f"WebSocket send error for {connection.connection_id}: {e}")
+            self.disconnect(connection)
+
+    def _evict(self, connection: ClientConnection, reason: str):
+        if connection.connection_id not in self.connections:
+            return
+        logger.warning(f"Evicting slow WebSocket consumer {connection.connection_id}: {reason}")
+        self.evicted += 1
+        self.disconnect(connection)
+        asyncio.create_task(self._close(connection))
+
+    @staticmethod
+    async def _close(connection: ClientConnection):
+        try:
+            await connection.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self.connections),
+            "indexed_event_types": len(self.index),
+            "queued_frames": sum(c.outbox.qsize() for c in self.connections.values()),
+            "evicted_slow_consumers": self.evicted
+        }
@@ -0,0 +1,545 @@
+"""
+Durable event dispatcher for the MakrX Event Service
+
+Each event is split into one delivery per destination (WebSocket fan-out,
+target service, webhook subscription). Deliveries wait in per-destination
+queues and are sent by a shared pool of workers, with a concurrency cap
+per destination, so one slow webhook cannot stall real-time updates.
+Failed deliveries are rescheduled with exponential backoff on a timer
+instead of sleeping inside a worker.
+
+Every destination queue has one lane per priority and workers are handed
+out highest priority first, so critical events overtake queued low-value
+traffic. A full destination queue sheds its lowest-priority, oldest
+deliveries; critical deliveries are never shed.
+
+Accepted events and completed deliveries are appended to an on-disk log.
+On startup the log is replayed and unfinished deliveries are queued again.
+"""
+
+import asyncio
+import fcntl
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import IO, Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Handler for one destination kind: (destination target, item) -> None, raises on failure
+DeliveryHandler = Callable[[str, Any], Awaitable[None]]
+
+# Priority lanes: 0 is the most urgent
+PRIORITY_LANES = 4
+DEFAULT_PRIORITY = 2
+
+
+@dataclass
+class Delivery:
+    event_id: str
+    destination: str
+    item: Any
+    max_retries: int
+    priority: int = DEFAULT_PRIORITY
+    attempt: int = 0
+
+
+@dataclass
+class DestinationQueue:
+    name: str
+    handler: DeliveryHandler
+    concurrency: int
+    lanes: List[Deque[Delivery]] = field(
+        default_factory=lambda: [deque() for _ in range(PRIORITY_LANES)]
+    )
+    active: int = 0
+    delivered: int = 0
+    retried: int = 0
+    failed: int = 0
+    dropped: int = 0
+
+    @property
+    def target(self) -> str:
+        return self.name.split(":", 1)[1] if ":" in self.name else ""
+
+    @property
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    def push(self, delivery: Delivery):
+        self.lanes[delivery.priority].append(delivery)
+
+    def pop(self) -> Optional[Delivery]:
+        for lane in self.lanes:
+            if lane:
+                return lane.popleft()
+        return None
+
+
+class PrioritySlots:
+    """Counting semaphore whose waiters are woken lowest priority number first, then FIFO"""
+
+    def __init__(self, size: int):
+        self.free = size
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int):
+        # Released slots go straight to waiters, so free > 0 means nobody is waiting
+        if self.free > 0:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Handed a slot just as we were cancelled: pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+def node_log_path(path: str, node_id: str) -> str:
+    """Per-node log file: data/events.log -> data/events.<node>.log"""
+    root, ext = os.path.splitext(path)
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "-", node_id)
+    return f"{root}.{safe_id}{ext}"
+
+
+def claim_node_slot(path: str, name: str) -> Tuple[int, IO]:
+    """
+    Claim the lowest free worker slot for name by locking data/events.<name>-<slot>.lock.
+
+    The slot stays claimed while the returned file is open (the lock is
+    released when the process exits). Workers of one node therefore get
+    distinct slots, and a restarted worker takes a freed slot back and
+    replays the log its previous holder left behind, so the number of logs
+    never exceeds the number of concurrent workers.
+    """
+    root, _ = os.path.splitext(path)
+    directory = os.path.dirname(root)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "-", name)
+
+    slot = 0
+    while True:
+        lock_file = open(f"{root}.{safe_name}-{slot}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot, lock_file
+        except BlockingIOError:
+            lock_file.close()
+            slot += 1
+
+
+class EventLog:
+    """
+    Append-only JSON-lines log of accepted events and completed deliveries.
+    Compacted to the still-pending events once it grows past max_bytes.
+    """
+
+    def __init__(self, path: str, fsync: bool = False, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self._file = None
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def append(self, record: Dict[str, Any]):
+        self.append_many((record,))
+
+    def append_many(self, records: Iterable[Dict[str, Any]]):
+        """Append records with a single write and flush"""
+        self._file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    @property
+    def size(self) -> int:
+        return self._file.tell() if self._file else 0
+
+    def replay(self) -> List[Tuple[str, Dict[str, Any], List[str], int]]:
+        """(event id, event data, remaining destinations, max retries) for every unfinished event"""
+        if not os.path.exists(self.path):
+            return []
+
+        pending: Dict[str, Tuple[Dict[str, Any], Set[str], int]] = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves at most one torn line
+                    logger.warning("Skipping unreadable event log line")
+                    continue
+
+                if record["op"] == "enqueue":
+                    pending[record["id"]] = (
+                        record["event"], set(record["destinations"]), record["max_retries"]
+                    )
+                elif record["op"] == "ack" and record["id"] in pending:
+                    destinations = pending[record["id"]][1]
+                    destinations.discard(record["destination"])
+                    if not destinations:
+                        del pending[record["id"]]
+
+        return [(event_id, data, sorted(destinations), max_retries)
+                for event_id, (data, destinations, max_retries) in pending.items()]
+
+    def rewrite(self, records: Iterable[Dict[str, Any]]):
+        """Atomically replace the log with the given records"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.open()
+
+
+class EventDispatcher:
+    """
+    Worker pool delivering events to per-destination queues.
+
+    Destinations are named "<kind>:<target>" (e.g. "webhook:<subscription id>",
+    "service:store") or just "<kind>". Each kind registers a handler and a
+    per-destination concurrency limit.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        log: Optional[EventLog] = None,
+        retry_base_delay: float = 2.0,
+        retry_max_delay: float = 300.0,
+        dumps: Callable[[Any], Dict[str, Any]] = lambda item: item,
+        loads: Callable[[Dict[str, Any]], Any] = lambda data: data,
+        priority_of: Callable[[Any], int] = lambda item: DEFAULT_PRIORITY,
+        max_queued: Optional[int] = None
+    ):
+        self.workers = workers
+        self.log = log
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.dumps = dumps
+        self.loads = loads
+        self.priority_of = priority_of
+        # Per-destination queue bound; None means unbounded
+        self.max_queued = max_queued
+        self.handlers: Dict[str, Tuple[DeliveryHandler, int]] = {}
+        self.destinations: Dict[str, DestinationQueue] = {}
+        # event id -> (item, destinations not yet finished, max retries)
+        self.in_flight: Dict[str, Tuple[Any, Set[str], int]] = {}
+        self.scheduled_retries = 0
+        self._slots: Optional[PrioritySlots] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._retry_handles: Set[asyncio.TimerHandle] = set()
+        self._stopping = False
+
+    def register(self, kind: str, handler: DeliveryHandler, concurrency: int = 1):
+        """Register the handler for a destination kind"""
+        self.handlers[kind] = (handler, concurrency)
+
+    async def start(self):
+        """Open the log and queue everything left unfinished by the previous run"""
+        self._slots = PrioritySlots(self.workers)
+        if not self.log:
+            return
+
+        recovered = await asyncio.to_thread(self.log.replay)
+        self.log.open()
+        # Start the new log from just the recovered events
+        self.log.rewrite(
+            self._enqueue_record(event_id, data, destinations, max_retries)
+            for event_id, data, destinations, max_retries in recovered
+        )
+        for event_id, data, destinations, max_retries in recovered:
+            self._enqueue(event_id, self.loads(data), destinations, max_retries)
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} undelivered events from {self.log.path}")
+
+    async def stop(self):
+        """Cancel outstanding work; unfinished deliveries stay in the log for the next start"""
+        self._stopping = True
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.log:
+            self.log.close()
+
+    def submit(self, event_id: str, item: Any, destinations: List[str], max_retries: int = 3):
+        """Durably accept an event for delivery to the given destinations"""
+        self.submit_many([(event_id, item, destinations, max_retries)])
+
+    def submit_many(self, entries: List[Tuple[str, Any, List[str], int]]):
+        """Accept a batch of (event id, item, destinations, max retries) with one log write"""
+        entries = [entry for entry in entries if entry[2]]
+        if not entries:
+            return
+        if self.log:
+            self.log.append_many(
+                self._enqueue_record(event_id, self.dumps(item), destinations, max_retries)
+                for event_id, item, destinations, max_retries in entries
+            )
+            if self.log.size > self.log.max_bytes:
+                self._compact()
+        for event_id, item, destinations, max_retries in entries:
+            self._enqueue(event_id, item, destinations, max_retries)
+
+    @staticmethod
+    def _enqueue_record(event_id: str, data: Dict[str, Any], destinations: List[str],
+                        max_retries: int) -> Dict[str, Any]:
+        return {
+            "op": "enqueue",
+            "id": event_id,
+            "event": data,
+            "destinations": list(destinations),
+            "max_retries": max_retries
+        }
+
+    def _enqueue(self, event_id: str, item: Any, destinations: List[str], max_retries: int):
+        self.in_flight[event_id] = (item, set(destinations), max_retries)
+        priority = self.priority_of(item)
+        for name in destinations:
+            queue = self._get_destination(name)
+            if queue is None:
+                self._finish(event_id, name)
+                continue
+            delivery = Delivery(event_id, name, item, max_retries, priority)
+            if self.max_queued is not None and queue.queued >= self.max_queued:
+                if not self._shed(queue, delivery):
+                    continue
+            queue.push(delivery)
+            self._pump(queue)
+
+    def _shed(self, queue: DestinationQueue, incoming: Delivery) -> bool:
+        """
+        Make room in a full queue by dropping the oldest delivery of the lowest
+        non-critical lane no more urgent than the incoming one. Returns False
+        if the incoming delivery itself is dropped.
+        """
+        for priority in range(PRIORITY_LANES - 1, 0, -1):
+            if priority < incoming.priority:
+                break
+            if queue.lanes[priority]:
+                victim = queue.lanes[priority].popleft()
+                self._drop(queue, victim)
+                return True
+        if incoming.priority == 0:
+            return True  # Critical deliveries may exceed the bound
+        self._drop(queue, incoming)
+        return False
+
+    def _drop(self, queue: DestinationQueue, delivery: Delivery):
+        queue.dropped += 1
+        logger.warning(f"Queue for {queue.name} is full, dropping {delivery.event_id}")
+        self._finish(delivery.event_id, delivery.destination)
+
+    def _get_destination(self, name: str) -> Optional[DestinationQueue]:
+        queue = self.destinations.get(name)
+        if queue is None:
+            kind = name.split(":", 1)[0]
+            if kind not in self.handlers:
+                logger.error(f"No handler registered for destination {name}")
+                return None
+            handler, concurrency = self.handlers[kind]
+            queue = self.destinations[name] = DestinationQueue(name, handler, concurrency)
+        return queue
+
+    def _pump(self, queue: DestinationQueue):
+        """Start deliveries for a destination up to its concurrency limit"""
+        while queue.active < queue.concurrency and not self._stopping:
+            delivery = queue.pop()
+            if delivery is None:
+                break
+            queue.active += 1
+            task = asyncio.create_task(self._deliver(queue, delivery))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, queue: DestinationQueue, delivery: Delivery):
+        try:
+            await self._slots.acquire(delivery.priority)
+            try:
+                await queue.handler(queue.target, delivery.item)
+            finally:
+                self._slots.release()
+            queue.delivered += 1
+            self._finish(delivery.event_id, delivery.destination)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if delivery.attempt < delivery.max_retries:
+                delivery.attempt += 1
+                queue.retried += 1
+                delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (delivery.attempt - 1))
+                logger.warning(
+                    f"Delivery of {delivery.event_id} to {delivery.destination} failed "
+                    f"(attempt {delivery.attempt}/{delivery.max_retries}), retrying in {delay:g}s: {e}"
+                )
+                self._schedule_retry(queue, delivery, delay)
+            else:
+                queue.failed += 1
+                logger.error(f"Giving up on {delivery.event_id} for {delivery.destination}: {e}")
+                self._finish(delivery.event_id, delivery.destination)
+        finally:
+            queue.active -= 1
+            self._pump(queue)
+
+    def _schedule_retry(self, queue: DestinationQueue, delivery: Delivery, delay: float):
+        loop = asyncio.get_running_loop()
+        handle = None
+
+        def requeue():
+            self._retry_handles.discard(handle)
+            self.scheduled_retries -= 1
+            queue.push(delivery)
+            self._pump(queue)
+
+        handle = loop.call_later(delay, requeue)
+        self._retry_handles.add(handle)
+        self.scheduled_retries += 1
+
+    def _finish(self, event_id: str, destination: str):
+        if self.log:
+            self.log.append({"op": "ack", "id": event_id, "destination": destination})
+        entry = self.in_flight.get(event_id)
+        if entry is not None:
+            entry[1].discard(destination)
+            if not entry[1]:
+                del self.in_flight[event_id]
+
+    def _compact(self):
+        started = time.monotonic()
+        self.log.rewrite(
+            self._enqueue_record(event_id, self.dumps(item), sorted(destinations), max_retries)
+            for event_id, (item, destinations, max_retries) in self.in_flight.items()
+        )
+        logger.info(
+            f"Compacted event log to {len(self.in_flight)} pending events "
+            f"in {(time.monotonic() - started) * 1000:.1f}ms"
+        )
+
+    @property
+    def pending_deliveries(self) -> int:
+        return sum(queue.queued + queue.active for queue in self.destinations.values()) \
+            + self.scheduled_retries
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pending_events": len(self.in_flight),
+            "pending_deliveries": self.pending_deliveries,
+            "scheduled_retries": self.scheduled_retries,
+            "waiting_for_worker": self._slots.waiting if self._slots else 0,
+            "dropped": sum(queue.dropped for queue in self.destinations.values()),
+            "log_bytes": self.log.size if self.log else 0,
+            "destinations": {
+                name: {
+                    "queued": queue.queued,
+                    "queued_by_priority": [len(lane) for lane in queue.lanes],
+                    "active": queue.active,
+                    "delivered": queue.delivered,
+                    "retried": queue.retried,
+                    "failed": queue.failed,
+                    "dropped": queue.dropped
+                }
+                for name, queue in self.destinations.items()
+            }
+        }
+
+
+class EventCoalescer:
+    """
+    Holds high-frequency events for a short window and keeps only the latest
+    per key; the survivors are passed to flush as one batch when the window
+    ends. Held events are not logged until they are flushed.
+
+    Any non-coalescible event with the same key flushes the held one first,
+    so e.g. a progress update can never arrive after the job's completion.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        key_of: Callable[[Any], Optional[str]],
+        coalescible: Callable[[Any], bool],
+        flush: Callable[[List[Any]], None]
+    ):
+        self.window = window
+        self.key_of = key_of
+        self.coalescible = coalescible
+        self.flush_callback = flush
+        self.held: Dict[str, Any] = {}
+        self.coalesced = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, items: Iterable[Any]) -> List[Any]:
+        """Hold what can be coalesced; returns the items to submit now, in order"""
+        ready = []
+        for item in items:
+            key = self.key_of(item) if self.window > 0 else None
+            if key is None:
+                ready.append(item)
+            elif self.coalescible(item):
+                if key in self.held:
+                    self.coalesced += 1
+                self.held[key] = item
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+            else:
+                if key in self.held:
+                    ready.append(self.held.pop(key))
+                ready.append(item)
+        return ready
+
+    def flush(self):
+        self._timer = None
+        if self.held:
+            items = list(self.held.values())
+            self.held.clear()
+            self.flush_callback(items)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": round(self.window * 1000),
+            "held": len(self.held),
+            "coalesced": self.coalesced
+        }
@@ -12,12 +12,17 @@ import logging
 from typing import Dict, List, Any, Optional, Set
 from datetime import datetime
 from uuid import uuid4
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from enum import Enum
 import httpx
 import os
+import socket
 from contextlib import asynccontextmanager
 
+from backplane import create_backplane
+from connections import ENCODINGS, ConnectionManager, FrameSet
+from dispatcher import EventCoalescer, EventDispatcher, EventLog, claim_node_slot, node_log_path
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,6 +31,34 @@ logger = logging.getLogger(__name__)
 MAKRCAVE_API_URL = os.getenv("MAKRCAVE_API_URL", "http://makrcave-backend:8000")
 STORE_API_URL = os.getenv("STORE_API_URL", "http://makrx-store-backend:8000")
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000")
+# Shared secret sent to services on /events/receive
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "")
+
+# Dispatcher configuration
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "32"))
+EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH", "data/events.log")
+EVENT_LOG_FSYNC = os.getenv("EVENT_LOG_FSYNC", "false").lower() == "true"
+RETRY_DELAY_SECONDS = float(os.getenv("RETRY_DELAY_SECONDS", "2"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+SERVICE_CONCURRENCY = int(os.getenv("SERVICE_CONCURRENCY", "8"))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "4"))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "10000"))
+# Job progress updates within this window are collapsed to the latest per job (0 disables)
+COALESCE_WINDOW_MS = float(os.getenv("COALESCE_WINDOW_MS", "250"))
+
+# WebSocket fan-out
+WS_OUTBOX_SIZE = int(os.getenv("WS_OUTBOX_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+# Cluster backplane: "loopback" (single process) or "redis" (Redis Streams)
+EVENT_BACKPLANE = os.getenv("EVENT_BACKPLANE", "loopback")
+REDIS_URL = os.getenv("REDIS_URL")
+# Name of this host's workers (defaults to the hostname); each worker adds a slot number
+EVENT_NODE_ID = os.getenv("EVENT_NODE_ID") or socket.gethostname()
+STATS_REPORT_INTERVAL = float(os.getenv("STATS_REPORT_INTERVAL", "5"))
+
+# Largest accepted /events/publish/batch request
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
 
 # Event Types
 class EventType(str, Enum):
@@ -78,6 +111,14 @@ class EventPriority(str, Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+# Dispatcher lane per priority (0 is served first)
+PRIORITY_LANES = {
+    EventPriority.CRITICAL: 0,
+    EventPriority.HIGH: 1,
+    EventPriority.NORMAL: 2,
+    EventPriority.LOW: 3
+}
+
 # Pydantic Models
 class Event(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid4()))
@@ -90,13 +131,46 @@ class Event(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     retry_count: int = 0
     max_retries: int = 3
-
-class WebSocketConnection(BaseModel):
-    websocket: WebSocket
-    user_id: Optional[str] = None
-    subscriptions: Set[EventType] = Field(default_factory=set)
-    connection_id: str = Field(default_factory=lambda: str(uuid4()))
-    connected_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    # Encoded forms, built once and shared by every destination
+    _encoded: Dict[str, Any] = PrivateAttr(default_factory=dict)
+    
+    def as_data(self) -> Dict[str, Any]:
+        """JSON-compatible dict of the whole event (log, services)"""
+        if "data" not in self._encoded:
+            self._encoded["data"] = self.model_dump(mode="json")
+        return self._encoded["data"]
+    
+    def as_json(self) -> bytes:
+        if "json" not in self._encoded:
+            self._encoded["json"] = json.dumps(self.as_data(), separators=(",", ":")).encode()
+        return self._encoded["json"]
+    
+    def websocket_message(self) -> Dict[str, Any]:
+        if "websocket" not in self._encoded:
+            self._encoded["websocket"] = {
+                "type": "event",
+                "event_type": self.type.value,
+                "event_id": self.id,
+                "source": self.source_service,
+                "payload": self.payload,
+                "timestamp": self.timestamp.isoformat()
+            }
+        return self._encoded["websocket"]
+    
+    def webhook_body(self) -> bytes:
+        if "webhook" not in self._encoded:
+            self._encoded["webhook"] = json.dumps({
+                "event_id": self.id,
+                "event_type": self.type.value,
+                "source_service": self.source_service,
+                "timestamp": self.timestamp.isoformat(),
+                "payload": self.payload
+            }, separators=(",", ":")).encode()
+        return self._encoded["webhook"]
+
+class EventBatch(BaseModel):
+    events: List[Event] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
 
 class EventSubscription(BaseModel):
     user_id: Optional[str] = None
@@ -105,22 +179,52 @@ class EventSubscription(BaseModel):
     filters: Dict[str, Any] = Field(default_factory=dict)
 
 # Global state
-active_connections: Dict[str, WebSocketConnection] = {}
+connection_manager = ConnectionManager(outbox_size=WS_OUTBOX_SIZE, send_timeout=WS_SEND_TIMEOUT)
 event_subscriptions: Dict[str, EventSubscription] = {}
-event_queue: asyncio.Queue = asyncio.Queue()
 http_client: Optional[httpx.AsyncClient] = None
 
+# Shares events, subscriptions and stats with the other event-service nodes
+# Stable per-worker id: the lowest free slot, held until this process exits,
+# so a restarted worker reuses a slot and replays that slot's event log
+node_slot, node_slot_lock = claim_node_slot(EVENT_LOG_PATH, EVENT_NODE_ID)
+backplane = create_backplane(EVENT_BACKPLANE, REDIS_URL, node_id=f"{EVENT_NODE_ID}-{node_slot}")
+
+# Durable delivery of events to WebSockets, services and webhooks
+dispatcher = EventDispatcher(
+    workers=EVENT_WORKERS,
+    # Each node replays and compacts only its own log
+    log=EventLog(node_log_path(EVENT_LOG_PATH, backplane.node_id), fsync=EVENT_LOG_FSYNC),
+    retry_base_delay=RETRY_DELAY_SECONDS,
+    dumps=lambda event: event.as_data(),
+    loads=lambda data: Event.model_validate(data),
+    priority_of=lambda event: PRIORITY_LANES[event.priority],
+    max_queued=MAX_QUEUE_SIZE
+)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global http_client
     http_client = httpx.AsyncClient(timeout=30.0)
     
-    # Start event processor
-    asyncio.create_task(process_event_queue())
+    # WebSocket fan-out stays ordered; remote destinations each get their own lane
+    dispatcher.register("websocket", deliver_to_websockets, concurrency=1)
+    dispatcher.register("service", deliver_to_service, concurrency=SERVICE_CONCURRENCY)
+    dispatcher.register("webhook", deliver_to_webhook, concurrency=WEBHOOK_CONCURRENCY)
+    
+    for subscription_id, data in (await backplane.load_subscriptions()).items():
+        event_subscriptions[subscription_id] = EventSubscription.model_validate(data)
+    await backplane.start(handle_backplane_message)
+    stats_task = asyncio.create_task(report_node_stats())
+    await dispatcher.start()
     
-    logger.info("Event Service started")
+    logger.info(f"Event Service started (node {backplane.node_id}, {EVENT_BACKPLANE} backplane)")
     yield
     
+    stats_task.cancel()
+    # Log held progress updates so they survive the restart
+    coalescer.flush()
+    await dispatcher.stop()
+    await backplane.stop()
     await http_client.aclose()
     logger.info("Event Service shutdown")
 
@@ -183,22 +287,24 @@ async def health_check():
         "status": "healthy",
         "service": "makrx-event-service",
         "timestamp": datetime.utcnow().isoformat(),
-        "active_connections": len(active_connections),
-        "pending_events": event_queue.qsize()
+        "active_connections": len(connection_manager),
+        "pending_events": len(dispatcher.in_flight)
     }
 
 # WebSocket Connection Management
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    """WebSocket endpoint for real-time updates"""
-    await websocket.accept()
+async def websocket_endpoint(websocket: WebSocket, user_id: str, encoding: str = "json"):
+    """
+    WebSocket endpoint for real-time updates.
+    ?encoding=msgpack or ?encoding=json-deflate switches server frames to binary.
+    """
+    if encoding not in ENCODINGS:
+        await websocket.close(code=1003, reason=f"Unsupported encoding: {encoding}")
+        return
     
-    connection = WebSocketConnection(
-        websocket=websocket,
-        user_id=user_id
-    )
+    await websocket.accept()
     
-    active_connections[connection.connection_id] = connection
+    connection = connection_manager.connect(websocket, user_id, encoding)
     logger.info(f"WebSocket connected: {user_id} ({connection.connection_id})")
     
     try:
@@ -207,36 +313,35 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             data = await websocket.receive_text()
             message = json.loads(data)
             
+            # Replies go through the outbox so they never race event frames on the socket
             if message.get("type") == "subscribe":
                 event_types = message.get("event_types", [])
-                connection.subscriptions.update(EventType(et) for et in event_types)
+                connection_manager.subscribe(connection, (EventType(et) for et in event_types))
                 logger.info(f"User {user_id} subscribed to: {event_types}")
                 
-                await websocket.send_text(json.dumps({
+                connection_manager.send(connection, {
                     "type": "subscription_confirmed",
-                    "event_types": list(connection.subscriptions),
+                    "event_types": [et.value for et in connection.subscriptions],
                     "timestamp": datetime.utcnow().isoformat()
-                }))
+                })
             
             elif message.get("type") == "unsubscribe":
                 event_types = message.get("event_types", [])
-                for et in event_types:
-                    connection.subscriptions.discard(EventType(et))
+                connection_manager.unsubscribe(connection, (EventType(et) for et in event_types))
                 logger.info(f"User {user_id} unsubscribed from: {event_types}")
                 
-                await websocket.send_text(json.dumps({
+                connection_manager.send(connection, {
                     "type": "unsubscription_confirmed",
                     "event_types": event_types,
                     "timestamp": datetime.utcnow().isoformat()
-                }))
+                })
             
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected: {user_id} ({connection.connection_id})")
     except Exception as e:
         logger.error(f"WebSocket error for {user_id}: {e}")
     finally:
-        if connection.connection_id in active_connections:
-            del active_connections[connection.connection_id]
+        connection_manager.disconnect(connection)
 
 # Event Publishing
 @app.post("/events/publish")
@@ -244,7 +349,7 @@ async def publish_event(event: Event, background_tasks: BackgroundTasks):
     """Publish an event to the system"""
     try:
         # Add to processing queue
-        await event_queue.put(event)
+        enqueue_event(event)
         
         logger.info(f"Event published: {event.type} from {event.source_service}")
         
@@ -258,133 +363,123 @@ async def publish_event(event: Event, background_tasks: BackgroundTasks):
         logger.error(f"Event publishing error: {e}")
         raise HTTPException(status_code=500, detail="Failed to publish event")
 
-# Event Processing
-async def process_event_queue():
-    """Background task to process events from queue"""
-    logger.info("Event processor started")
-    
-    while True:
-        try:
-            # Get event from queue
-            event = await event_queue.get()
-            
-            # Process event
-            await process_event(event)
-            
-            # Mark task as done
-            event_queue.task_done()
-            
-        except Exception as e:
-            logger.error(f"Event processing error: {e}")
-            await asyncio.sleep(1)  # Brief pause on error
-
-async def process_event(event: Event):
-    """Process a single event"""
+@app.post("/events/publish/batch")
+async def publish_event_batch(batch: EventBatch):
+    """Publish many events in one request; they are logged with a single write"""
     try:
-        # Send to WebSocket subscribers
-        await broadcast_to_websockets(event)
-        
-        # Send to target services
-        await send_to_services(event)
+        enqueue_events(batch.events)
         
-        # Send webhook notifications
-        await send_webhook_notifications(event)
+        logger.info(f"Event batch published: {len(batch.events)} events")
         
-        logger.info(f"Processed event: {event.type} ({event.id})")
+        return {
+            "success": True,
+            "accepted": len(batch.events),
+            "event_ids": [event.id for event in batch.events]
+        }
         
     except Exception as e:
-        logger.error(f"Error processing event {event.id}: {e}")
-        
-        # Retry logic
-        if event.retry_count < event.max_retries:
-            event.retry_count += 1
-            await asyncio.sleep(2 ** event.retry_count)  # Exponential backoff
-            await event_queue.put(event)
-
-async def broadcast_to_websockets(event: Event):
-    """Broadcast event to WebSocket connections"""
-    if not active_connections:
-        return
-    
-    # Prepare WebSocket message
-    message = {
-        "type": "event",
-        "event_type": event.type.value,
-        "event_id": event.id,
-        "source": event.source_service,
-        "payload": event.payload,
-        "timestamp": event.timestamp.isoformat()
-    }
+        logger.error(f"Event batch publishing error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to publish events")
+
+# Event Processing
+def resolve_destinations(event: Event) -> List[str]:
+    """Dispatcher destinations for an event: WebSockets, target services, matching webhooks"""
+    destinations = ["websocket"]
     
-    message_json = json.dumps(message)
-    disconnected_connections = []
+    for service in event.target_services:
+        if get_service_url(service):
+            destinations.append(f"service:{service}")
+        else:
+            logger.warning(f"Unknown target service {service} for event {event.id}")
     
-    # Send to all subscribed connections
-    for connection_id, connection in active_connections.items():
-        try:
-            # Check if user is subscribed to this event type
-            if event.type in connection.subscriptions:
-                # Check if event is for this user or is a global event
-                if (event.user_id is None or 
-                    event.user_id == connection.user_id):
-                    
-                    await connection.websocket.send_text(message_json)
-                    
-        except Exception as e:
-            logger.error(f"WebSocket send error for {connection_id}: {e}")
-            disconnected_connections.append(connection_id)
+    for subscription_id, subscription in event_subscriptions.items():
+        if (event.type in subscription.event_types and
+            subscription.webhook_url and
+            event_matches_filters(event, subscription.filters)):
+            destinations.append(f"webhook:{subscription_id}")
     
-    # Clean up disconnected connections
-    for connection_id in disconnected_connections:
-        if connection_id in active_connections:
-            del active_connections[connection_id]
+    return destinations
+
+def job_key(event: Event) -> Optional[str]:
+    """Coalescing/ordering key: the job an event is about"""
+    job_id = event.payload.get("job_id")
+    return f"job:{job_id}" if job_id is not None else None
+
+def submit_events(events: List[Event]):
+    """Hand events to the dispatcher; they are logged before this returns"""
+    dispatcher.submit_many([
+        (event.id, event, resolve_destinations(event), event.max_retries) for event in events
+    ])
+
+# Keeps only the latest JOB_PROGRESS_UPDATE per job within the window
+coalescer = EventCoalescer(
+    window=COALESCE_WINDOW_MS / 1000,
+    key_of=job_key,
+    coalescible=lambda event: event.type == EventType.JOB_PROGRESS_UPDATE,
+    flush=submit_events
+)
 
-async def send_to_services(event: Event):
-    """Send event to target services"""
-    if not event.target_services:
+def enqueue_event(event: Event):
+    enqueue_events([event])
+
+def enqueue_events(events: List[Event]):
+    """Accept events; progress updates may be held briefly for coalescing"""
+    submit_events(coalescer.add(events))
+
+async def deliver_to_websockets(_: str, event: Event):
+    """Publish on the backplane; every node then fans out to its own sockets"""
+    await backplane.publish({
+        "kind": "event",
+        "event_type": event.type.value,
+        "user_id": event.user_id,
+        "message": event.websocket_message()
+    })
+    logger.info(f"Processed event: {event.type} ({event.id})")
+
+async def handle_backplane_message(message: Dict[str, Any]):
+    """Apply a message published by any node, including this one"""
+    kind = message.get("kind")
+    if kind == "event":
+        broadcast_to_websockets(message["event_type"], message["user_id"], message["message"])
+    elif kind == "subscription_created":
+        event_subscriptions[message["subscription_id"]] = EventSubscription.model_validate(
+            message["subscription"]
+        )
+    elif kind == "subscription_deleted":
+        event_subscriptions.pop(message["subscription_id"], None)
+
+def broadcast_to_websockets(event_type: str, user_id: Optional[str], message: Dict[str, Any]):
+    """Queue a message for every subscribed local WebSocket via the subscription index"""
+    if not connection_manager.index:
         return
     
-    for service in event.target_services:
-        try:
-            service_url = get_service_url(service)
-            if service_url:
-                async with http_client.post(
-                    f"{service_url}/events/receive",
-                    json=event.dict(),
-                    timeout=10.0
-                ) as response:
-                    if response.status_code != 200:
-                        logger.warning(f"Service {service} returned {response.status_code}")
-                        
-        except Exception as e:
-            logger.error(f"Error sending event to service {service}: {e}")
+    # Each wire encoding is produced once for all recipients
+    connection_manager.broadcast(event_type, user_id, FrameSet(message))
+
+async def deliver_to_service(service: str, event: Event):
+    """Send event to a target service; raises so the dispatcher retries"""
+    response = await http_client.post(
+        f"{get_service_url(service)}/events/receive",
+        content=event.as_json(),
+        headers={"Content-Type": "application/json", "X-Service-Token": SERVICE_TOKEN},
+        timeout=10.0
+    )
+    response.raise_for_status()
 
-async def send_webhook_notifications(event: Event):
-    """Send webhook notifications for subscribed events"""
-    for subscription in event_subscriptions.values():
-        try:
-            if (event.type in subscription.event_types and
-                subscription.webhook_url and
-                event_matches_filters(event, subscription.filters)):
-                
-                webhook_payload = {
-                    "event_id": event.id,
-                    "event_type": event.type.value,
-                    "source_service": event.source_service,
-                    "timestamp": event.timestamp.isoformat(),
-                    "payload": event.payload
-                }
-                
-                async with http_client.post(
-                    subscription.webhook_url,
-                    json=webhook_payload,
-                    timeout=10.0
-                ) as response:
-                    if response.status_code not in [200, 202]:
-                        logger.warning(f"Webhook {subscription.webhook_url} returned {response.status_code}")
-                        
-        except Exception as e:
-            logger.error(f"Webhook notification error: {e}")
+async def deliver_to_webhook(subscription_id: str, event: Event):
+    """Send a webhook notification; raises so the dispatcher retries"""
+    subscription = event_subscriptions.get(subscription_id)
+    if not subscription or not subscription.webhook_url:
+        return  # Subscription was deleted after the event was queued
+    
+    response = await http_client.post(
+        subscription.webhook_url,
+        content=event.webhook_body(),
+        headers={"Content-Type": "application/json"},
+        timeout=WEBHOOK_TIMEOUT
+    )
+    if response.status_code not in [200, 202]:
+        raise RuntimeError(f"Webhook {subscription.webhook_url} returned {response.status_code}")
 
 def get_service_url(service: str) -> Optional[str]:
     """Get service URL for event delivery"""
@@ -414,6 +509,14 @@ async def create_subscription(subscription: EventSubscription):
     subscription_id = str(uuid4())
     event_subscriptions[subscription_id] = subscription
     
+    data = subscription.model_dump(mode="json")
+    await backplane.save_subscription(subscription_id, data)
+    await backplane.publish({
+        "kind": "subscription_created",
+        "subscription_id": subscription_id,
+        "subscription": data
+    })
+    
     logger.info(f"Created subscription {subscription_id} for events: {subscription.event_types}")
     
     return {
@@ -427,6 +530,8 @@ async def delete_subscription(subscription_id: str):
     """Delete event subscription"""
     if subscription_id in event_subscriptions:
         del event_subscriptions[subscription_id]
+        await backplane.delete_subscription(subscription_id)
+        await backplane.publish({"kind": "subscription_deleted", "subscription_id": subscription_id})
         logger.info(f"Deleted subscription {subscription_id}")
         return {"message": "Subscription deleted"}
     else:
@@ -453,7 +558,7 @@ async def publish_order_update(
         }
     )
     
-    await event_queue.put(event)
+    enqueue_event(event)
     return {"message": "Order update event published"}
 
 @app.post("/events/job-status")
@@ -480,7 +585,7 @@ async def publish_job_status(
         }
     )
     
-    await event_queue.put(event)
+    enqueue_event(event)
     return {"message": "Job status event published"}
 
 @app.post("/events/bom-export")
@@ -503,7 +608,7 @@ async def publish_bom_export(
         }
     )
     
-    await event_queue.put(event)
+    enqueue_event(event)
     return {"message": "BOM export event published"}
 
 # Event receiver for services
@@ -512,19 +617,51 @@ async def receive_event(event: Event):
     """Receive event from another service"""
     logger.info(f"Received event: {event.type} from {event.source_service}")
     
-    # Process the received event
-    await process_event(event)
+    # Queue the received event for local delivery
+    enqueue_event(event)
     
-    return {"message": "Event received and processed"}
+    return {"message": "Event received and queued"}
 
 # Statistics
+def collect_node_stats() -> Dict[str, Any]:
+    """Statistics for this node only"""
+    return {
+        "active_connections": len(connection_manager),
+        "pending_events": len(dispatcher.in_flight),
+        "queue_depth": dispatcher.pending_deliveries,
+        "dropped": sum(queue.dropped for queue in dispatcher.destinations.values()),
+        "coalescer": coalescer.get_stats(),
+        "websockets": connection_manager.get_stats(),
+        "dispatcher": dispatcher.get_stats()
+    }
+
+async def report_node_stats():
+    """Periodically share this node's statistics on the backplane"""
+    while True:
+        try:
+            await backplane.report_stats(collect_node_stats())
+        except Exception as e:
+            logger.error(f"Failed to report node stats: {e}")
+        await asyncio.sleep(STATS_REPORT_INTERVAL)
+
 @app.get("/stats")
 async def get_event_stats():
-    """Get event service statistics"""
+    """Get event service statistics, aggregated across all nodes"""
+    node_stats = collect_node_stats()
+    await backplane.report_stats(node_stats)
+    nodes = await backplane.cluster_stats()
+    
     return {
-        "active_connections": len(active_connections),
-        "pending_events": event_queue.qsize(),
+        "node_id": backplane.node_id,
+        "nodes": len(nodes),
+        "active_connections": sum(n["active_connections"] for n in nodes.values()),
+        "pending_events": sum(n["pending_events"] for n in nodes.values()),
+        "queue_depth": sum(n.get("queue_depth", 0) for n in nodes.values()),
+        "dropped": sum(n.get("dropped", 0) for n in nodes.values()),
+        "coalesced": sum(n.get("coalescer", {}).get("coalesced", 0) for n in nodes.values()),
         "subscriptions": len(event_subscriptions),
+        "node": node_stats,
+        "cluster": nodes,
         "service_endpoints": {
             "makrcave": MAKRCAVE_API_URL,
             "store": STORE_API_URL,
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the request security scanners
+
+Compares the per-call cost of the precompiled single-pass scanner with the
+pattern-by-pattern loop it replaced for the InputSanitizer checks.
+RequestLoggingMiddleware keeps its substring loop: a combined regex measured
+slower than it (0.2-0.8x).
+
+Usage: python benchmark_security.py [iterations]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+# Add the backend directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from security.input_validation import InputSanitizer
+
+SAMPLE_INPUTS = {
+    "clean": "Laser cutter booking for the robotics club, 3mm acrylic sheets x4",
+    "xss": "Great project! <script>alert(document.cookie)</script>",
+    "path_traversal": "uploads/../../etc/passwd",
+    "sql_injection": "name' OR 1=1 --",
+}
+
+def legacy_classify(text: str):
+    """Pattern-by-pattern loop, as InputSanitizer used to check input"""
+    text_lower = text.lower()
+    for family, patterns in (
+        ("xss", InputSanitizer.XSS_PATTERNS),
+        ("path_traversal", InputSanitizer.PATH_TRAVERSAL_PATTERNS),
+        ("sql_injection", InputSanitizer.SQL_INJECTION_PATTERNS),
+    ):
+        for pattern in patterns:
+            if re.search(pattern, text_lower, flags=re.IGNORECASE):
+                return family
+    return None
+
+def measure(func, iterations: int) -> float:
+    """Best-of-5 cost of one call in microseconds"""
+    return min(timeit.repeat(func, number=iterations, repeat=5)) / iterations * 1e6
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"Per-call cost in microseconds ({iterations} iterations, best of 5)")
+    print("=" * 64)
+    print(f"{'input':<28}{'legacy':>12}{'scanner':>12}{'speedup':>12}")
+
+    for name, text in SAMPLE_INPUTS.items():
+        assert legacy_classify(text) == InputSanitizer.classify(text)
+        legacy = measure(lambda: legacy_classify(text), iterations)
+        scanner = measure(lambda: InputSanitizer.classify(text), iterations)
+        print(f"{'sanitizer/' + name:<28}{legacy:>12.2f}{scanner:>12.2f}{legacy / scanner:>11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,146 @@ Security Middleware for MakrCave Backend
 Rate limiting, security headers, and request validation
 """
 
+import math
+import os
 import time
-from collections import defaultdict
-from typing import Dict, Any
-from fastapi import Request, Response, HTTPException, status
-from fastapi.middleware.base import BaseHTTPMiddleware
+from collections import OrderedDict
+from typing import Dict, Any, NamedTuple, Optional
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Rate limiter state: tracked (IP, category) keys per worker, and whether
+# counts are shared across workers through Redis
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "false").lower() == "true"
+
+# SLIDING_WINDOW_SCRIPT, RateLimitResult and SlidingWindowLimiter are
+# deliberately duplicated in backends/auth-service/security_middleware.py (only the key prefix
+# differs): each service is built from its own directory, so there is no
+# shared module to import. Apply any fix to the script or window math to both.
+
+# Shared-state check: reads the previous and current window counts and
+# increments the current one only if the request is allowed.
+# KEYS: current window, previous window. ARGV: previous weight, limit, ttl.
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[1]) + current >= tonumber(ARGV[2]) then
+    return {0, current, previous}
+end
+current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return {1, current, previous}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # seconds until the next request would be allowed (0 if allowed)
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding-window counter per key.
+
+    Each key keeps only the counts of the current and previous fixed
+    windows; the previous count is weighted by how much of it still
+    overlaps the sliding window. That makes every check O(1) in time and
+    memory, and at most max_keys keys are tracked (least recently seen
+    keys are dropped first).
+
+    With a redis_url the counts live in Redis, so all workers share one
+    limit. If Redis is unreachable the worker falls back to its own counts.
+    """
+
+    def __init__(self, max_keys: int = 100000, redis_url: Optional[str] = None,
+                 prefix: str = "makrcave:ratelimit"):
+        self.max_keys = max_keys
+        self.prefix = prefix
+        # key -> [window index, previous window count, current window count]
+        self.windows: "OrderedDict[str, list]" = OrderedDict()
+        self.redis = None
+        if redis_url:
+            # Imported here so single-worker deployments don't need the redis package
+            import redis.asyncio as aioredis
+            self.redis = aioredis.from_url(redis_url)
+            self._script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+
+    @staticmethod
+    def _result(allowed: bool, previous: int, current: int, limit: int,
+                period: int, elapsed: float) -> RateLimitResult:
+        if allowed:
+            used = previous * (1 - elapsed / period) + current
+            return RateLimitResult(True, max(0, int(limit - used)), 0.0)
+
+        if current < limit:
+            # Wait until enough of the previous window has slid out
+            retry_after = period * (1 - (limit - current) / previous) - elapsed
+        else:
+            # Wait for the next window, where this window's count becomes the previous one
+            retry_after = period - elapsed + max(0.0, period * (1 - limit / current))
+        return RateLimitResult(False, 0, max(retry_after, 0.0))
+
+    def hit(self, key: str, limit: int, period: int, now: Optional[float] = None) -> RateLimitResult:
+        """Count a request for key against this worker's counts"""
+        now = time.time() if now is None else now
+        window = int(now // period)
+        entry = self.windows.get(key)
+        if entry is None:
+            entry = self.windows[key] = [window, 0, 0]
+            if len(self.windows) > self.max_keys:
+                self.windows.popitem(last=False)
+        else:
+            self.windows.move_to_end(key)
+            if entry[0] != window:
+                entry[1] = entry[2] if entry[0] == window - 1 else 0
+                entry[2] = 0
+                entry[0] = window
+
+        elapsed = now - window * period
+        allowed = entry[1] * (1 - elapsed / period) + entry[2] < limit
+        if allowed:
+            entry[2] += 1
+        return self._result(allowed, entry[1], entry[2], limit, period, elapsed)
+
+    async def acquire(self, key: str, limit: int, period: int) -> RateLimitResult:
+        """Count a request for key, against shared counts when Redis is configured"""
+        if self.redis is None:
+            return self.hit(key, limit, period)
+
+        now = time.time()
+        window = int(now // period)
+        elapsed = now - window * period
+        base = f"{self.prefix}:{{{key}}}"
+        try:
+            allowed, current, previous = await self._script(
+                keys=[f"{base}:{window}", f"{base}:{window - 1}"],
+                args=[1 - elapsed / period, limit, period * 2]
+            )
+        except Exception as e:
+            logger.warning(f"Shared rate limit unavailable, using local counts: {e}")
+            return self.hit(key, limit, period, now)
+        return self._result(bool(allowed), int(previous), int(current), limit, period, elapsed)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """Rate limiting middleware with endpoint-specific limits"""
     
-    def __init__(self, app):
+    def __init__(self, app, max_keys: int = RATE_LIMIT_MAX_KEYS, redis_url: Optional[str] = None,
+                 limiter: Optional[SlidingWindowLimiter] = None):
         super().__init__(app)
-        self.clients = defaultdict(lambda: defaultdict(list))
+        # Pass a limiter in to close its Redis connection on shutdown
+        self.limiter = limiter or SlidingWindowLimiter(max_keys=max_keys, redis_url=redis_url)
         
         # Endpoint-specific rate limits (calls per hour)
         self.limits = {
@@ -38,7 +163,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         return "default"
     
     async def dispatch(self, request: Request, call_next):
-        client_ip = request.client.host
+        client_ip = request.client.host if request.client else "unknown"
         endpoint_category = self.get_endpoint_category(request.url.path)
         
         # Get limits for this endpoint category
@@ -46,34 +171,29 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         calls_limit = limit_config["calls"]
         period = limit_config["period"]
         
-        # Clean old entries
-        now = time.time()
-        self.clients[client_ip][endpoint_category] = [
-            call_time for call_time in self.clients[client_ip][endpoint_category]
-            if now - call_time < period
-        ]
-        
         # Check rate limit
-        if len(self.clients[client_ip][endpoint_category]) >= calls_limit:
+        now = time.time()
+        result = await self.limiter.acquire(f"{client_ip}:{endpoint_category}", calls_limit, period)
+        if not result.allowed:
+            retry_after = max(1, math.ceil(result.retry_after))
             logger.warning(
-                f"Rate limit exceeded for IP {client_ip} on {endpoint_category}: "
-                f"{len(self.clients[client_ip][endpoint_category])}/{calls_limit}"
+                f"Rate limit exceeded for IP {client_ip} on {endpoint_category}: limit {calls_limit}"
             )
-            raise HTTPException(
+            return JSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"Rate limit exceeded for {endpoint_category}. Try again later.",
-                headers={"Retry-After": str(period)}
+                content={"detail": f"Rate limit exceeded for {endpoint_category}. Try again later."},
+                headers={
+                    "Retry-After": str(retry_after),
+                    "X-RateLimit-Limit": str(calls_limit),
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset": str(int(now + retry_after))
+                }
             )
         
-        # Record this call
-        self.clients[client_ip][endpoint_category].append(now)
-        
         # Add rate limit headers
         response = await call_next(request)
         response.headers["X-RateLimit-Limit"] = str(calls_limit)
-        response.headers["X-RateLimit-Remaining"] = str(
-            calls_limit - len(self.clients[client_ip][endpoint_category])
-        )
+        response.headers["X-RateLimit-Remaining"] = str(result.remaining)
         response.headers["X-RateLimit-Reset"] = str(int(now + period))
         
         return response
@@ -174,4 +294,9 @@ def add_security_middleware(app):
     # Order is important - headers should be last to ensure they're added
     app.add_middleware(SecurityHeadersMiddleware)
     app.add_middleware(RequestLoggingMiddleware)
-    app.add_middleware(RateLimitMiddleware)
+    limiter = SlidingWindowLimiter(
+        max_keys=RATE_LIMIT_MAX_KEYS,
+        redis_url=os.getenv("REDIS_URL") if RATE_LIMIT_SHARED else None
+    )
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    app.add_event_handler("shutdown", limiter.close)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Analytics Rollup Tables Migration Script for MakrCave Backend
+
+This script creates the pre-aggregated analytics rollup tables and can run
+the first compaction, which backfills the rollups from the raw tables.
+"""
+
+import sys
+import os
+
+# Add the backend directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base, engine, get_db_session
+from models.analytics_rollups import (
+    ActivityHourlyRollup, MemberDailyRollup, EquipmentDailyRollup,
+    RevenueDailyRollup, AnalyticsRollupState
+)
+from services.analytics_rollup_service import compact_all_makerspaces, ROLLUP_BACKFILL_DAYS
+
+ROLLUP_TABLES = [
+    ActivityHourlyRollup.__table__,
+    MemberDailyRollup.__table__,
+    EquipmentDailyRollup.__table__,
+    RevenueDailyRollup.__table__,
+    AnalyticsRollupState.__table__,
+]
+
+def create_rollup_tables():
+    """Create all analytics rollup tables"""
+    print("📊 Creating analytics rollup tables...")
+
+    try:
+        Base.metadata.create_all(bind=engine, tables=ROLLUP_TABLES)
+        print("✅ Analytics rollup tables created successfully")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error creating analytics rollup tables: {e}")
+        return False
+
+def drop_rollup_tables():
+    """Drop all analytics rollup tables (for reset); they can be rebuilt from raw data"""
+    print("⚠️  Dropping analytics rollup tables...")
+
+    try:
+        Base.metadata.drop_all(bind=engine, tables=ROLLUP_TABLES)
+        print("✅ Analytics rollup tables dropped successfully")
+
+    except Exception as e:
+        print(f"❌ Error dropping analytics rollup tables: {e}")
+
+def backfill_rollups():
+    """Run the first compaction for every makerspace"""
+    print(f"📦 Backfilling rollups for the last {ROLLUP_BACKFILL_DAYS} days...")
+
+    db = get_db_session()
+    try:
+        for result in compact_all_makerspaces(db):
+            print(f"  {result['makerspace_id']}: {result['days_rebuilt']} days up to {result['rolled_up_until']}")
+        print("✅ Analytics rollups backfilled")
+    finally:
+        db.close()
+
+def main():
+    """Main migration function"""
+    print("🚀 Running Analytics Rollup Tables Migration...")
+
+    reset = "--reset" in sys.argv
+    backfill = "--backfill" in sys.argv
+
+    if "--drop" in sys.argv:
+        drop_rollup_tables()
+        return
+
+    if reset:
+        drop_rollup_tables()
+
+    success = create_rollup_tables()
+
+    if success and backfill:
+        backfill_rollups()
+
+    if success:
+        print("🎉 Analytics rollup migration completed successfully!")
+        print("\n⏱️  Keep rollups current by compacting regularly, e.g. hourly from cron:")
+        print("  python -m services.analytics_rollup_service")
+    else:
+        print("❌ Analytics rollup migration failed!")
+
+    print("\n📚 Usage:")
+    print("  python create_analytics_rollup_tables.py               # Create tables")
+    print("  python create_analytics_rollup_tables.py --backfill    # Create tables and backfill rollups")
+    print("  python create_analytics_rollup_tables.py --reset --backfill  # Rebuild rollups from scratch")
+    print("  python create_analytics_rollup_tables.py --drop        # Drop rollup tables")
+
+if __name__ == "__main__":
+    main()
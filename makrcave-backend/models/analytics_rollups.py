@@ -0,0 +1,84 @@
+"""
+Pre-aggregated analytics rollups
+
+Hourly and daily aggregates of member activity, equipment usage and
+revenue, maintained by services.analytics_rollup_service. Dashboards read
+these instead of scanning raw event rows; rows newer than a makerspace's
+rolled_up_until watermark are still read from the raw tables.
+
+Key columns use the types of their source tables (member_activity_logs via
+members, equipment_usage_logs, transactions) so rollup keys compare equal
+to the raw rows they are combined with.
+"""
+
+from sqlalchemy import Column, String, Integer, Float, Date, DateTime, Index
+from sqlalchemy.dialects.postgresql import UUID
+from database import Base
+from datetime import datetime
+
+class ActivityHourlyRollup(Base):
+    """Member activity per makerspace per hour"""
+    __tablename__ = "analytics_activity_hourly"
+
+    makerspace_id = Column(UUID(as_uuid=True), primary_key=True)
+    hour = Column(DateTime, primary_key=True)  # start of the hour (UTC)
+    activity_count = Column(Integer, default=0, nullable=False)
+    checkin_count = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<ActivityHourlyRollup(makerspace={self.makerspace_id}, hour={self.hour}, activities={self.activity_count})>"
+
+class MemberDailyRollup(Base):
+    """Member activity per member per day; distinct-member counts are row counts"""
+    __tablename__ = "analytics_member_daily"
+
+    makerspace_id = Column(UUID(as_uuid=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    member_id = Column(UUID(as_uuid=True), primary_key=True)
+    activity_count = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        Index("idx_member_daily_makerspace_member", "makerspace_id", "member_id"),
+    )
+
+    def __repr__(self):
+        return f"<MemberDailyRollup(member={self.member_id}, day={self.day}, activities={self.activity_count})>"
+
+class EquipmentDailyRollup(Base):
+    """Equipment usage sessions per equipment per day (by session start)"""
+    __tablename__ = "analytics_equipment_daily"
+
+    makerspace_id = Column(UUID(as_uuid=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    equipment_id = Column(UUID(as_uuid=True), primary_key=True)
+    sessions = Column(Integer, default=0, nullable=False)
+    completed_sessions = Column(Integer, default=0, nullable=False)
+    total_hours = Column(Float, default=0.0, nullable=False)  # completed sessions only
+
+    def __repr__(self):
+        return f"<EquipmentDailyRollup(equipment={self.equipment_id}, day={self.day}, sessions={self.sessions})>"
+
+class RevenueDailyRollup(Base):
+    """Completed transaction revenue per makerspace per day and category"""
+    __tablename__ = "analytics_revenue_daily"
+
+    makerspace_id = Column(String, primary_key=True)  # billing keys makerspaces by string
+    day = Column(Date, primary_key=True)
+    category = Column(String(50), primary_key=True)
+    revenue = Column(Float, default=0.0, nullable=False)
+    transaction_count = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<RevenueDailyRollup(makerspace={self.makerspace_id}, day={self.day}, revenue={self.revenue})>"
+
+class AnalyticsRollupState(Base):
+    """How far each makerspace's rollups reach"""
+    __tablename__ = "analytics_rollup_state"
+
+    makerspace_id = Column(UUID(as_uuid=True), primary_key=True)
+    rolled_up_from = Column(Date, nullable=False)  # first day covered by the rollups
+    rolled_up_until = Column(DateTime, nullable=False)  # raw rows at or after this are not rolled up
+    last_compacted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<AnalyticsRollupState(makerspace={self.makerspace_id}, until={self.rolled_up_until})>"
@@ -8,6 +8,7 @@ import logging
 from database import get_db
 from dependencies import get_current_user, get_current_makerspace, require_permission
 from services.real_analytics_service import get_real_analytics_service
+from services.analytics_rollup_service import AnalyticsRollupService
 from utils.analytics_mock_data import AnalyticsMockData  # Fallback only
 
 router = APIRouter()
@@ -336,3 +337,20 @@ async def export_analytics(
     except Exception as e:
         logger.error(f"Analytics export error: {e}")
         raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+
+@router.post("/rollups/compact")
+async def compact_analytics_rollups(
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user),
+    makerspace = Depends(get_current_makerspace),
+    _: bool = Depends(require_permission("analytics:manage"))
+):
+    """Bring the makerspace's pre-aggregated analytics up to the last complete hour"""
+    try:
+        result = AnalyticsRollupService(db).compact(makerspace.id)
+        return {"success": True, "data": result}
+        
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Analytics rollup compaction error: {e}")
+        raise HTTPException(status_code=500, detail=f"Rollup compaction failed: {str(e)}")
@@ -5,6 +5,7 @@ Comprehensive security utilities and middleware
 
 from .input_validation import (
     InputSanitizer,
+    PatternScanner,
     SecureBaseModel,
     FileUploadValidator,
     ValidationPatterns,
@@ -14,6 +15,7 @@ from .input_validation import (
 
 __all__ = [
     "InputSanitizer",
+    "PatternScanner",
     "SecureBaseModel", 
     "FileUploadValidator",
     "ValidationPatterns",
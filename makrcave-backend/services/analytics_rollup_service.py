@@ -0,0 +1,454 @@
+"""Maintains the pre-aggregated analytics rollups and reads them back for dashboards
+
+Compaction rebuilds whole days of rollup rows from the raw tables, up to the
+last complete hour, and records that point as the makerspace's watermark.
+Each run rebuilds the days since the previous watermark plus any earlier
+day whose raw rows changed since the previous run (equipment sessions that
+ended, transactions whose status changed), so rollups stay exact without
+rescanning history. Readers combine rollup rows before the watermark with
+raw rows after it.
+"""
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta, date, time
+from typing import Dict, List, Optional, Any, Set, Tuple
+from collections import defaultdict
+from sqlalchemy.orm import Session
+from sqlalchemy import func, and_, Date, DateTime
+from sqlalchemy.sql import case
+
+from database import get_db_session
+from models.analytics_rollups import (
+    ActivityHourlyRollup, MemberDailyRollup, EquipmentDailyRollup,
+    RevenueDailyRollup, AnalyticsRollupState
+)
+from models.enhanced_member import Member, MemberActivityLog
+from models.analytics import EquipmentUsageLog
+from models.billing import Transaction
+
+logger = logging.getLogger(__name__)
+
+# How far back the first compaction of a makerspace reaches (covers a 30-day
+# window plus the previous period used for growth rates)
+ROLLUP_BACKFILL_DAYS = int(os.getenv("ANALYTICS_ROLLUP_BACKFILL_DAYS", "62"))
+
+# Stored in place of a missing transaction category (part of the primary key).
+# Transactions are categorized by their service_type.
+UNCATEGORIZED = ""
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+def _as_uuid(value: Any) -> uuid.UUID:
+    """Makerspace ids are UUIDs in the activity and equipment tables, strings in billing"""
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+class AnalyticsRollupService:
+    """Compaction and reads of the analytics rollup tables"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_state(self, makerspace_id: str) -> Optional[AnalyticsRollupState]:
+        return self.db.query(AnalyticsRollupState).filter(
+            AnalyticsRollupState.makerspace_id == makerspace_id
+        ).first()
+
+    def covered_until(self, makerspace_id: str, start: datetime) -> Optional[datetime]:
+        """
+        Watermark of the makerspace's rollups if they cover everything from
+        start on; None if raw tables have to be read instead
+        """
+        state = self.get_state(makerspace_id)
+        if state is None or state.rolled_up_from > start.date():
+            return None
+        return state.rolled_up_until
+
+    # Compaction
+
+    def compact(self, makerspace_id: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Bring a makerspace's rollups up to the last complete hour"""
+        makerspace_id = _as_uuid(makerspace_id)
+        now = now or datetime.utcnow()
+        until = now.replace(minute=0, second=0, microsecond=0)
+        state = self.get_state(makerspace_id)
+
+        if state is None:
+            first_day = (until - timedelta(days=ROLLUP_BACKFILL_DAYS)).date()
+            days = self._days_between(first_day, until.date())
+            state = AnalyticsRollupState(makerspace_id=makerspace_id, rolled_up_from=first_day)
+            self.db.add(state)
+        else:
+            days = self._days_between(state.rolled_up_until.date(), until.date())
+            days |= self._changed_days(makerspace_id, state)
+
+        for day in sorted(days):
+            self._rebuild_day(makerspace_id, day, until)
+
+        state.rolled_up_until = until
+        state.last_compacted_at = now
+        self.db.commit()
+
+        return {
+            "makerspace_id": str(makerspace_id),
+            "days_rebuilt": len(days),
+            "rolled_up_until": until.isoformat()
+        }
+
+    @staticmethod
+    def _days_between(first: date, last: date) -> Set[date]:
+        return {first + timedelta(days=offset) for offset in range((last - first).days + 1)}
+
+    def _changed_days(self, makerspace_id: str, state: AnalyticsRollupState) -> Set[date]:
+        """Already rolled-up days whose raw rows changed since the last compaction"""
+        ended_sessions = self.db.query(func.date(EquipmentUsageLog.session_start, type_=Date)).filter(
+            and_(
+                EquipmentUsageLog.makerspace_id == makerspace_id,
+                EquipmentUsageLog.session_start < state.rolled_up_until,
+                EquipmentUsageLog.session_end >= state.last_compacted_at
+            )
+        ).distinct().all()
+
+        updated_transactions = self.db.query(func.date(Transaction.created_at, type_=Date)).filter(
+            and_(
+                Transaction.makerspace_id == str(makerspace_id),
+                Transaction.created_at < state.rolled_up_until,
+                Transaction.updated_at >= state.last_compacted_at
+            )
+        ).distinct().all()
+
+        days = {row[0] for row in ended_sessions + updated_transactions}
+        return {day for day in days if day >= state.rolled_up_from}
+
+    def _rebuild_day(self, makerspace_id: str, day: date, until: datetime):
+        """Replace one day's rollup rows with aggregates of its raw rows before until"""
+        start = _day_start(day)
+        end = min(start + timedelta(days=1), until)
+
+        self.db.query(ActivityHourlyRollup).filter(
+            and_(
+                ActivityHourlyRollup.makerspace_id == makerspace_id,
+                ActivityHourlyRollup.hour >= start,
+                ActivityHourlyRollup.hour < start + timedelta(days=1)
+            )
+        ).delete(synchronize_session=False)
+        for model in (MemberDailyRollup, EquipmentDailyRollup):
+            self.db.query(model).filter(
+                and_(model.makerspace_id == makerspace_id, model.day == day)
+            ).delete(synchronize_session=False)
+        self.db.query(RevenueDailyRollup).filter(
+            and_(RevenueDailyRollup.makerspace_id == str(makerspace_id), RevenueDailyRollup.day == day)
+        ).delete(synchronize_session=False)
+
+        if end <= start:
+            return
+
+        # Member activity, aggregated per member and hour in one pass
+        member_hours = self._member_activity(
+            func.date_trunc('hour', MemberActivityLog.created_at, type_=DateTime).label('hour'),
+            MemberActivityLog.member_id,
+            func.count(MemberActivityLog.id).label('activity_count'),
+            func.sum(case((MemberActivityLog.activity_type == 'checkin', 1), else_=0)).label('checkin_count')
+        ).filter(
+            and_(
+                Member.makerspace_id == makerspace_id,
+                MemberActivityLog.created_at >= start,
+                MemberActivityLog.created_at < end
+            )
+        ).group_by('hour', MemberActivityLog.member_id).all()
+
+        hourly = defaultdict(lambda: [0, 0])
+        members = defaultdict(int)
+        for row in member_hours:
+            hourly[row.hour][0] += row.activity_count
+            hourly[row.hour][1] += row.checkin_count or 0
+            members[row.member_id] += row.activity_count
+
+        equipment = self._equipment_sessions().filter(
+            and_(
+                EquipmentUsageLog.makerspace_id == makerspace_id,
+                EquipmentUsageLog.session_start >= start,
+                EquipmentUsageLog.session_start < end
+            )
+        ).group_by(EquipmentUsageLog.equipment_id).all()
+
+        revenue = self.db.query(
+            Transaction.service_type.label('category'),
+            func.sum(Transaction.amount).label('revenue'),
+            func.count(Transaction.id).label('transaction_count')
+        ).filter(
+            and_(
+                Transaction.makerspace_id == str(makerspace_id),
+                Transaction.created_at >= start,
+                Transaction.created_at < end,
+                Transaction.status == 'completed'
+            )
+        ).group_by(Transaction.service_type).all()
+
+        self.db.bulk_save_objects(
+            [
+                ActivityHourlyRollup(
+                    makerspace_id=makerspace_id, hour=hour,
+                    activity_count=counts[0], checkin_count=counts[1]
+                )
+                for hour, counts in hourly.items()
+            ] + [
+                MemberDailyRollup(
+                    makerspace_id=makerspace_id, day=day,
+                    member_id=member_id, activity_count=count
+                )
+                for member_id, count in members.items()
+            ] + [
+                EquipmentDailyRollup(
+                    makerspace_id=makerspace_id, day=day, equipment_id=row.equipment_id,
+                    sessions=row.sessions, completed_sessions=row.completed_sessions,
+                    total_hours=float(row.total_hours or 0)
+                )
+                for row in equipment
+            ] + [
+                RevenueDailyRollup(
+                    makerspace_id=str(makerspace_id), day=day,
+                    category=row.category if row.category is not None else UNCATEGORIZED,
+                    revenue=float(row.revenue or 0), transaction_count=row.transaction_count
+                )
+                for row in revenue
+            ]
+        )
+
+    def _member_activity(self, *columns):
+        """Query over activity logs; their makerspace comes from the member"""
+        return self.db.query(*columns).join(Member, Member.id == MemberActivityLog.member_id)
+
+    def _equipment_sessions(self):
+        """Sessions, completed sessions and hours per equipment (to be filtered and grouped)"""
+        return self.db.query(
+            EquipmentUsageLog.equipment_id,
+            func.count(EquipmentUsageLog.id).label('sessions'),
+            func.count(EquipmentUsageLog.session_end).label('completed_sessions'),
+            func.sum(
+                func.extract('epoch', EquipmentUsageLog.session_end - EquipmentUsageLog.session_start) / 3600
+            ).label('total_hours')
+        )
+
+    # Reads: rollup rows up to the watermark plus raw rows after it
+
+    def daily_activity(self, makerspace_id: str, start: datetime, until: datetime) -> List[Tuple[date, int, int]]:
+        """(day, unique members, activities) per day from start on"""
+        days = {
+            row.day: [row.unique_members, row.total_activities or 0]
+            for row in self.db.query(
+                MemberDailyRollup.day,
+                func.count().label('unique_members'),
+                func.sum(MemberDailyRollup.activity_count).label('total_activities')
+            ).filter(
+                and_(
+                    MemberDailyRollup.makerspace_id == makerspace_id,
+                    MemberDailyRollup.day >= start.date()
+                )
+            ).group_by(MemberDailyRollup.day).all()
+        }
+
+        tail = self._member_activity(
+            func.date(MemberActivityLog.created_at, type_=Date).label('day'),
+            MemberActivityLog.member_id,
+            func.count(MemberActivityLog.id).label('activity_count')
+        ).filter(
+            and_(
+                Member.makerspace_id == makerspace_id,
+                MemberActivityLog.created_at >= max(start, until)
+            )
+        ).group_by('day', MemberActivityLog.member_id).all()
+
+        # Members of the watermark's day may already be counted in its rollup row
+        tail_members = {(row.day, row.member_id) for row in tail}
+        shared_days = {day for day, _ in tail_members if day in days}
+        counted = set()
+        if shared_days:
+            counted = {
+                (row.day, row.member_id)
+                for row in self.db.query(MemberDailyRollup.day, MemberDailyRollup.member_id).filter(
+                    and_(
+                        MemberDailyRollup.makerspace_id == makerspace_id,
+                        MemberDailyRollup.day.in_(list(shared_days)),
+                        MemberDailyRollup.member_id.in_(list({member for _, member in tail_members}))
+                    )
+                ).all()
+            }
+
+        for row in tail:
+            key = (row.day, row.member_id)
+            entry = days.setdefault(key[0], [0, 0])
+            entry[1] += row.activity_count
+            if key not in counted:
+                entry[0] += 1
+
+        return [(day, counts[0], counts[1]) for day, counts in sorted(days.items())]
+
+    def hourly_activity(self, makerspace_id: str, start: datetime, until: datetime) -> Dict[int, int]:
+        """Activities per hour of day from start on"""
+        hours = defaultdict(int)
+        for row in self.db.query(
+            func.extract('hour', ActivityHourlyRollup.hour).label('hour'),
+            func.sum(ActivityHourlyRollup.activity_count).label('activity_count')
+        ).filter(
+            and_(
+                ActivityHourlyRollup.makerspace_id == makerspace_id,
+                ActivityHourlyRollup.hour >= start
+            )
+        ).group_by('hour').all():
+            hours[int(row.hour)] += row.activity_count or 0
+
+        for row in self._member_activity(
+            func.extract('hour', MemberActivityLog.created_at).label('hour'),
+            func.count(MemberActivityLog.id).label('activity_count')
+        ).filter(
+            and_(
+                Member.makerspace_id == makerspace_id,
+                MemberActivityLog.created_at >= max(start, until)
+            )
+        ).group_by('hour').all():
+            hours[int(row.hour)] += row.activity_count
+
+        return dict(hours)
+
+    def member_activity_counts(self, makerspace_id: str, start: datetime, until: datetime) -> Dict[str, int]:
+        """Activities per member from start on (members with any activity)"""
+        counts = defaultdict(int)
+        for row in self.db.query(
+            MemberDailyRollup.member_id,
+            func.sum(MemberDailyRollup.activity_count).label('activity_count')
+        ).filter(
+            and_(
+                MemberDailyRollup.makerspace_id == makerspace_id,
+                MemberDailyRollup.day >= start.date()
+            )
+        ).group_by(MemberDailyRollup.member_id).all():
+            counts[row.member_id] += row.activity_count or 0
+
+        for row in self._member_activity(
+            MemberActivityLog.member_id,
+            func.count(MemberActivityLog.id).label('activity_count')
+        ).filter(
+            and_(
+                Member.makerspace_id == makerspace_id,
+                MemberActivityLog.created_at >= max(start, until)
+            )
+        ).group_by(MemberActivityLog.member_id).all():
+            counts[row.member_id] += row.activity_count
+
+        return dict(counts)
+
+    def equipment_usage(self, makerspace_id: str, start: datetime, until: datetime) -> Dict[str, Dict[str, float]]:
+        """Sessions, completed sessions and hours per equipment from start on"""
+        usage = defaultdict(lambda: {"sessions": 0, "completed_sessions": 0, "total_hours": 0.0})
+
+        rolled = self.db.query(
+            EquipmentDailyRollup.equipment_id,
+            func.sum(EquipmentDailyRollup.sessions).label('sessions'),
+            func.sum(EquipmentDailyRollup.completed_sessions).label('completed_sessions'),
+            func.sum(EquipmentDailyRollup.total_hours).label('total_hours')
+        ).filter(
+            and_(
+                EquipmentDailyRollup.makerspace_id == makerspace_id,
+                EquipmentDailyRollup.day >= start.date()
+            )
+        ).group_by(EquipmentDailyRollup.equipment_id).all()
+
+        raw = self._equipment_sessions().filter(
+            and_(
+                EquipmentUsageLog.makerspace_id == makerspace_id,
+                EquipmentUsageLog.session_start >= max(start, until)
+            )
+        ).group_by(EquipmentUsageLog.equipment_id).all()
+
+        for row in rolled + raw:
+            # Keyed by string so callers can look up Equipment.id directly
+            entry = usage[str(row.equipment_id)]
+            entry["sessions"] += row.sessions or 0
+            entry["completed_sessions"] += row.completed_sessions or 0
+            entry["total_hours"] += float(row.total_hours or 0)
+
+        return dict(usage)
+
+    def daily_revenue(self, makerspace_id: str, start: datetime, until: datetime) -> List[Tuple[date, float, int]]:
+        """(day, revenue, transactions) per day from start on"""
+        days = defaultdict(lambda: [0.0, 0])
+        for row in self._revenue_rows(makerspace_id, start, until, RevenueDailyRollup.day, func.date(Transaction.created_at, type_=Date)):
+            entry = days[row.key]
+            entry[0] += float(row.revenue or 0)
+            entry[1] += row.transaction_count or 0
+        return [(day, values[0], values[1]) for day, values in sorted(days.items())]
+
+    def revenue_by_category(self, makerspace_id: str, start: datetime, until: datetime) -> List[Tuple[Optional[str], float, int]]:
+        """(category, revenue, transactions) from start on"""
+        categories = defaultdict(lambda: [0.0, 0])
+        for row in self._revenue_rows(makerspace_id, start, until, RevenueDailyRollup.category, Transaction.service_type):
+            category = None if row.key == UNCATEGORIZED else row.key
+            categories[category][0] += float(row.revenue or 0)
+            categories[category][1] += row.transaction_count or 0
+        return [(category, values[0], values[1]) for category, values in categories.items()]
+
+    def total_revenue(self, makerspace_id: str, start: datetime, end: datetime) -> float:
+        """Completed revenue of whole days in [start, end), both before the watermark"""
+        return float(self.db.query(func.sum(RevenueDailyRollup.revenue)).filter(
+            and_(
+                RevenueDailyRollup.makerspace_id == str(makerspace_id),
+                RevenueDailyRollup.day >= start.date(),
+                RevenueDailyRollup.day < end.date()
+            )
+        ).scalar() or 0.0)
+
+    def _revenue_rows(self, makerspace_id: str, start: datetime, until: datetime, rollup_key, raw_key) -> List[Any]:
+        rolled = self.db.query(
+            rollup_key.label('key'),
+            func.sum(RevenueDailyRollup.revenue).label('revenue'),
+            func.sum(RevenueDailyRollup.transaction_count).label('transaction_count')
+        ).filter(
+            and_(
+                RevenueDailyRollup.makerspace_id == str(makerspace_id),
+                RevenueDailyRollup.day >= start.date()
+            )
+        ).group_by(rollup_key).all()
+
+        raw = self.db.query(
+            raw_key.label('key'),
+            func.sum(Transaction.amount).label('revenue'),
+            func.count(Transaction.id).label('transaction_count')
+        ).filter(
+            and_(
+                Transaction.makerspace_id == str(makerspace_id),
+                Transaction.created_at >= max(start, until),
+                Transaction.status == 'completed'
+            )
+        ).group_by(raw_key).all()
+
+        return rolled + raw
+
+def compact_all_makerspaces(db: Session, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Compact the rollups of every makerspace with analytics data"""
+    makerspace_ids = {
+        row[0] for row in db.query(Member.makerspace_id).distinct().all()
+    } | {
+        row[0] for row in db.query(AnalyticsRollupState.makerspace_id).all()
+    }
+    service = AnalyticsRollupService(db)
+    results = []
+    for makerspace_id in sorted(makerspace_ids):
+        try:
+            results.append(service.compact(makerspace_id, now))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Analytics rollup compaction failed for {makerspace_id}: {e}")
+    return results
+
+if __name__ == "__main__":
+    # Compaction job entry point, e.g. run hourly from cron:
+    #   python -m services.analytics_rollup_service
+    logging.basicConfig(level=logging.INFO)
+    session = get_db_session()
+    try:
+        for result in compact_all_makerspaces(session):
+            logger.info(f"Compacted analytics rollups: {result}")
+    finally:
+        session.close()
@@ -1,22 +1,20 @@
 """Real analytics service replacing mock data with actual database queries"""
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, time
 from typing import Dict, List, Optional, Any, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_, extract, text
+from sqlalchemy import func, and_, or_, desc, extract, text
 from sqlalchemy.sql import case
 import logging
 from collections import defaultdict
 
 from database import get_db
-from models.enhanced_analytics import (
-    UsageMetric, RevenueRecord, EquipmentUsage, 
-    MemberActivity, SafetyIncident, SystemHealth
-)
-from models.enhanced_member import Member, MemberSkill, Certification
-from models.equipment import Equipment, EquipmentReservation
-from models.makerspace_settings import MakerspaceSettings
-from models.project import Project
-from models.billing import Transaction, CreditTransaction
+from models.enhanced_member import Member, MemberActivityLog
+from models.analytics import EquipmentUsageLog
+from models.equipment import Equipment, EquipmentReservation, EquipmentStatus, ReservationStatus
+from models.machine_access import SafetyIncident, UserCertification
+from models.skill import Skill, UserSkill
+from models.billing import Transaction, CreditTransaction, CreditWallet
+from services.analytics_rollup_service import AnalyticsRollupService
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +23,28 @@ class RealAnalyticsService:
     
     def __init__(self, db: Session):
         self.db = db
+        self.rollups = AnalyticsRollupService(db)
+    
+    @staticmethod
+    def _window_start(days: int) -> datetime:
+        """Start of a days-long window, at midnight UTC so whole-day rollups line up"""
+        return datetime.combine((datetime.utcnow() - timedelta(days=days)).date(), time.min)
+    
+    @staticmethod
+    def _engagement_level(activity_count: int) -> str:
+        if activity_count >= 20:
+            return 'high'
+        if activity_count >= 10:
+            return 'medium'
+        return 'low'
+    
+    def _member_activity(self, *columns):
+        """Query over activity logs; their makerspace comes from the member"""
+        return self.db.query(*columns).join(Member, Member.id == MemberActivityLog.member_id)
+    
+    def _safety_incidents(self, *columns):
+        """Query over safety incidents; their makerspace comes from the equipment involved"""
+        return self.db.query(*columns).join(Equipment, Equipment.id == SafetyIncident.equipment_id)
         
     def get_real_time_analytics(self, makerspace_id: str, hours: int = 24) -> Dict[str, Any]:
         """Get real-time analytics for the last N hours"""
@@ -32,23 +52,23 @@ class RealAnalyticsService:
             cutoff_time = datetime.utcnow() - timedelta(hours=hours)
             
             # Active members in period
-            active_members = self.db.query(func.count(func.distinct(MemberActivity.member_id))).filter(
+            active_members = self._member_activity(func.count(func.distinct(MemberActivityLog.member_id))).filter(
                 and_(
-                    MemberActivity.makerspace_id == makerspace_id,
-                    MemberActivity.timestamp >= cutoff_time
+                    Member.makerspace_id == makerspace_id,
+                    MemberActivityLog.created_at >= cutoff_time
                 )
             ).scalar() or 0
             
             # Equipment utilization
             total_equipment = self.db.query(func.count(Equipment.id)).filter(
-                Equipment.makerspace_id == makerspace_id
+                Equipment.linked_makerspace_id == str(makerspace_id)
             ).scalar() or 1
             
-            active_equipment = self.db.query(func.count(func.distinct(EquipmentUsage.equipment_id))).filter(
+            active_equipment = self.db.query(func.count(func.distinct(EquipmentUsageLog.equipment_id))).filter(
                 and_(
-                    EquipmentUsage.makerspace_id == makerspace_id,
-                    EquipmentUsage.start_time >= cutoff_time,
-                    EquipmentUsage.end_time.is_(None)  # Currently in use
+                    EquipmentUsageLog.makerspace_id == makerspace_id,
+                    EquipmentUsageLog.session_start >= cutoff_time,
+                    EquipmentUsageLog.session_end.is_(None)  # Currently in use
                 )
             ).scalar() or 0
             
@@ -57,26 +77,26 @@ class RealAnalyticsService:
             # Revenue in period
             revenue = self.db.query(func.sum(Transaction.amount)).filter(
                 and_(
-                    Transaction.makerspace_id == makerspace_id,
+                    Transaction.makerspace_id == str(makerspace_id),
                     Transaction.created_at >= cutoff_time,
                     Transaction.status == 'completed'
                 )
             ).scalar() or 0.0
             
             # Current occupancy
-            current_occupancy = self.db.query(func.count(MemberActivity.id)).filter(
+            current_occupancy = self._member_activity(func.count(MemberActivityLog.id)).filter(
                 and_(
-                    MemberActivity.makerspace_id == makerspace_id,
-                    MemberActivity.activity_type == 'checkin',
-                    MemberActivity.timestamp >= cutoff_time
+                    Member.makerspace_id == makerspace_id,
+                    MemberActivityLog.activity_type == 'checkin',
+                    MemberActivityLog.created_at >= cutoff_time
                 )
             ).scalar() or 0
             
             # Safety incidents
-            safety_incidents = self.db.query(func.count(SafetyIncident.id)).filter(
+            safety_incidents = self._safety_incidents(func.count(SafetyIncident.id)).filter(
                 and_(
-                    SafetyIncident.makerspace_id == makerspace_id,
-                    SafetyIncident.incident_date >= cutoff_time.date(),
+                    Equipment.linked_makerspace_id == str(makerspace_id),
+                    SafetyIncident.occurred_at >= cutoff_time,
                     SafetyIncident.severity.in_(['medium', 'high', 'critical'])
                 )
             ).scalar() or 0
@@ -102,129 +122,154 @@ class RealAnalyticsService:
     def get_usage_analytics(self, makerspace_id: str, days: int = 30) -> Dict[str, Any]:
         """Get detailed usage analytics"""
         try:
-            start_date = datetime.utcnow() - timedelta(days=days)
-            
-            # Daily usage trends
-            daily_usage = self.db.query(
-                func.date(MemberActivity.timestamp).label('date'),
-                func.count(func.distinct(MemberActivity.member_id)).label('unique_members'),
-                func.count(MemberActivity.id).label('total_activities')
-            ).filter(
-                and_(
-                    MemberActivity.makerspace_id == makerspace_id,
-                    MemberActivity.timestamp >= start_date
-                )
-            ).group_by(func.date(MemberActivity.timestamp)).order_by('date').all()
-            
-            # Peak hours analysis
-            hourly_usage = self.db.query(
-                extract('hour', MemberActivity.timestamp).label('hour'),
-                func.count(MemberActivity.id).label('activity_count')
-            ).filter(
-                and_(
-                    MemberActivity.makerspace_id == makerspace_id,
-                    MemberActivity.timestamp >= start_date
-                )
-            ).group_by(extract('hour', MemberActivity.timestamp)).all()
+            start_date = self._window_start(days)
+            rolled_up_until = self.rollups.covered_until(makerspace_id, start_date)
+            
+            if rolled_up_until:
+                daily_usage = self.rollups.daily_activity(makerspace_id, start_date, rolled_up_until)
+                hourly_usage = self.rollups.hourly_activity(makerspace_id, start_date, rolled_up_until)
+                usage = self.rollups.equipment_usage(makerspace_id, start_date, rolled_up_until)
+                activity_counts = self.rollups.member_activity_counts(makerspace_id, start_date, rolled_up_until)
+            else:
+                # No rollups for this window yet: aggregate the raw event tables
+                daily_usage, hourly_usage, activity_counts = self._raw_member_activity(makerspace_id, start_date)
+                usage = self._raw_equipment_usage(makerspace_id, start_date)
             
             # Equipment popularity
-            equipment_usage = self.db.query(
-                Equipment.name,
-                Equipment.category,
-                func.count(EquipmentUsage.id).label('usage_count'),
-                func.avg(
-                    func.extract('epoch', EquipmentUsage.end_time - EquipmentUsage.start_time) / 3600
-                ).label('avg_duration_hours')
-            ).join(EquipmentUsage).filter(
-                and_(
-                    Equipment.makerspace_id == makerspace_id,
-                    EquipmentUsage.start_time >= start_date
-                )
-            ).group_by(Equipment.id, Equipment.name, Equipment.category).order_by('usage_count desc').limit(10).all()
+            top_usage = sorted(usage.items(), key=lambda item: item[1]["sessions"], reverse=True)[:10]
+            equipment = {
+                eq.id: eq for eq in self.db.query(Equipment.id, Equipment.name, Equipment.category).filter(
+                    and_(
+                        Equipment.linked_makerspace_id == str(makerspace_id),
+                        Equipment.id.in_([equipment_id for equipment_id, _ in top_usage])
+                    )
+                ).all()
+            }
             
             # Member engagement levels
-            member_engagement = self.db.query(
-                case(
-                    (func.count(MemberActivity.id) >= 20, 'high'),
-                    (func.count(MemberActivity.id) >= 10, 'medium'),
-                    else_='low'
-                ).label('engagement_level'),
-                func.count(func.distinct(MemberActivity.member_id)).label('member_count')
-            ).filter(
-                and_(
-                    MemberActivity.makerspace_id == makerspace_id,
-                    MemberActivity.timestamp >= start_date
-                )
-            ).group_by(MemberActivity.member_id).subquery()
-            
-            engagement_summary = self.db.query(
-                member_engagement.c.engagement_level,
-                func.count().label('member_count')
-            ).group_by(member_engagement.c.engagement_level).all()
+            member_engagement = defaultdict(int)
+            for count in activity_counts.values():
+                member_engagement[self._engagement_level(count)] += 1
             
             return {
                 "period_days": days,
                 "daily_trends": [
-                    {
-                        "date": str(row.date),
-                        "unique_members": row.unique_members,
-                        "total_activities": row.total_activities
-                    }
-                    for row in daily_usage
+                    {"date": str(day), "unique_members": unique_members, "total_activities": total_activities}
+                    for day, unique_members, total_activities in daily_usage
                 ],
                 "peak_hours": [
-                    {"hour": int(row.hour), "activity_count": row.activity_count}
-                    for row in hourly_usage
+                    {"hour": hour, "activity_count": count}
+                    for hour, count in sorted(hourly_usage.items())
                 ],
                 "popular_equipment": [
                     {
-                        "name": row.name,
-                        "category": row.category,
-                        "usage_count": row.usage_count,
-                        "avg_duration_hours": round(float(row.avg_duration_hours or 0), 2)
+                        "name": equipment[equipment_id].name,
+                        "category": equipment[equipment_id].category,
+                        "usage_count": stats["sessions"],
+                        "avg_duration_hours": round(
+                            stats["total_hours"] / stats["completed_sessions"], 2
+                        ) if stats["completed_sessions"] else 0.0
                     }
-                    for row in equipment_usage
+                    for equipment_id, stats in top_usage
+                    if equipment_id in equipment
                 ],
-                "member_engagement": {
-                    row.engagement_level: row.member_count
-                    for row in engagement_summary
-                }
+                "member_engagement": dict(member_engagement)
             }
             
         except Exception as e:
             logger.error(f"Usage analytics error: {e}")
             return {"error": str(e)}
     
+    def _raw_member_activity(self, makerspace_id: str, start_date: datetime) -> Tuple[List[Tuple[date, int, int]], Dict[int, int], Dict[Any, int]]:
+        """Daily trends, activities per hour of day and activities per member from raw activity logs"""
+        # Daily usage trends
+        daily_usage = self._member_activity(
+            func.date(MemberActivityLog.created_at).label('date'),
+            func.count(func.distinct(MemberActivityLog.member_id)).label('unique_members'),
+            func.count(MemberActivityLog.id).label('total_activities')
+        ).filter(
+            and_(
+                Member.makerspace_id == makerspace_id,
+                MemberActivityLog.created_at >= start_date
+            )
+        ).group_by(func.date(MemberActivityLog.created_at)).order_by('date').all()
+        
+        # Peak hours analysis
+        hourly_usage = self._member_activity(
+            extract('hour', MemberActivityLog.created_at).label('hour'),
+            func.count(MemberActivityLog.id).label('activity_count')
+        ).filter(
+            and_(
+                Member.makerspace_id == makerspace_id,
+                MemberActivityLog.created_at >= start_date
+            )
+        ).group_by(extract('hour', MemberActivityLog.created_at)).all()
+        
+        # Activities per member, for engagement levels
+        member_activity = self._member_activity(
+            MemberActivityLog.member_id,
+            func.count(MemberActivityLog.id).label('activity_count')
+        ).filter(
+            and_(
+                Member.makerspace_id == makerspace_id,
+                MemberActivityLog.created_at >= start_date
+            )
+        ).group_by(MemberActivityLog.member_id).all()
+        
+        return (
+            [(row.date, row.unique_members, row.total_activities) for row in daily_usage],
+            {int(row.hour): row.activity_count for row in hourly_usage},
+            {row.member_id: row.activity_count for row in member_activity}
+        )
+    
+    def _raw_equipment_usage(self, makerspace_id: str, start_date: datetime) -> Dict[str, Dict[str, float]]:
+        """Sessions, completed sessions and hours per equipment from raw usage logs"""
+        rows = self.db.query(
+            EquipmentUsageLog.equipment_id,
+            func.count(EquipmentUsageLog.id).label('sessions'),
+            func.count(EquipmentUsageLog.session_end).label('completed_sessions'),
+            func.sum(
+                func.extract('epoch', EquipmentUsageLog.session_end - EquipmentUsageLog.session_start) / 3600
+            ).label('total_hours')
+        ).filter(
+            and_(
+                EquipmentUsageLog.makerspace_id == makerspace_id,
+                EquipmentUsageLog.session_start >= start_date
+            )
+        ).group_by(EquipmentUsageLog.equipment_id).all()
+        
+        return {
+            str(row.equipment_id): {
+                "sessions": row.sessions or 0,
+                "completed_sessions": row.completed_sessions or 0,
+                "total_hours": float(row.total_hours or 0)
+            }
+            for row in rows
+        }
+    
     def get_revenue_analytics(self, makerspace_id: str, days: int = 30) -> Dict[str, Any]:
         """Get revenue and financial analytics"""
         try:
-            start_date = datetime.utcnow() - timedelta(days=days)
-            
-            # Daily revenue trends
-            daily_revenue = self.db.query(
-                func.date(Transaction.created_at).label('date'),
-                func.sum(Transaction.amount).label('revenue'),
-                func.count(Transaction.id).label('transaction_count')
-            ).filter(
-                and_(
-                    Transaction.makerspace_id == makerspace_id,
-                    Transaction.created_at >= start_date,
-                    Transaction.status == 'completed'
-                )
-            ).group_by(func.date(Transaction.created_at)).order_by('date').all()
+            start_date = self._window_start(days)
+            prev_start = start_date - timedelta(days=days)
+            rolled_up_until = self.rollups.covered_until(makerspace_id, prev_start)
             
-            # Revenue by category
-            revenue_by_category = self.db.query(
-                Transaction.category,
-                func.sum(Transaction.amount).label('revenue'),
-                func.count(Transaction.id).label('count')
-            ).filter(
-                and_(
-                    Transaction.makerspace_id == makerspace_id,
-                    Transaction.created_at >= start_date,
-                    Transaction.status == 'completed'
+            if rolled_up_until and rolled_up_until >= start_date:
+                daily_revenue = [
+                    {"date": str(day), "revenue": revenue, "transaction_count": count}
+                    for day, revenue, count in self.rollups.daily_revenue(makerspace_id, start_date, rolled_up_until)
+                ]
+                revenue_by_category = [
+                    {"category": category, "revenue": revenue, "count": count}
+                    for category, revenue, count in self.rollups.revenue_by_category(
+                        makerspace_id, start_date, rolled_up_until
+                    )
+                ]
+                prev_revenue = self.rollups.total_revenue(makerspace_id, prev_start, start_date)
+            else:
+                daily_revenue, revenue_by_category, prev_revenue = self._raw_revenue_trends(
+                    makerspace_id, start_date, prev_start
                 )
-            ).group_by(Transaction.category).all()
             
             # Top paying members
             top_members = self.db.query(
@@ -235,39 +280,29 @@ class RealAnalyticsService:
                 func.count(Transaction.id).label('transaction_count')
             ).join(Transaction, Transaction.member_id == Member.id).filter(
                 and_(
-                    Transaction.makerspace_id == makerspace_id,
+                    Transaction.makerspace_id == str(makerspace_id),
                     Transaction.created_at >= start_date,
                     Transaction.status == 'completed'
                 )
-            ).group_by(Member.id).order_by('total_spent desc').limit(10).all()
+            ).group_by(Member.id).order_by(desc('total_spent')).limit(10).all()
             
-            # Credit system analytics
+            # Credit system analytics (spent credits are stored as negative amounts)
             credit_analytics = self.db.query(
-                func.sum(case((CreditTransaction.transaction_type == 'purchase', CreditTransaction.amount), else_=0)).label('credits_purchased'),
-                func.sum(case((CreditTransaction.transaction_type == 'usage', CreditTransaction.amount), else_=0)).label('credits_used'),
-                func.count(func.distinct(CreditTransaction.member_id)).label('active_credit_users')
-            ).filter(
+                func.sum(case((CreditTransaction.type == 'earned', CreditTransaction.amount), else_=0)).label('credits_purchased'),
+                func.sum(case((CreditTransaction.type == 'spent', -CreditTransaction.amount), else_=0)).label('credits_used'),
+                func.count(func.distinct(CreditTransaction.user_id)).label('active_credit_users')
+            ).join(CreditWallet, CreditWallet.id == CreditTransaction.wallet_id).filter(
                 and_(
-                    CreditTransaction.makerspace_id == makerspace_id,
+                    CreditWallet.makerspace_id == str(makerspace_id),
                     CreditTransaction.created_at >= start_date
                 )
             ).first()
             
             # Calculate totals and growth
-            total_revenue = sum(float(row.revenue or 0) for row in daily_revenue)
-            total_transactions = sum(row.transaction_count for row in daily_revenue)
+            total_revenue = sum(row["revenue"] for row in daily_revenue)
+            total_transactions = sum(row["transaction_count"] for row in daily_revenue)
             
             # Growth calculation (compare with previous period)
-            prev_start = start_date - timedelta(days=days)
-            prev_revenue = self.db.query(func.sum(Transaction.amount)).filter(
-                and_(
-                    Transaction.makerspace_id == makerspace_id,
-                    Transaction.created_at >= prev_start,
-                    Transaction.created_at < start_date,
-                    Transaction.status == 'completed'
-                )
-            ).scalar() or 0.0
-            
             growth_rate = ((total_revenue - float(prev_revenue)) / float(prev_revenue) * 100) if prev_revenue > 0 else 0
             
             return {
@@ -278,22 +313,8 @@ class RealAnalyticsService:
                     "average_transaction": round(total_revenue / total_transactions, 2) if total_transactions > 0 else 0,
                     "growth_rate": round(growth_rate, 2)
                 },
-                "daily_trends": [
-                    {
-                        "date": str(row.date),
-                        "revenue": float(row.revenue or 0),
-                        "transaction_count": row.transaction_count
-                    }
-                    for row in daily_revenue
-                ],
-                "revenue_by_category": [
-                    {
-                        "category": row.category,
-                        "revenue": float(row.revenue or 0),
-                        "count": row.count
-                    }
-                    for row in revenue_by_category
-                ],
+                "daily_trends": daily_revenue,
+                "revenue_by_category": revenue_by_category,
                 "top_members": [
                     {
                         "name": f"{row.first_name} {row.last_name}",
@@ -314,46 +335,101 @@ class RealAnalyticsService:
             logger.error(f"Revenue analytics error: {e}")
             return {"error": str(e)}
     
+    def _raw_revenue_trends(self, makerspace_id: str, start_date: datetime, prev_start: datetime) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], float]:
+        """Daily revenue, revenue by category and previous-period revenue from raw transactions"""
+        # Daily revenue trends
+        daily_revenue = self.db.query(
+            func.date(Transaction.created_at).label('date'),
+            func.sum(Transaction.amount).label('revenue'),
+            func.count(Transaction.id).label('transaction_count')
+        ).filter(
+            and_(
+                Transaction.makerspace_id == str(makerspace_id),
+                Transaction.created_at >= start_date,
+                Transaction.status == 'completed'
+            )
+        ).group_by(func.date(Transaction.created_at)).order_by('date').all()
+        
+        # Revenue by category
+        revenue_by_category = self.db.query(
+            Transaction.service_type.label('category'),
+            func.sum(Transaction.amount).label('revenue'),
+            func.count(Transaction.id).label('count')
+        ).filter(
+            and_(
+                Transaction.makerspace_id == str(makerspace_id),
+                Transaction.created_at >= start_date,
+                Transaction.status == 'completed'
+            )
+        ).group_by(Transaction.service_type).all()
+        
+        prev_revenue = self.db.query(func.sum(Transaction.amount)).filter(
+            and_(
+                Transaction.makerspace_id == str(makerspace_id),
+                Transaction.created_at >= prev_start,
+                Transaction.created_at < start_date,
+                Transaction.status == 'completed'
+            )
+        ).scalar() or 0.0
+        
+        return (
+            [
+                {
+                    "date": str(row.date),
+                    "revenue": float(row.revenue or 0),
+                    "transaction_count": row.transaction_count
+                }
+                for row in daily_revenue
+            ],
+            [
+                {
+                    "category": row.category,
+                    "revenue": float(row.revenue or 0),
+                    "count": row.count
+                }
+                for row in revenue_by_category
+            ],
+            float(prev_revenue)
+        )
+    
     def get_equipment_analytics(self, makerspace_id: str, days: int = 30) -> Dict[str, Any]:
         """Get detailed equipment analytics"""
         try:
-            start_date = datetime.utcnow() - timedelta(days=days)
+            start_date = self._window_start(days)
+            rolled_up_until = self.rollups.covered_until(makerspace_id, start_date)
             
             # Equipment utilization rates
-            equipment_stats = self.db.query(
-                Equipment.id,
-                Equipment.name,
-                Equipment.category,
-                Equipment.status,
-                func.count(EquipmentUsage.id).label('usage_sessions'),
-                func.sum(
-                    func.extract('epoch', EquipmentUsage.end_time - EquipmentUsage.start_time) / 3600
-                ).label('total_hours'),
-                func.avg(
-                    func.extract('epoch', EquipmentUsage.end_time - EquipmentUsage.start_time) / 3600
-                ).label('avg_session_hours')
-            ).outerjoin(
-                EquipmentUsage,
-                and_(
-                    EquipmentUsage.equipment_id == Equipment.id,
-                    EquipmentUsage.start_time >= start_date
-                )
-            ).filter(
-                Equipment.makerspace_id == makerspace_id
-            ).group_by(Equipment.id).all()
+            if rolled_up_until:
+                usage = self.rollups.equipment_usage(makerspace_id, start_date, rolled_up_until)
+            else:
+                usage = self._raw_equipment_usage(makerspace_id, start_date)
+            equipment_stats = []
+            for eq in self.db.query(
+                Equipment.id, Equipment.name, Equipment.category, Equipment.status
+            ).filter(Equipment.linked_makerspace_id == str(makerspace_id)).all():
+                stats = usage.get(eq.id, {"sessions": 0, "completed_sessions": 0, "total_hours": 0.0})
+                equipment_stats.append({
+                    "id": eq.id,
+                    "name": eq.name,
+                    "category": eq.category,
+                    "status": eq.status,
+                    "usage_sessions": stats["sessions"],
+                    "total_hours": stats["total_hours"],
+                    "avg_session_hours": stats["total_hours"] / stats["completed_sessions"] if stats["completed_sessions"] else 0.0
+                })
             
             # Maintenance tracking
             maintenance_due = self.db.query(
                 Equipment.id,
                 Equipment.name,
                 Equipment.next_maintenance_date,
-                Equipment.maintenance_hours_interval,
+                Equipment.maintenance_interval_hours,
                 func.sum(
-                    func.extract('epoch', EquipmentUsage.end_time - EquipmentUsage.start_time) / 3600
+                    func.extract('epoch', EquipmentUsageLog.session_end - EquipmentUsageLog.session_start) / 3600
                 ).label('hours_since_maintenance')
-            ).outerjoin(EquipmentUsage).filter(
+            ).outerjoin(EquipmentUsageLog, EquipmentUsageLog.equipment_id == Equipment.id).filter(
                 and_(
-                    Equipment.makerspace_id == makerspace_id,
+                    Equipment.linked_makerspace_id == str(makerspace_id),
                     Equipment.next_maintenance_date <= datetime.utcnow() + timedelta(days=7)
                 )
             ).group_by(Equipment.id).all()
@@ -363,14 +439,13 @@ class RealAnalyticsService:
                 Equipment.name,
                 EquipmentReservation.start_time,
                 EquipmentReservation.end_time,
-                Member.first_name,
-                Member.last_name
-            ).join(Equipment).join(Member).filter(
+                EquipmentReservation.user_name
+            ).join(Equipment).filter(
                 and_(
-                    Equipment.makerspace_id == makerspace_id,
+                    Equipment.linked_makerspace_id == str(makerspace_id),
                     EquipmentReservation.start_time >= datetime.utcnow(),
                     EquipmentReservation.start_time <= datetime.utcnow() + timedelta(days=7),
-                    EquipmentReservation.status == 'confirmed'
+                    EquipmentReservation.status == ReservationStatus.APPROVED
                 )
             ).order_by(EquipmentReservation.start_time).limit(20).all()
             
@@ -380,15 +455,15 @@ class RealAnalyticsService:
             
             equipment_list = []
             for eq in equipment_stats:
-                utilization_rate = (float(eq.total_hours or 0) / total_available_hours) * 100 if total_available_hours > 0 else 0
+                utilization_rate = (float(eq["total_hours"] or 0) / total_available_hours) * 100 if total_available_hours > 0 else 0
                 equipment_list.append({
-                    "id": eq.id,
-                    "name": eq.name,
-                    "category": eq.category,
-                    "status": eq.status,
-                    "usage_sessions": eq.usage_sessions or 0,
-                    "total_hours": round(float(eq.total_hours or 0), 2),
-                    "avg_session_hours": round(float(eq.avg_session_hours or 0), 2),
+                    "id": eq["id"],
+                    "name": eq["name"],
+                    "category": eq["category"],
+                    "status": eq["status"],
+                    "usage_sessions": eq["usage_sessions"] or 0,
+                    "total_hours": round(float(eq["total_hours"] or 0), 2),
+                    "avg_session_hours": round(float(eq["avg_session_hours"] or 0), 2),
                     "utilization_rate": round(utilization_rate, 1)
                 })
             
@@ -410,13 +485,13 @@ class RealAnalyticsService:
                         "equipment": res.name,
                         "start_time": res.start_time.isoformat(),
                         "end_time": res.end_time.isoformat(),
-                        "member": f"{res.first_name} {res.last_name}"
+                        "member": res.user_name
                     }
                     for res in upcoming_reservations
                 ],
                 "summary": {
                     "total_equipment": len(equipment_list),
-                    "active_equipment": len([eq for eq in equipment_list if eq["status"] == "operational"]),
+                    "active_equipment": len([eq for eq in equipment_list if eq["status"] in (EquipmentStatus.AVAILABLE, EquipmentStatus.IN_USE)]),
                     "maintenance_due": len(maintenance_due),
                     "average_utilization": round(sum(eq["utilization_rate"] for eq in equipment_list) / len(equipment_list), 1) if equipment_list else 0
                 }
@@ -437,14 +512,14 @@ class RealAnalyticsService:
                 Member.first_name,
                 Member.last_name,
                 Member.email,
-                Member.membership_type,
-                func.count(MemberActivity.id).label('activity_count'),
-                func.max(MemberActivity.timestamp).label('last_activity')
+                Member.membership_plan_id,
+                func.count(MemberActivityLog.id).label('activity_count'),
+                func.max(MemberActivityLog.created_at).label('last_activity')
             ).outerjoin(
-                MemberActivity,
+                MemberActivityLog,
                 and_(
-                    MemberActivity.member_id == Member.id,
-                    MemberActivity.timestamp >= start_date
+                    MemberActivityLog.member_id == Member.id,
+                    MemberActivityLog.created_at >= start_date
                 )
             ).filter(
                 Member.makerspace_id == makerspace_id
@@ -452,33 +527,35 @@ class RealAnalyticsService:
             
             # Skills and certifications
             skills_distribution = self.db.query(
-                MemberSkill.skill_name,
-                MemberSkill.skill_level,
-                func.count(MemberSkill.id).label('member_count')
-            ).join(Member).filter(
-                Member.makerspace_id == makerspace_id
-            ).group_by(MemberSkill.skill_name, MemberSkill.skill_level).all()
-            
-            # Recent certifications
+                Skill.name.label('skill_name'),
+                Skill.level.label('skill_level'),
+                func.count(UserSkill.id).label('member_count')
+            ).join(UserSkill, UserSkill.skill_id == Skill.id).filter(
+                Skill.makerspace_id == str(makerspace_id)
+            ).group_by(Skill.name, Skill.level).all()
+            
+            # Recent certifications (certifications record the member's Keycloak user id)
             recent_certifications = self.db.query(
-                Certification.certification_name,
-                Certification.certification_date,
+                Skill.name.label('certification_name'),
+                UserCertification.issued_at.label('certification_date'),
                 Member.first_name,
                 Member.last_name
-            ).join(Member).filter(
+            ).join(Skill, Skill.id == UserCertification.skill_id).join(
+                Member, Member.keycloak_user_id == UserCertification.user_id
+            ).filter(
                 and_(
                     Member.makerspace_id == makerspace_id,
-                    Certification.certification_date >= start_date
+                    UserCertification.issued_at >= start_date
                 )
-            ).order_by(Certification.certification_date.desc()).limit(10).all()
+            ).order_by(UserCertification.issued_at.desc()).limit(10).all()
             
-            # Membership type distribution
+            # Membership plan distribution
             membership_distribution = self.db.query(
-                Member.membership_type,
+                Member.membership_plan_id,
                 func.count(Member.id).label('count')
             ).filter(
                 Member.makerspace_id == makerspace_id
-            ).group_by(Member.membership_type).all()
+            ).group_by(Member.membership_plan_id).all()
             
             # Engagement categories
             high_engagement = len([m for m in member_activity if (m.activity_count or 0) >= 20])
@@ -495,7 +572,7 @@ class RealAnalyticsService:
                     "low_engagement": low_engagement
                 },
                 "membership_distribution": [
-                    {"type": row.membership_type, "count": row.count}
+                    {"type": str(row.membership_plan_id), "count": row.count}
                     for row in membership_distribution
                 ],
                 "skills_distribution": [
@@ -531,30 +608,30 @@ class RealAnalyticsService:
             start_date = datetime.utcnow() - timedelta(days=days)
             
             # Safety incidents
-            incidents = self.db.query(
+            incidents = self._safety_incidents(
                 SafetyIncident.id,
-                SafetyIncident.incident_date,
+                SafetyIncident.occurred_at,
                 SafetyIncident.incident_type,
                 SafetyIncident.severity,
                 SafetyIncident.description,
-                SafetyIncident.equipment_involved,
-                SafetyIncident.resolution_status
+                Equipment.name.label('equipment_involved'),
+                case((SafetyIncident.resolved_at.isnot(None), 'resolved'), else_='open').label('resolution_status')
             ).filter(
                 and_(
-                    SafetyIncident.makerspace_id == makerspace_id,
-                    SafetyIncident.incident_date >= start_date.date()
+                    Equipment.linked_makerspace_id == str(makerspace_id),
+                    SafetyIncident.occurred_at >= start_date
                 )
-            ).order_by(SafetyIncident.incident_date.desc()).all()
+            ).order_by(SafetyIncident.occurred_at.desc()).all()
             
             # Incident trends by type
-            incident_trends = self.db.query(
+            incident_trends = self._safety_incidents(
                 SafetyIncident.incident_type,
                 SafetyIncident.severity,
                 func.count(SafetyIncident.id).label('count')
             ).filter(
                 and_(
-                    SafetyIncident.makerspace_id == makerspace_id,
-                    SafetyIncident.incident_date >= start_date.date()
+                    Equipment.linked_makerspace_id == str(makerspace_id),
+                    SafetyIncident.occurred_at >= start_date
                 )
             ).group_by(SafetyIncident.incident_type, SafetyIncident.severity).all()
             
@@ -565,10 +642,10 @@ class RealAnalyticsService:
                 func.count(SafetyIncident.id).label('incident_count')
             ).outerjoin(
                 SafetyIncident,
-                SafetyIncident.equipment_involved == Equipment.name
+                SafetyIncident.equipment_id == Equipment.id
             ).filter(
-                Equipment.makerspace_id == makerspace_id
-            ).group_by(Equipment.id).order_by('incident_count desc').all()
+                Equipment.linked_makerspace_id == str(makerspace_id)
+            ).group_by(Equipment.id).order_by(desc('incident_count')).all()
             
             return {
                 "period_days": days,
@@ -581,7 +658,7 @@ class RealAnalyticsService:
                 "incidents": [
                     {
                         "id": inc.id,
-                        "date": inc.incident_date.isoformat(),
+                        "date": inc.occurred_at.isoformat(),
                         "type": inc.incident_type,
                         "severity": inc.severity,
                         "description": inc.description,
@@ -620,7 +697,7 @@ class RealAnalyticsService:
             # Check for overdue maintenance
             overdue_maintenance = self.db.query(func.count(Equipment.id)).filter(
                 and_(
-                    Equipment.makerspace_id == makerspace_id,
+                    Equipment.linked_makerspace_id == str(makerspace_id),
                     Equipment.next_maintenance_date < datetime.utcnow()
                 )
             ).scalar() or 0
@@ -634,11 +711,11 @@ class RealAnalyticsService:
                 })
             
             # Check for critical safety incidents
-            critical_incidents = self.db.query(func.count(SafetyIncident.id)).filter(
+            critical_incidents = self._safety_incidents(func.count(SafetyIncident.id)).filter(
                 and_(
-                    SafetyIncident.makerspace_id == makerspace_id,
+                    Equipment.linked_makerspace_id == str(makerspace_id),
                     SafetyIncident.severity == 'critical',
-                    SafetyIncident.resolution_status == 'open'
+                    SafetyIncident.resolved_at.is_(None)
                 )
             ).scalar() or 0
             
@@ -653,8 +730,8 @@ class RealAnalyticsService:
             # Check equipment status
             offline_equipment = self.db.query(func.count(Equipment.id)).filter(
                 and_(
-                    Equipment.makerspace_id == makerspace_id,
-                    Equipment.status == 'offline'
+                    Equipment.linked_makerspace_id == str(makerspace_id),
+                    Equipment.status == EquipmentStatus.OFFLINE
                 )
             ).scalar() or 0
             
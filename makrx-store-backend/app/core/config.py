@@ -101,9 +101,33 @@ class Settings(BaseSettings):
     MAX_UPLOAD_SIZE: int = Field(100 * 1024 * 1024, description="Max file size in bytes (100MB)")
     ALLOWED_UPLOAD_EXTENSIONS: List[str] = [".stl", ".obj", ".3mf", ".step", ".stp"]
     
+    # Mesh analysis worker pool
+    ANALYSIS_WORKERS: int = Field(2, description="Concurrent mesh analysis worker processes")
+    ANALYSIS_QUEUE_SIZE: int = Field(32, description="Max queued + running analysis jobs")
+    ANALYSIS_JOB_TIMEOUT: int = Field(300, description="Per-job analysis timeout in seconds")
+    ANALYSIS_MAX_TRIANGLES: int = Field(5_000_000, description="Largest mesh accepted for analysis")
+    ANALYSIS_CACHE_MAX_ENTRIES: int = Field(512, description="In-memory analysis cache entries")
+    ANALYSIS_CACHE_MAX_BYTES: int = Field(64 * 1024 * 1024, description="In-memory analysis cache size in bytes")
+    ANALYSIS_CACHE_TTL: int = Field(7 * 24 * 3600, description="Redis analysis cache TTL in seconds")
+    
+    # BOM import product matching
+    BOM_MATCH_INDEX_REFRESH_INTERVAL: int = Field(30, description="Seconds between product match index change checks")
+    BOM_MATCH_INDEX_REBUILD_INTERVAL: int = Field(3600, description="Seconds between full product match index rebuilds")
+    
+    # Catalog search facets
+    FACET_INDEX_REFRESH_INTERVAL: int = Field(30, description="Seconds between facet index change checks")
+    FACET_INDEX_REBUILD_INTERVAL: int = Field(3600, description="Seconds between full facet index rebuilds")
+    CATEGORY_TREE_CACHE_TTL: int = Field(300, description="Max age in seconds of the cached category tree")
+    
     # Rate Limiting
     RATE_LIMIT_REQUESTS: int = Field(100, description="Requests per window")
     RATE_LIMIT_WINDOW: int = Field(3600, description="Rate limit window in seconds")
+    RATE_LIMIT_ALGORITHM: str = Field("sliding_window", regex="^(sliding_window|token_bucket)$")
+    RATE_LIMIT_REDIS_MAX_CONNECTIONS: int = Field(50, description="Redis connection pool size for rate limiting")
+    RATE_LIMIT_LOCAL_TIER: bool = Field(True, description="Decide clearly-under-limit requests in-process")
+    RATE_LIMIT_LOCAL_MAX_KEYS: int = Field(100_000, description="Client keys tracked by the local rate limit tier")
+    RATE_LIMIT_LOCAL_THRESHOLD: float = Field(0.8, description="Fraction of a limit after which requests go to Redis")
+    RATE_LIMIT_LOCAL_SYNC_INTERVAL: float = Field(1.0, description="Seconds between local count syncs to Redis")
     
     # Email Configuration (for notifications)
     SMTP_HOST: Optional[str] = Field(None, description="SMTP server host")
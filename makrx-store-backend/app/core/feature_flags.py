@@ -9,13 +9,17 @@ Implements API guards and decorators per specification:
 
 import json
 import logging
-from typing import Optional, Dict, Any, List, Callable
-from functools import wraps
+from typing import Optional, Dict, Any, List, Callable, Mapping, FrozenSet
+from functools import wraps, lru_cache
+from dataclasses import dataclass
+from types import MappingProxyType
 from fastapi import HTTPException, status, Depends, Request
 from fastapi.responses import JSONResponse
 import hashlib
 from datetime import datetime, timedelta
 
+from app.core.config import settings
+
 logger = logging.getLogger(__name__)
 
 # ==========================================
@@ -80,13 +84,73 @@ class FlagDefinition:
         self.percentage_rollout = percentage_rollout
         self.config_value = config_value
 
+# Roles that see flags in the "internal" rollout state
+INTERNAL_ROLES = frozenset({"superadmin", "store_admin", "makerspace_admin"})
+
+@lru_cache(maxsize=65536)
+def rollout_bucket(flag_key: str, identifier: str) -> int:
+    """Stable 0-99 bucket for percentage rollouts, memoized per flag and identifier"""
+    return int(hashlib.md5(f"{flag_key}:{identifier}".encode()).hexdigest(), 16) % 100
+
+def _result(enabled: bool, value: Any, reason: str) -> Mapping[str, Any]:
+    return MappingProxyType({"enabled": enabled, "value": value, "reason": reason})
+
+_PERCENTAGE_OFF = _result(False, False, "percentage_rollout")
+
+@dataclass(frozen=True)
+class CompiledFlag:
+    """A flag definition reduced to set/bitmask checks and prebuilt results"""
+    key: str
+    static_result: Optional[Mapping[str, Any]]  # outcome that does not depend on the context
+    internal_only: bool
+    scope: str
+    role_mask: int
+    users: FrozenSet[str]
+    spaces: FrozenSet[str]
+    countries: FrozenSet[str]
+    pincodes: FrozenSet[str]
+    is_percentage: bool
+    percentage_rollout: Optional[int]
+    enabled_result: Mapping[str, Any]
+    internal_result: Mapping[str, Any]
+    targeting_result: Mapping[str, Any]
+
+@dataclass(frozen=True)
+class CompiledFlags:
+    """Immutable snapshot of every compiled flag; replaced whole when flags change"""
+    flags: Dict[str, CompiledFlag]
+    role_bits: Dict[str, int]
+    internal_mask: int
+
+@dataclass(frozen=True)
+class ContextView:
+    """The parts of a FlagContext the compiled rules read, derived once per evaluation"""
+    role_mask: int
+    user_id: Optional[str]
+    makerspace_id: Optional[str]
+    country: Optional[str]
+    pincode: Optional[str]
+    identifier: str
+
 class FeatureFlagEngine:
-    """Backend feature flag engine"""
+    """
+    Backend feature flag engine
+    
+    Definitions are compiled into an immutable CompiledFlags snapshot, so
+    evaluation reads it without locking; change flags through set_flag /
+    remove_flag, which swap in a recompiled snapshot.
+    """
     
     def __init__(self):
-        self.flags: Dict[str, FlagDefinition] = {}
+        self._definitions: Dict[str, FlagDefinition] = {}
+        self._compiled = CompiledFlags(flags={}, role_bits={}, internal_mask=0)
         self._load_default_flags()
     
+    @property
+    def flags(self) -> Mapping[str, FlagDefinition]:
+        """Read-only view of the flag definitions"""
+        return MappingProxyType(self._definitions)
+    
     def _load_default_flags(self):
         """Load default flags from configuration"""
         # Key flags for API protection
@@ -224,115 +288,151 @@ class FeatureFlagEngine:
             )
         ]
         
-        for flag in default_flags:
-            self.flags[flag.key] = flag
+        self._definitions = {flag.key: flag for flag in default_flags}
+        self.recompile()
     
-    def evaluate(self, flag_key: str, context: FlagContext, default_value: Any = None) -> Dict[str, Any]:
-        """Evaluate a feature flag"""
-        flag = self.flags.get(flag_key)
-        
-        if not flag:
-            return {
-                "enabled": False,
-                "value": default_value or False,
-                "reason": "flag_not_found"
-            }
-        
-        # Check rollout state
-        if flag.rollout_state == "off":
-            return {
-                "enabled": False,
-                "value": flag.default_value,
-                "reason": "rollout_off"
-            }
-        
-        # Internal rollout - only for admins
-        if flag.rollout_state == "internal":
-            is_internal = any(role in ["superadmin", "store_admin", "makerspace_admin"] 
-                            for role in context.roles)
-            if not is_internal:
-                return {
-                    "enabled": False,
-                    "value": flag.default_value,
-                    "reason": "internal_only"
-                }
+    def set_flag(self, flag: FlagDefinition):
+        """Add or replace a flag definition"""
+        self._definitions = {**self._definitions, flag.key: flag}
+        self.recompile()
+    
+    def remove_flag(self, flag_key: str):
+        """Remove a flag definition"""
+        self._definitions = {key: flag for key, flag in self._definitions.items() if key != flag_key}
+        self.recompile()
+    
+    def recompile(self):
+        """Compile the current definitions and swap the snapshot in"""
+        roles = set(INTERNAL_ROLES)
+        for flag in self._definitions.values():
+            roles.update(flag.enabled_for_roles)
+        role_bits = {role: 1 << bit for bit, role in enumerate(sorted(roles))}
         
-        # Evaluate targeting
-        if not self._evaluate_targeting(flag, context):
-            return {
-                "enabled": False,
-                "value": flag.default_value,
-                "reason": "targeting_failed"
-            }
+        self._compiled = CompiledFlags(
+            flags={key: self._compile(flag, role_bits) for key, flag in self._definitions.items()},
+            role_bits=role_bits,
+            internal_mask=self._role_mask(INTERNAL_ROLES, role_bits)
+        )
+    
+    @staticmethod
+    def _role_mask(roles, role_bits: Dict[str, int]) -> int:
+        mask = 0
+        for role in roles:
+            mask |= role_bits.get(role, 0)
+        return mask
+    
+    def _compile(self, flag: FlagDefinition, role_bits: Dict[str, int]) -> CompiledFlag:
+        def default_result(reason: str) -> Mapping[str, Any]:
+            return _result(False, flag.default_value, reason)
         
-        # Evaluate flag type
         if flag.flag_type == "boolean":
-            return {
-                "enabled": True,
-                "value": True,
-                "reason": "enabled"
-            }
-        elif flag.flag_type == "percentage":
-            enabled = self._evaluate_percentage(flag, context)
-            return {
-                "enabled": enabled,
-                "value": enabled,
-                "reason": "percentage_rollout"
-            }
+            enabled_result = _result(True, True, "enabled")
         elif flag.flag_type == "config":
-            return {
-                "enabled": True,
-                "value": flag.config_value or flag.default_value,
-                "reason": "config_value"
-            }
+            enabled_result = _result(True, flag.config_value or flag.default_value, "config_value")
+        elif flag.flag_type == "percentage":
+            enabled_result = _result(True, True, "percentage_rollout")
+        else:
+            enabled_result = default_result("unknown_type")
         
-        return {
-            "enabled": False,
-            "value": flag.default_value,
-            "reason": "unknown_type"
-        }
+        # A scope with no targets configured matches nobody, except global and audience
+        targetable = (
+            flag.scope == "global"
+            or flag.scope == "audience"
+            or (flag.scope == "role" and flag.enabled_for_roles)
+            or (flag.scope == "user" and flag.enabled_for_users)
+            or (flag.scope == "space" and flag.enabled_for_spaces)
+        )
+        
+        static_result = None
+        if flag.rollout_state == "off":
+            static_result = default_result("rollout_off")
+        elif not targetable:
+            static_result = default_result("targeting_failed") if flag.rollout_state != "internal" else None
+        elif flag.scope == "global" and flag.rollout_state != "internal" and flag.flag_type != "percentage":
+            static_result = enabled_result
+        
+        return CompiledFlag(
+            key=flag.key,
+            static_result=static_result,
+            internal_only=flag.rollout_state == "internal",
+            scope=flag.scope if targetable else "none",
+            role_mask=self._role_mask(flag.enabled_for_roles, role_bits),
+            users=frozenset(flag.enabled_for_users),
+            spaces=frozenset(flag.enabled_for_spaces),
+            countries=frozenset(flag.enabled_for_countries),
+            pincodes=frozenset(flag.enabled_for_pincodes),
+            is_percentage=flag.flag_type == "percentage",
+            percentage_rollout=flag.percentage_rollout,
+            enabled_result=enabled_result,
+            internal_result=default_result("internal_only"),
+            targeting_result=default_result("targeting_failed")
+        )
     
-    def _evaluate_targeting(self, flag: FlagDefinition, context: FlagContext) -> bool:
-        """Evaluate targeting rules"""
-        if flag.scope == "global":
-            return True
+    def _view(self, context: FlagContext, compiled: CompiledFlags) -> ContextView:
+        return ContextView(
+            role_mask=self._role_mask(context.roles, compiled.role_bits),
+            user_id=context.user_id,
+            makerspace_id=context.makerspace_id,
+            country=context.country,
+            pincode=context.pincode,
+            identifier=context.user_id or context.session_id or "anonymous"
+        )
+    
+    def _evaluate_compiled(self, flag: CompiledFlag, view: ContextView, internal_mask: int) -> Mapping[str, Any]:
+        if flag.static_result is not None:
+            return flag.static_result
         
-        if flag.scope == "role" and flag.enabled_for_roles:
-            return any(role in flag.enabled_for_roles for role in context.roles)
+        # Internal rollout - only for admins
+        if flag.internal_only and not view.role_mask & internal_mask:
+            return flag.internal_result
         
-        if flag.scope == "user" and flag.enabled_for_users:
-            return context.user_id in flag.enabled_for_users
+        # Evaluate targeting
+        if flag.scope == "role":
+            targeted = bool(view.role_mask & flag.role_mask)
+        elif flag.scope == "user":
+            targeted = view.user_id in flag.users
+        elif flag.scope == "space":
+            targeted = bool(view.makerspace_id) and view.makerspace_id in flag.spaces
+        elif flag.scope == "audience":
+            targeted = not (
+                (flag.countries and view.country and view.country not in flag.countries)
+                or (flag.pincodes and view.pincode and view.pincode not in flag.pincodes)
+            )
+        else:
+            targeted = flag.scope == "global"
         
-        if flag.scope == "space" and flag.enabled_for_spaces:
-            if not context.makerspace_id:
-                return False
-            return context.makerspace_id in flag.enabled_for_spaces
+        if not targeted:
+            return flag.targeting_result
         
-        if flag.scope == "audience":
-            # Country targeting
-            if flag.enabled_for_countries and context.country:
-                if context.country not in flag.enabled_for_countries:
-                    return False
-            
-            # Pincode targeting
-            if flag.enabled_for_pincodes and context.pincode:
-                if context.pincode not in flag.enabled_for_pincodes:
-                    return False
-            
-            return True
+        if flag.is_percentage:
+            if flag.percentage_rollout and rollout_bucket(flag.key, view.identifier) < flag.percentage_rollout:
+                return flag.enabled_result
+            return _PERCENTAGE_OFF
         
-        return False
+        return flag.enabled_result
     
-    def _evaluate_percentage(self, flag: FlagDefinition, context: FlagContext) -> bool:
-        """Evaluate percentage rollout"""
-        if not flag.percentage_rollout:
-            return False
+    def evaluate(self, flag_key: str, context: FlagContext, default_value: Any = None) -> Dict[str, Any]:
+        """Evaluate a feature flag"""
+        compiled = self._compiled
+        flag = compiled.flags.get(flag_key)
         
-        identifier = context.user_id or context.session_id or "anonymous"
-        hash_val = int(hashlib.md5(f"{flag.key}:{identifier}".encode()).hexdigest(), 16)
-        percentage = hash_val % 100
+        if not flag:
+            return {
+                "enabled": False,
+                "value": default_value or False,
+                "reason": "flag_not_found"
+            }
         
-        return percentage < flag.percentage_rollout
+        return dict(self._evaluate_compiled(flag, self._view(context, compiled), compiled.internal_mask))
+    
+    def evaluate_all(self, context: FlagContext) -> Dict[str, Mapping[str, Any]]:
+        """Evaluate every flag for one context in a single pass; results are read-only"""
+        compiled = self._compiled
+        view = self._view(context, compiled)
+        return {
+            key: self._evaluate_compiled(flag, view, compiled.internal_mask)
+            for key, flag in compiled.flags.items()
+        }
 
 # Global flag engine instance
 flag_engine = FeatureFlagEngine()
@@ -359,6 +459,19 @@ async def get_flag_context(request: Request) -> FlagContext:
     """Dependency to get flag context"""
     return build_flag_context(request)
 
+def get_request_flags(request: Request, user_info: Optional[Dict[str, Any]] = None) -> Dict[str, Mapping[str, Any]]:
+    """
+    Every flag evaluated for this request, computed on first use and kept
+    on request.state so later guards on the same request just look up
+    """
+    flags = getattr(request.state, "feature_flags", None)
+    if flags is None:
+        context = build_flag_context(request, user_info)
+        flags = flag_engine.evaluate_all(context)
+        request.state.flag_context = context
+        request.state.feature_flags = flags
+    return flags
+
 # ==========================================
 # Decorators and Guards
 # ==========================================
@@ -404,13 +517,10 @@ def require_flag(flag_key: str, default_value: Any = False, for_authenticated: b
                 # For now, we'll simulate based on auth presence
                 user_info = {"user_id": "user_123", "roles": ["user"]}
             
-            # Build flag context
-            context = build_flag_context(request, user_info)
-            
-            # Evaluate flag
-            result = flag_engine.evaluate(flag_key, context, default_value)
+            # Evaluate flags (once per request)
+            result = get_request_flags(request, user_info).get(flag_key)
             
-            if not result["enabled"] or not result["value"]:
+            if not result or not result["enabled"] or not result["value"]:
                 # Determine response based on authentication and flag type
                 if user_info and for_authenticated:
                     # Authenticated user but not allowed
@@ -576,6 +686,7 @@ __all__ = [
     "get_flag_value",
     "build_flag_context",
     "get_flag_context",
+    "get_request_flags",
     "KillSwitch",
     "feature_disabled_response",
     "feature_not_available_response",
@@ -228,7 +228,7 @@ def calculate_file_hash(file_obj: BinaryIO) -> str:
     file_obj.seek(0)
     
     # Read file in chunks
-    for chunk in iter(lambda: file_obj.read(4096), b""):
+    for chunk in iter(lambda: file_obj.read(1024 * 1024), b""):
         sha256_hash.update(chunk)
     
     # Reset file pointer again
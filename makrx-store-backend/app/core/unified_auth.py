@@ -2,10 +2,14 @@
 Unified Authentication System
 One Keycloak realm with precise JWT handling as specified
 """
+import asyncio
+import hashlib
+import time
 import httpx
 import jwt
 import logging
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timedelta
@@ -26,30 +30,104 @@ class UnifiedAuth:
     audience = client id for each service
     """
     
+    # JWKS is refreshed in the background once older than this
+    JWKS_REFRESH_AFTER = timedelta(hours=1)
+    # Stale keys are still served while a refresh is pending, up to this age
+    JWKS_MAX_STALE = timedelta(hours=24)
+    # Minimum gap between forced refetches triggered by unknown key IDs
+    JWKS_UNKNOWN_KID_REFETCH = timedelta(seconds=30)
+    
+    # Verified claims are reused until the token's exp, capped by this TTL
+    VERIFIED_CACHE_TTL = 300
+    VERIFIED_CACHE_MAX_ENTRIES = 10_000
+    
     def __init__(self):
         self.keycloak_url = settings.KEYCLOAK_URL
         self.realm = settings.KEYCLOAK_REALM
         self.jwks_cache = {}
         self.jwks_cache_expiry = None
-        
-    async def get_jwks(self) -> Dict[str, Any]:
-        """Get JWKS from Keycloak with caching"""
-        if (self.jwks_cache_expiry and 
-            datetime.utcnow() < self.jwks_cache_expiry and 
-            self.jwks_cache):
-            return self.jwks_cache
+        self.jwks_fetched_at: Optional[datetime] = None
+        # Parsed public keys indexed by kid, rebuilt on every JWKS fetch
+        self.signing_keys: Dict[str, Any] = {}
+        # sha256(audience:token) -> (claims, expires_at epoch seconds)
+        self.verified_tokens: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._last_forced_refresh: Optional[datetime] = None
+    
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """Pooled client shared by all JWKS fetches"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(5.0),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
+            )
+        return self._http_client
+    
+    async def close(self):
+        """Release the pooled HTTP client"""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+    
+    async def _fetch_jwks(self) -> Dict[str, Any]:
+        """Fetch JWKS and rebuild the kid -> key index; concurrent callers share one fetch"""
+        started = datetime.utcnow()
+        async with self._refresh_lock:
+            # Another caller refreshed while we waited for the lock
+            if self.jwks_fetched_at and self.jwks_fetched_at >= started:
+                return self.jwks_cache
+            
+            response = await self.http_client.get(
+                f"{self.keycloak_url}/realms/{self.realm}/protocol/openid-connect/certs"
+            )
+            response.raise_for_status()
+            jwks = response.json()
             
+            signing_keys = {}
+            for jwk in jwks.get('keys', []):
+                kid = jwk.get('kid')
+                if not kid or jwk.get('kty') != 'RSA':
+                    continue
+                try:
+                    signing_keys[kid] = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+                except Exception as e:
+                    logger.warning(f"Skipping unusable JWKS key {kid}: {e}")
+            
+            self.jwks_cache = jwks
+            self.signing_keys = signing_keys
+            self.jwks_fetched_at = datetime.utcnow()
+            self.jwks_cache_expiry = self.jwks_fetched_at + self.JWKS_REFRESH_AFTER
+            return jwks
+    
+    async def _background_refresh(self):
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.keycloak_url}/realms/{self.realm}/protocol/openid-connect/certs"
-                )
-                response.raise_for_status()
-                
-                self.jwks_cache = response.json()
-                self.jwks_cache_expiry = datetime.utcnow() + timedelta(hours=1)
+            await self._fetch_jwks()
+        except Exception as e:
+            logger.error(f"Background JWKS refresh failed, serving cached keys: {e}")
+    
+    async def get_jwks(self) -> Dict[str, Any]:
+        """
+        Get JWKS from Keycloak with caching.
+        Past the refresh age the cached set is served while a background
+        refresh runs (stale-while-revalidate); only a missing or too-stale
+        cache blocks on the network.
+        """
+        now = datetime.utcnow()
+        if self.jwks_cache and self.jwks_fetched_at:
+            if now < self.jwks_cache_expiry:
+                return self.jwks_cache
+            if now < self.jwks_fetched_at + self.JWKS_MAX_STALE:
+                if self._refresh_task is None or self._refresh_task.done():
+                    self._refresh_task = asyncio.create_task(self._background_refresh())
                 return self.jwks_cache
-                
+        
+        try:
+            return await self._fetch_jwks()
         except Exception as e:
             logger.error(f"Failed to fetch JWKS: {e}")
             raise HTTPException(
@@ -57,13 +135,56 @@ class UnifiedAuth:
                 detail="Authentication service unavailable"
             )
     
+    async def get_signing_key(self, kid: str) -> Optional[Any]:
+        """Public key for a kid; an unknown kid triggers a rate-limited refetch (key rotation)"""
+        await self.get_jwks()
+        key = self.signing_keys.get(kid)
+        if key is not None:
+            return key
+        
+        now = datetime.utcnow()
+        if (self._last_forced_refresh is None or
+                now - self._last_forced_refresh >= self.JWKS_UNKNOWN_KID_REFETCH):
+            self._last_forced_refresh = now
+            try:
+                await self._fetch_jwks()
+            except Exception as e:
+                logger.error(f"JWKS refetch for unknown key {kid} failed: {e}")
+        return self.signing_keys.get(kid)
+    
+    def _get_verified(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        cached = self.verified_tokens.get(cache_key)
+        if cached is None:
+            return None
+        claims, expires_at = cached
+        if time.time() >= expires_at:
+            del self.verified_tokens[cache_key]
+            return None
+        self.verified_tokens.move_to_end(cache_key)
+        return claims
+    
+    def _store_verified(self, cache_key: str, claims: Dict[str, Any]):
+        expires_at = time.time() + self.VERIFIED_CACHE_TTL
+        if isinstance(claims.get('exp'), (int, float)):
+            expires_at = min(expires_at, claims['exp'])
+        self.verified_tokens[cache_key] = (claims, expires_at)
+        self.verified_tokens.move_to_end(cache_key)
+        while len(self.verified_tokens) > self.VERIFIED_CACHE_MAX_ENTRIES:
+            self.verified_tokens.popitem(last=False)
+    
     async def verify_jwt(self, token: str, expected_audience: str) -> Dict[str, Any]:
         """
         Verify JWT with exact rules:
         - Validate issuer/audience
         - Check expiration
         - Verify signature with JWKS
+        Successfully verified tokens are cached until they expire.
         """
+        cache_key = hashlib.sha256(f"{expected_audience}:{token}".encode()).hexdigest()
+        cached = self._get_verified(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             # Decode header to get key ID
             header = jwt.get_unverified_header(token)
@@ -75,14 +196,7 @@ class UnifiedAuth:
                     detail="Invalid token: missing key ID"
                 )
             
-            # Get JWKS and find matching key
-            jwks = await self.get_jwks()
-            key = None
-            
-            for jwk in jwks.get('keys', []):
-                if jwk.get('kid') == kid:
-                    key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
-                    break
+            key = await self.get_signing_key(kid)
             
             if not key:
                 raise HTTPException(
@@ -101,6 +215,7 @@ class UnifiedAuth:
                 audience=expected_audience
             )
             
+            self._store_verified(cache_key, payload)
             return payload
             
         except jwt.ExpiredSignatureError:
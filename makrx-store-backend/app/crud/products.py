@@ -4,16 +4,82 @@ Database operations for product management
 """
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, or_, desc, asc, text
+from sqlalchemy import select, func, and_, or_, desc, asc, text, literal, tuple_
 from sqlalchemy.orm import selectinload
 from typing import List, Optional, Tuple, Dict, Any
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import base64
+import json
 import logging
+import re
 
 from app.models.commerce import Product, Category, OrderItem
 from app.schemas import ProductCreate, ProductUpdate, ProductSearch, ProductFilter, ProductSort
 
 logger = logging.getLogger(__name__)
 
+# Text search configuration used by the products.search_vector generated column
+SEARCH_CONFIG = "english"
+
+_SEARCH_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def build_prefix_tsquery(q: str) -> Optional[str]:
+    """Turn free text into a tsquery string where every term is a prefix match"""
+    tokens = _SEARCH_TOKEN_RE.findall(q.lower())
+    if not tokens:
+        return None
+    return " & ".join(f"{token}:*" for token in tokens)
+
+def build_search_clauses(q: str) -> Tuple[Any, Any]:
+    """
+    Build the search filter and relevance expression for a query string.
+    Matches the weighted tsvector (prefix terms) or trigram word similarity on
+    name/brand, so partially typed and misspelled terms still hit an index.
+    """
+    term = literal(q.strip())
+    name_similarity = func.word_similarity(term, Product.name)
+    conditions = [
+        term.op("<%")(Product.name),
+        term.op("<%")(Product.brand),
+    ]
+    rank = name_similarity
+    
+    tsquery_text = build_prefix_tsquery(q)
+    if tsquery_text:
+        tsquery = func.to_tsquery(SEARCH_CONFIG, tsquery_text)
+        conditions.insert(0, Product.search_vector.op("@@")(tsquery))
+        rank = func.ts_rank_cd(Product.search_vector, tsquery) + name_similarity
+    
+    return or_(*conditions), rank
+
+# Sort orders that support keyset (cursor) pagination: sort -> (key expression, direction)
+KEYSET_SORTS = {
+    ProductSort.NAME_ASC: (Product.name, asc),
+    ProductSort.NAME_DESC: (Product.name, desc),
+    ProductSort.PRICE_ASC: (func.coalesce(Product.sale_price, Product.price), asc),
+    ProductSort.PRICE_DESC: (func.coalesce(Product.sale_price, Product.price), desc),
+    ProductSort.CREATED_ASC: (Product.created_at, asc),
+    ProductSort.CREATED_DESC: (Product.created_at, desc),
+}
+
+def decode_cursor(cursor: str, sort: ProductSort) -> Tuple[Any, int]:
+    """Decode a keyset cursor into (last sort value, last product id)"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if payload["s"] != sort.value:
+            raise ValueError("cursor was issued for a different sort order")
+        
+        value = payload["v"]
+        if sort in (ProductSort.PRICE_ASC, ProductSort.PRICE_DESC):
+            value = Decimal(value)
+        elif sort in (ProductSort.CREATED_ASC, ProductSort.CREATED_DESC):
+            value = datetime.fromisoformat(value)
+        
+        return value, int(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidOperation) as e:
+        raise ValueError(f"Invalid pagination cursor: {e}")
+
 class ProductCRUD:
     """CRUD operations for products"""
     
@@ -90,154 +156,165 @@ class ProductCRUD:
             logger.error(f"Failed to delete product {product_id}: {e}")
             return False
     
-    async def search_products(self, db: AsyncSession, search: ProductSearch) -> Tuple[List[Product], int]:
-        """Search products with filtering, sorting, and pagination"""
-        try:
-            # Base query
-            query = select(Product).options(
-                selectinload(Product.category)
-            ).where(Product.is_active == True)
+    def _build_search_conditions(self, search: ProductSearch) -> Tuple[List[Any], Any]:
+        """Build the WHERE conditions and optional relevance expression for a search"""
+        conditions = [Product.is_active == True]
+        search_rank = None
+        
+        if search.filters:
+            filters = search.filters
             
-            # Count query for pagination
-            count_query = select(func.count(Product.id)).where(Product.is_active == True)
+            # Category filter
+            if filters.category_id:
+                conditions.append(Product.category_id == filters.category_id)
             
-            # Apply filters
-            if search.filters:
-                filters = search.filters
-                
-                # Category filter
-                if filters.category_id:
-                    query = query.where(Product.category_id == filters.category_id)
-                    count_query = count_query.where(Product.category_id == filters.category_id)
-                
-                # Brand filter
-                if filters.brand:
-                    query = query.where(Product.brand.ilike(f"%{filters.brand}%"))
-                    count_query = count_query.where(Product.brand.ilike(f"%{filters.brand}%"))
-                
-                # Price range filters
-                if filters.price_min is not None:
-                    query = query.where(
-                        or_(
-                            and_(Product.sale_price.isnot(None), Product.sale_price >= filters.price_min),
-                            and_(Product.sale_price.is_(None), Product.price >= filters.price_min)
-                        )
+            # Brand filter
+            if filters.brand:
+                conditions.append(Product.brand.ilike(f"%{filters.brand}%"))
+            
+            # Price range filters
+            if filters.price_min is not None:
+                conditions.append(
+                    or_(
+                        and_(Product.sale_price.isnot(None), Product.sale_price >= filters.price_min),
+                        and_(Product.sale_price.is_(None), Product.price >= filters.price_min)
                     )
-                    count_query = count_query.where(
-                        or_(
-                            and_(Product.sale_price.isnot(None), Product.sale_price >= filters.price_min),
-                            and_(Product.sale_price.is_(None), Product.price >= filters.price_min)
-                        )
+                )
+            
+            if filters.price_max is not None:
+                conditions.append(
+                    or_(
+                        and_(Product.sale_price.isnot(None), Product.sale_price <= filters.price_max),
+                        and_(Product.sale_price.is_(None), Product.price <= filters.price_max)
                     )
-                
-                if filters.price_max is not None:
-                    query = query.where(
+                )
+            
+            # Stock filter
+            if filters.in_stock is not None:
+                if filters.in_stock:
+                    conditions.append(
                         or_(
-                            and_(Product.sale_price.isnot(None), Product.sale_price <= filters.price_max),
-                            and_(Product.sale_price.is_(None), Product.price <= filters.price_max)
+                            Product.track_inventory == False,
+                            Product.allow_backorder == True,
+                            Product.stock_qty > 0
                         )
                     )
-                    count_query = count_query.where(
-                        or_(
-                            and_(Product.sale_price.isnot(None), Product.sale_price <= filters.price_max),
-                            and_(Product.sale_price.is_(None), Product.price <= filters.price_max)
+                else:
+                    conditions.append(
+                        and_(
+                            Product.track_inventory == True,
+                            Product.allow_backorder == False,
+                            Product.stock_qty <= 0
                         )
                     )
+            
+            # Featured filter
+            if filters.is_featured is not None:
+                conditions.append(Product.is_featured == filters.is_featured)
+            
+            # Tags filter (array contains)
+            if filters.tags:
+                for tag in filters.tags:
+                    conditions.append(Product.tags.contains([tag]))
+        
+        # Apply search query
+        if search.q and search.q.strip():
+            search_filter, search_rank = build_search_clauses(search.q)
+            conditions.append(search_filter)
+        
+        return conditions, search_rank
+    
+    async def search_products(
+        self, db: AsyncSession, search: ProductSearch
+    ) -> Tuple[List[Product], Optional[int], bool]:
+        """
+        Search products with filtering, sorting, and pagination.
+        
+        Returns (products, total, has_more). The total is computed with a window
+        count in the same round trip as the page. When ``search.cursor`` is set,
+        keyset pagination is used instead of OFFSET and the total is not
+        recomputed (None is returned). One extra row is fetched to tell whether
+        another page follows.
+        """
+        try:
+            conditions, search_rank = self._build_search_conditions(search)
+            
+            use_keyset = search.cursor is not None and search.sort in KEYSET_SORTS
+            
+            query = select(Product).options(
+                selectinload(Product.category)
+            ).where(*conditions)
+            if not use_keyset:
+                # The window count makes the database count every match; keyset pages skip it
+                query = query.add_columns(func.count(Product.id).over().label("total_count"))
+            
+            # Apply sorting (product id breaks ties so pages are stable)
+            if search.sort == ProductSort.RELEVANCE and search_rank is not None:
+                query = query.order_by(desc(search_rank), desc(Product.created_at), desc(Product.id))
+            else:
+                sort_key, direction = KEYSET_SORTS.get(search.sort, KEYSET_SORTS[ProductSort.CREATED_DESC])
+                query = query.order_by(direction(sort_key), direction(Product.id))
                 
-                # Stock filter
-                if filters.in_stock is not None:
-                    if filters.in_stock:
-                        query = query.where(
-                            or_(
-                                Product.track_inventory == False,
-                                Product.allow_backorder == True,
-                                Product.stock_qty > 0
-                            )
-                        )
-                        count_query = count_query.where(
-                            or_(
-                                Product.track_inventory == False,
-                                Product.allow_backorder == True,
-                                Product.stock_qty > 0
-                            )
-                        )
+                if use_keyset:
+                    last_value, last_id = decode_cursor(search.cursor, search.sort)
+                    position = tuple_(sort_key, Product.id)
+                    if direction is asc:
+                        query = query.where(position > tuple_(last_value, last_id))
                     else:
-                        query = query.where(
-                            and_(
-                                Product.track_inventory == True,
-                                Product.allow_backorder == False,
-                                Product.stock_qty <= 0
-                            )
-                        )
-                        count_query = count_query.where(
-                            and_(
-                                Product.track_inventory == True,
-                                Product.allow_backorder == False,
-                                Product.stock_qty <= 0
-                            )
-                        )
-                
-                # Featured filter
-                if filters.is_featured is not None:
-                    query = query.where(Product.is_featured == filters.is_featured)
-                    count_query = count_query.where(Product.is_featured == filters.is_featured)
-                
-                # Tags filter (array contains)
-                if filters.tags:
-                    for tag in filters.tags:
-                        query = query.where(Product.tags.contains([tag]))
-                        count_query = count_query.where(Product.tags.contains([tag]))
-            
-            # Apply search query
-            if search.q:
-                search_term = f"%{search.q}%"
-                search_filter = or_(
-                    Product.name.ilike(search_term),
-                    Product.description.ilike(search_term),
-                    Product.short_description.ilike(search_term),
-                    Product.brand.ilike(search_term)
-                )
-                query = query.where(search_filter)
-                count_query = count_query.where(search_filter)
-            
-            # Apply sorting
-            if search.sort == ProductSort.NAME_ASC:
-                query = query.order_by(asc(Product.name))
-            elif search.sort == ProductSort.NAME_DESC:
-                query = query.order_by(desc(Product.name))
-            elif search.sort == ProductSort.PRICE_ASC:
-                query = query.order_by(
-                    asc(func.coalesce(Product.sale_price, Product.price))
-                )
-            elif search.sort == ProductSort.PRICE_DESC:
-                query = query.order_by(
-                    desc(func.coalesce(Product.sale_price, Product.price))
-                )
-            elif search.sort == ProductSort.CREATED_ASC:
-                query = query.order_by(asc(Product.created_at))
-            elif search.sort == ProductSort.CREATED_DESC:
-                query = query.order_by(desc(Product.created_at))
-            else:  # Default to created_desc
-                query = query.order_by(desc(Product.created_at))
-            
-            # Get total count
-            count_result = await db.execute(count_query)
-            total = count_result.scalar()
+                        query = query.where(position < tuple_(last_value, last_id))
             
             # Apply pagination
-            offset = (search.page - 1) * search.per_page
-            query = query.offset(offset).limit(search.per_page)
+            if use_keyset:
+                query = query.limit(search.per_page + 1)
+            else:
+                offset = (search.page - 1) * search.per_page
+                query = query.offset(offset).limit(search.per_page + 1)
             
             # Execute query
             result = await db.execute(query)
-            products = result.scalars().all()
+            rows = result.all()
+            has_more = len(rows) > search.per_page
+            rows = rows[:search.per_page]
+            products = [row[0] for row in rows]
             
-            return list(products), total
+            if use_keyset:
+                return products, None, has_more
+            
+            if rows:
+                total = rows[0].total_count
+            elif search.page > 1:
+                # Past the last page there is no row to carry the window count
+                count_result = await db.execute(
+                    select(func.count(Product.id)).where(*conditions)
+                )
+                total = count_result.scalar()
+            else:
+                total = 0
+            
+            return products, total, has_more
             
         except Exception as e:
             logger.error(f"Failed to search products: {e}")
             raise
     
+    def encode_cursor(self, search: ProductSearch, product: Product) -> Optional[str]:
+        """Build the keyset cursor that continues a search after ``product``"""
+        if search.sort not in KEYSET_SORTS:
+            return None
+        
+        if search.sort in (ProductSort.NAME_ASC, ProductSort.NAME_DESC):
+            value = product.name
+        elif search.sort in (ProductSort.PRICE_ASC, ProductSort.PRICE_DESC):
+            value = str(product.sale_price if product.sale_price is not None else product.price)
+        else:
+            value = product.created_at.isoformat() if product.created_at else None
+        
+        if value is None:
+            return None
+        
+        payload = json.dumps({"s": search.sort.value, "v": value, "id": product.id})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+    
     async def get_featured_products(self, db: AsyncSession, limit: int = 10) -> List[Product]:
         """Get featured products"""
         try:
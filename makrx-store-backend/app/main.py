@@ -61,11 +61,12 @@ from app.routes import (
 )
 
 # Security and middleware modules
-from app.middleware.api_security import setup_api_security      # API security middleware
+from app.middleware.api_security import setup_api_security, shutdown_api_security  # API security middleware
 from app.middleware.observability import ObservabilityMiddleware # Request monitoring
 
 # Comprehensive security system imports
 from app.core.enhanced_security_auth import enhanced_auth       # Advanced authentication
+from app.core.unified_auth import auth as unified_auth           # Token verification (pooled JWKS client)
 from app.core.file_security import file_validator, storage_manager  # Secure file handling
 from app.core.payment_security import webhook_verifier, payment_processor  # Payment security
 from app.core.data_protection import (                          # DPDP Act compliance
@@ -351,6 +352,12 @@ async def shutdown_event():
     except Exception as e:
         logger.error(f"Shutdown cleanup failed: {e}")
 
+    # Release the pooled JWKS connections
+    await unified_auth.close()
+
+    # Stop the rate limit sync task and close its Redis pool
+    await shutdown_api_security()
+
     logger.info("MakrX Store API shutdown complete")
 
 @app.get("/")
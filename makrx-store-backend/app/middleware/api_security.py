@@ -4,14 +4,15 @@ Implements comprehensive API security per specification:
 - TLS enforcement (HTTPS, HSTS)
 - CORS restrictions to known domains
 - CSRF protection for browser forms
-- Rate limiting with Redis token bucket
+- Rate limiting with Redis sliding window / token bucket
 - API Gateway protections
 """
 import time
 import json
-import redis
+import math
+import redis.asyncio as aioredis
 import logging
-from typing import Optional, Dict, Any, Set
+from typing import Optional, Dict, Any, Set, List, Tuple
 from fastapi import FastAPI, Request, Response, HTTPException, status
 from fastapi.middleware.base import BaseHTTPMiddleware
 from fastapi.middleware.cors import CORSMiddleware
@@ -19,8 +20,12 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from starlette.responses import JSONResponse
 import secrets
 import hashlib
+import asyncio
+import weakref
+from collections import OrderedDict
 
 from app.core.config import settings
+from app.middleware.observability import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -57,6 +62,10 @@ class APISecurityConfig:
         "webhook": {"requests": 1000, "window": 300}    # Webhooks: 1000/5min
     }
     
+    # Endpoint types decided in-process until a client nears its limit.
+    # Low, security-sensitive limits (login, checkout, upload) always go to Redis.
+    LOCAL_RATE_LIMIT_TYPES = {"api", "webhook"}
+    
     # File upload limits per specification
     MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50 MB for STL/3MF
     MAX_IMAGE_SIZE = 10 * 1024 * 1024   # 10 MB for images
@@ -125,16 +134,246 @@ class HTTPSRedirectMiddleware(BaseHTTPMiddleware):
 # Rate Limiting Middleware
 # ==========================================
 
+# Sliding window over sorted sets. Every key is checked before any is
+# updated, so a request denied by one limit is not counted against the others.
+# KEYS: limit keys; ARGV: window_ms, limit, member
+# Returns {denied_key_index (0 = allowed), retry_after_ms, used_1, used_2, ...}
+SLIDING_WINDOW_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        local retry_after = window
+        if oldest[2] then
+            retry_after = tonumber(oldest[2]) + window - now
+        end
+        return {i, retry_after}
+    end
+end
+local result = {0, 0}
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[3])
+    redis.call('PEXPIRE', key, window)
+    result[i + 2] = redis.call('ZCARD', key)
+end
+return result
+"""
+
+# Token bucket per key stored as a hash of {tokens, ts}; capacity = limit,
+# refilled at limit / window. Requests inside the same second each consume a token.
+# KEYS: limit keys; ARGV: window_ms, limit
+# Returns {denied_key_index (0 = allowed), retry_after_ms, used_1, used_2, ...}
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local window = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local rate = capacity / window
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    if tokens < 1 then
+        return {i, math.ceil((1 - tokens) / rate)}
+    end
+    levels[i] = tokens
+end
+local result = {0, 0}
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', levels[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, window)
+    result[i + 2] = math.ceil(capacity - levels[i] + 1)
+end
+return result
+"""
+
+# Batch sync of requests admitted by the local tier. Each key gets one
+# sorted-set member per admitted request, stamped with the sync time.
+# KEYS: limit keys; ARGV: window_ms, member_prefix, count_1, count_2, ...
+# Returns {used_1, used_2, ...}
+SLIDING_WINDOW_SYNC_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local window = tonumber(ARGV[1])
+local used = {}
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+    for j = 1, tonumber(ARGV[i + 2]) do
+        redis.call('ZADD', key, now, ARGV[2] .. ':' .. i .. ':' .. j)
+    end
+    redis.call('PEXPIRE', key, window)
+    used[i] = redis.call('ZCARD', key)
+end
+return used
+"""
+
+# Batch sync for token buckets: admitted requests are drawn from the bucket
+# even if that takes it below zero, which then delays the next Redis admission.
+# KEYS: limit keys; ARGV: window_ms, limit, count_1, count_2, ...
+# Returns {used_1, used_2, ...}
+TOKEN_BUCKET_SYNC_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local window = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local rate = capacity / window
+local used = {}
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate) - tonumber(ARGV[i + 2])
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', key, window)
+    used[i] = math.ceil(capacity - tokens)
+end
+return used
+"""
+
+
+class _LocalBucket:
+    """Local view of one limit key: last known Redis usage plus requests admitted since"""
+    
+    __slots__ = ("limit", "window", "remote_used", "synced_at", "pending")
+    
+    def __init__(self, limit: int, window: int, now: float):
+        self.limit = limit
+        self.window = window
+        self.remote_used = 0.0
+        self.synced_at = now
+        self.pending = 0
+    
+    def estimated_used(self, now: float) -> float:
+        # The Redis count drains at the refill rate between syncs, token-bucket style
+        drained = (now - self.synced_at) * self.limit / self.window
+        return max(0.0, self.remote_used - drained) + self.pending
+
+
+class LocalRateLimiter:
+    """
+    In-process pre-limiter in front of the Redis limiter.
+    - Admits requests locally while a client is clearly under its limit
+    - Admitted counts are pushed to Redis in batches by sync()
+    - Keys are spread over shards, each an LRU bounded to max_keys / shards
+    """
+    
+    def __init__(self, max_keys: int = 100_000, threshold: float = 0.8, shards: int = 16):
+        self.threshold = threshold
+        self._shards: List["OrderedDict[str, _LocalBucket]"] = [OrderedDict() for _ in range(shards)]
+        self._max_keys_per_shard = max(1, max_keys // shards)
+        self.evictions = 0
+    
+    def _shard(self, key: str) -> "OrderedDict[str, _LocalBucket]":
+        return self._shards[hash(key) % len(self._shards)]
+    
+    def _get_bucket(self, key: str, limit: int, window: int, now: float) -> _LocalBucket:
+        shard = self._shard(key)
+        bucket = shard.get(key)
+        if bucket is not None:
+            shard.move_to_end(key)
+            return bucket
+        
+        bucket = shard[key] = _LocalBucket(limit, window, now)
+        if len(shard) > self._max_keys_per_shard:
+            # Idle keys age out first; unsynced counts of an evicted key are dropped
+            shard.popitem(last=False)
+            self.evictions += 1
+        return bucket
+    
+    def try_acquire(self, keys: List[str], limit: int, window: int) -> bool:
+        """
+        Admit the request locally if every key stays under threshold * limit.
+        False means the caller must ask Redis.
+        """
+        now = time.monotonic()
+        ceiling = limit * self.threshold
+        buckets = []
+        for key in keys:
+            bucket = self._get_bucket(key, limit, window, now)
+            if bucket.estimated_used(now) + 1 > ceiling:
+                return False
+            buckets.append(bucket)
+        
+        for bucket in buckets:
+            bucket.pending += 1
+        return True
+    
+    def record_usage(self, key: str, used: float) -> None:
+        """Store an authoritative usage count returned by Redis"""
+        bucket = self._shard(key).get(key)
+        if bucket is not None:
+            bucket.remote_used = used
+            bucket.synced_at = time.monotonic()
+    
+    def pending_batches(self) -> Dict[Tuple[int, int], List[Tuple[str, int]]]:
+        """Keys with unsynced requests, grouped by (limit, window)"""
+        batches: Dict[Tuple[int, int], List[Tuple[str, int]]] = {}
+        for shard in self._shards:
+            for key, bucket in shard.items():
+                if bucket.pending:
+                    batches.setdefault((bucket.limit, bucket.window), []).append((key, bucket.pending))
+        return batches
+    
+    def mark_synced(self, key: str, count: int, used: float) -> None:
+        """Apply a sync result; requests admitted while the sync was in flight stay pending"""
+        bucket = self._shard(key).get(key)
+        if bucket is not None:
+            bucket.pending = max(0, bucket.pending - count)
+            bucket.remote_used = used
+            bucket.synced_at = time.monotonic()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "keys": sum(len(shard) for shard in self._shards),
+            "max_keys": self._max_keys_per_shard * len(self._shards),
+            "evictions": self.evictions,
+        }
+
+# Live rate limit middlewares, for shutdown_api_security. Starlette builds the
+# middleware stack itself, so the app holds no reference to them.
+_rate_limit_middlewares: "weakref.WeakSet[RateLimitMiddleware]" = weakref.WeakSet()
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """
-    Rate limiting with Redis token bucket per specification
-    - Per-IP & per-user limits
+    Rate limiting with Redis per specification
+    - Per-IP & per-user limits, checked together in one atomic Lua script
     - Different limits for file uploads, quotes, checkout, login
+    - Sliding window (default) or token bucket algorithm
+    - Optional in-process tier that only sends near-limit clients to Redis
     """
     
-    def __init__(self, app, redis_url: str = None):
+    # Keys per sync script call
+    SYNC_BATCH_SIZE = 500
+    
+    def __init__(self, app, redis_url: str = None, algorithm: str = "sliding_window",
+                 local_limiter: Optional[LocalRateLimiter] = None,
+                 sync_interval: float = 1.0):
         super().__init__(app)
-        self.redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+        self.algorithm = algorithm
+        self.redis_client = aioredis.from_url(
+            redis_url, max_connections=settings.RATE_LIMIT_REDIS_MAX_CONNECTIONS
+        ) if redis_url else None
+        self._script = None
+        self._sync_script = None
+        if self.redis_client:
+            if algorithm == "token_bucket":
+                script, sync_script = TOKEN_BUCKET_SCRIPT, TOKEN_BUCKET_SYNC_SCRIPT
+            else:
+                script, sync_script = SLIDING_WINDOW_SCRIPT, SLIDING_WINDOW_SYNC_SCRIPT
+            self._script = self.redis_client.register_script(script)
+            self._sync_script = self.redis_client.register_script(sync_script)
+        
+        # The local tier only makes sense with Redis behind it
+        self.local_limiter = local_limiter if self.redis_client else None
+        self.sync_interval = sync_interval
+        self._sync_task: Optional[asyncio.Task] = None
+        _rate_limit_middlewares.add(self)
         
     def _get_endpoint_type(self, path: str) -> str:
         """Determine endpoint type for rate limiting"""
@@ -173,38 +412,89 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         
         return ip, user_id
     
-    async def _check_rate_limit(self, key: str, limit: int, window: int) -> bool:
-        """Check rate limit using Redis token bucket"""
-        if not self.redis_client:
-            return True  # Allow if Redis unavailable
+    async def _check_rate_limits(self, keys: List[str], limit: int, window: int) -> Tuple[int, int]:
+        """
+        Check all limit keys for a request in one Redis round trip.
+        Returns (index of the first exceeded key starting at 1, or 0 if allowed; retry-after seconds).
+        """
+        if not self._script:
+            return 0, 0  # Allow if Redis unavailable
         
         try:
-            current_time = int(time.time())
-            window_start = current_time - window
-            
-            # Use sliding window with Redis sorted sets
-            pipe = self.redis_client.pipeline()
-            
-            # Remove old entries
-            pipe.zremrangebyscore(key, 0, window_start)
-            
-            # Add current request
-            pipe.zadd(key, {str(current_time): current_time})
+            window_ms = window * 1000
+            if self.algorithm == "token_bucket":
+                args = [window_ms, limit]
+            else:
+                # Unique member so requests within the same millisecond are all counted
+                args = [window_ms, limit, f"{time.time_ns()}:{secrets.token_hex(4)}"]
             
-            # Count requests in window
-            pipe.zcard(key)
+            denied, retry_after_ms, *used = await self._script(keys=keys, args=args)
+            denied = int(denied)
             
-            # Set expiry
-            pipe.expire(key, window)
+            if self.local_limiter:
+                # Keep the local tier's view of these keys current
+                if denied:
+                    self.local_limiter.record_usage(keys[denied - 1], limit)
+                for key, key_used in zip(keys, used):
+                    self.local_limiter.record_usage(key, int(key_used))
             
-            results = pipe.execute()
-            request_count = results[2]
-            
-            return request_count <= limit
+            return denied, max(1, math.ceil(int(retry_after_ms) / 1000))
             
         except Exception as e:
             logger.error(f"Rate limiting failed: {e}")
-            return True  # Allow on error (fail open)
+            return 0, 0  # Allow on error (fail open)
+    
+    async def _sync_local_counts(self) -> None:
+        """Push requests admitted by the local tier to Redis"""
+        for (limit, window), entries in self.local_limiter.pending_batches().items():
+            for start in range(0, len(entries), self.SYNC_BATCH_SIZE):
+                batch = entries[start:start + self.SYNC_BATCH_SIZE]
+                keys = [key for key, _ in batch]
+                counts = [count for _, count in batch]
+                if self.algorithm == "token_bucket":
+                    args = [window * 1000, limit, *counts]
+                else:
+                    args = [window * 1000, f"{time.time_ns()}:{secrets.token_hex(4)}", *counts]
+                
+                used = await self._sync_script(keys=keys, args=args)
+                for key, count, key_used in zip(keys, counts, used):
+                    self.local_limiter.mark_synced(key, count, int(key_used))
+    
+    async def _sync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self._sync_local_counts()
+            except Exception as e:
+                logger.error(f"Rate limit sync failed: {e}")
+    
+    def _ensure_sync_task(self) -> None:
+        # Started lazily: the middleware is constructed before the event loop runs
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync_loop())
+    
+    async def close(self) -> None:
+        """Stop the local-tier sync task and release the Redis connection pool"""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+        if self.redis_client:
+            await self.redis_client.aclose()
+    
+    def _rate_limited_response(self, limit_type: str, endpoint_type: str, retry_after: int) -> JSONResponse:
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={
+                "detail": "Rate limit exceeded",
+                "type": f"{limit_type}_limit_{endpoint_type}",
+                "retry_after": retry_after
+            },
+            headers={"Retry-After": str(retry_after)}
+        )
     
     async def dispatch(self, request: Request, call_next):
         # Skip rate limiting for health checks
@@ -219,42 +509,38 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         # Get client identifiers
         ip, user_id = self._get_client_identifier(request)
         
-        # Check IP rate limit
-        ip_key = f"rate_limit:ip:{endpoint_type}:{ip}"
-        ip_allowed = await self._check_rate_limit(
-            ip_key, rate_config["requests"], rate_config["window"]
-        )
-        
-        if not ip_allowed:
-            logger.warning(f"Rate limit exceeded for IP {ip} on {endpoint_type}")
-            return JSONResponse(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                content={
-                    "detail": "Rate limit exceeded",
-                    "type": f"ip_limit_{endpoint_type}",
-                    "retry_after": rate_config["window"]
-                },
-                headers={"Retry-After": str(rate_config["window"])}
-            )
-        
-        # Check user rate limit (if user identified)
+        # IP limit, plus user limit if the user is identified
+        limit_types = ["ip"]
+        keys = [f"rate_limit:ip:{endpoint_type}:{ip}"]
         if user_id:
-            user_key = f"rate_limit:user:{endpoint_type}:{user_id}"
-            user_allowed = await self._check_rate_limit(
-                user_key, rate_config["requests"], rate_config["window"]
+            limit_types.append("user")
+            keys.append(f"rate_limit:user:{endpoint_type}:{user_id}")
+        
+        started = time.perf_counter()
+        if (
+            self.local_limiter
+            and endpoint_type in APISecurityConfig.LOCAL_RATE_LIMIT_TYPES
+            and self.local_limiter.try_acquire(keys, rate_config["requests"], rate_config["window"])
+        ):
+            self._ensure_sync_task()
+            tier = "local"
+            denied, retry_after = 0, 0
+        else:
+            tier = "redis"
+            denied, retry_after = await self._check_rate_limits(
+                keys, rate_config["requests"], rate_config["window"]
             )
-            
-            if not user_allowed:
-                logger.warning(f"Rate limit exceeded for user {user_id} on {endpoint_type}")
-                return JSONResponse(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    content={
-                        "detail": "Rate limit exceeded", 
-                        "type": f"user_limit_{endpoint_type}",
-                        "retry_after": rate_config["window"]
-                    },
-                    headers={"Retry-After": str(rate_config["window"])}
-                )
+        metrics.record_histogram(
+            "rate_limit_decision_ms",
+            (time.perf_counter() - started) * 1000,
+            {"tier": tier, "endpoint_type": endpoint_type}
+        )
+        
+        if denied:
+            limit_type = limit_types[denied - 1]
+            identifier = ip if limit_type == "ip" else user_id
+            logger.warning(f"Rate limit exceeded for {limit_type} {identifier} on {endpoint_type}")
+            return self._rate_limited_response(limit_type, endpoint_type, retry_after)
         
         return await call_next(request)
 
@@ -489,7 +775,16 @@ def setup_api_security(app: FastAPI):
     # 3. Rate limiting
     redis_url = getattr(settings, 'REDIS_URL', None)
     if redis_url:
-        app.add_middleware(RateLimitMiddleware, redis_url=redis_url)
+        app.add_middleware(
+            RateLimitMiddleware,
+            redis_url=redis_url,
+            algorithm=settings.RATE_LIMIT_ALGORITHM,
+            local_limiter=LocalRateLimiter(
+                max_keys=settings.RATE_LIMIT_LOCAL_MAX_KEYS,
+                threshold=settings.RATE_LIMIT_LOCAL_THRESHOLD
+            ) if settings.RATE_LIMIT_LOCAL_TIER else None,
+            sync_interval=settings.RATE_LIMIT_LOCAL_SYNC_INTERVAL
+        )
     
     # 4. CSRF protection
     app.add_middleware(CSRFProtectionMiddleware)
@@ -519,3 +814,8 @@ def setup_api_security(app: FastAPI):
     app.add_middleware(TrustedHostMiddleware, allowed_hosts=trusted_hosts)
     
     logger.info("API security middleware configured successfully")
+
+async def shutdown_api_security():
+    """Stop background tasks and close connections opened by the API security middleware"""
+    for middleware in list(_rate_limit_middlewares):
+        await middleware.close()
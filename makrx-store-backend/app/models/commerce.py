@@ -3,8 +3,8 @@ SQLAlchemy models for commerce entities
 Products, Categories, Cart, Orders
 """
 
-from sqlalchemy import Column, Integer, String, Numeric, Boolean, DateTime, Text, ForeignKey, Index
-from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy import Column, Integer, String, Numeric, Boolean, DateTime, Text, ForeignKey, Index, Computed
+from sqlalchemy.dialects.postgresql import JSONB, UUID, TSVECTOR
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
@@ -95,6 +95,15 @@ class Product(Base):
     weight = Column(Numeric(8, 3))  # kg
     dimensions = Column(JSONB, default={})  # {"length": 10, "width": 10, "height": 5}
     
+    # Full-text search document, maintained by PostgreSQL on every insert/update
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(brand, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(short_description, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'C')",
+        persisted=True
+    ))
+    
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -111,6 +120,11 @@ class Product(Base):
         Index("ix_products_category_active", "category_id", "is_active"),
         Index("ix_products_brand_active", "brand", "is_active"),
         Index("ix_products_price", "price"),
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_products_name_trgm", "name", postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_products_brand_trgm", "brand", postgresql_using="gin",
+              postgresql_ops={"brand": "gin_trgm_ops"}),
     )
 
 class Cart(Base):
@@ -5,7 +5,8 @@ Enables importing Bills of Materials from MakrCave projects into store cart
 
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_, or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, and_, func
 from typing import List, Optional, Dict, Any
 import logging
 import json
@@ -17,6 +18,7 @@ from app.core.db import get_db
 from app.core.security import get_current_user
 from app.models.commerce import Product, Cart, CartItem
 from app.models.subscriptions import BOMIntegration
+from app.services.product_match_index import product_match_index, jaccard, name_tokens
 from pydantic import BaseModel, Field
 
 logger = logging.getLogger(__name__)
@@ -131,16 +133,13 @@ async def import_bom_from_makrcave(
         db.refresh(integration)
         
         # Map BOM items to store products
-        mapping_results = []
         mapped_count = 0
         unmapped_count = 0
         estimated_total = 0.0
         warnings = []
         
-        for bom_item in bom_data.items:
-            result = await map_bom_item_to_products(db, bom_item)
-            mapping_results.append(result)
-            
+        mapping_results = await map_bom_items_to_products(db, bom_data.items)
+        for bom_item, result in zip(bom_data.items, mapping_results):
             if result.best_match:
                 mapped_count += 1
                 estimated_total += result.best_match.store_product_price * bom_item.quantity
@@ -350,14 +349,11 @@ async def preview_bom_import(
             raise HTTPException(status_code=404, detail="BOM not found")
         
         # Map items to get preview
-        preview_results = []
         total_estimated_cost = 0.0
         mappable_items = 0
         
-        for bom_item in bom_data.items:
-            result = await map_bom_item_to_products(db, bom_item)
-            preview_results.append(result)
-            
+        preview_results = await map_bom_items_to_products(db, bom_data.items)
+        for bom_item, result in zip(bom_data.items, preview_results):
             if result.best_match:
                 mappable_items += 1
                 total_estimated_cost += result.best_match.store_product_price * bom_item.quantity
@@ -469,87 +465,33 @@ async def fetch_bom_from_makrcave(project_id: str, user_id: str) -> Optional[BOM
         logger.error(f"Failed to fetch BOM from MakrCave: {e}")
         return None
 
-async def map_bom_item_to_products(db: Session, bom_item: BOMItem) -> BOMMappingResult:
-    """Map a BOM item to store products using various matching strategies"""
-    
-    matches = []
-    
-    # Strategy 1: Exact part number match
-    if bom_item.part_number:
-        exact_matches = db.query(Product).filter(
-            and_(
-                Product.is_active == True,
-                or_(
-                    Product.attributes['part_number'].astext == bom_item.part_number,
-                    Product.attributes['sku'].astext == bom_item.part_number
-                )
-            )
-        ).all()
-        
-        for product in exact_matches:
-            matches.append(ProductMatch(
-                confidence=0.95,
-                match_type="exact",
-                store_product_id=product.id,
-                store_product_name=product.name,
-                store_product_brand=product.brand,
-                store_product_price=float(product.sale_price or product.price),
-                quantity_available=product.stock_qty,
-                match_reasons=["Exact part number match"]
-            ))
-    
-    # Strategy 2: Name and manufacturer match
-    if bom_item.manufacturer and not matches:
-        name_brand_matches = db.query(Product).filter(
-            and_(
-                Product.is_active == True,
-                Product.brand.ilike(f"%{bom_item.manufacturer}%"),
-                Product.name.ilike(f"%{bom_item.name[:20]}%")  # First 20 chars
-            )
-        ).all()
-        
-        for product in name_brand_matches:
-            confidence = calculate_name_similarity(bom_item.name, product.name)
-            if confidence > 0.7:
-                matches.append(ProductMatch(
-                    confidence=confidence * 0.8,  # Reduce confidence for partial match
-                    match_type="partial",
-                    store_product_id=product.id,
-                    store_product_name=product.name,
-                    store_product_brand=product.brand,
-                    store_product_price=float(product.sale_price or product.price),
-                    quantity_available=product.stock_qty,
-                    match_reasons=["Brand and name similarity"]
-                ))
+async def map_bom_items_to_products(db: AsyncSession, bom_items: List[BOMItem]) -> List[BOMMappingResult]:
+    """Map a whole BOM to store products in one pass over the product match index"""
+    await product_match_index.ensure_fresh(db)
+    item_matches = product_match_index.match_items(
+        (bom_item.name, bom_item.manufacturer, bom_item.part_number)
+        for bom_item in bom_items
+    )
     
-    # Strategy 3: Fuzzy name matching
-    if not matches:
-        fuzzy_matches = db.query(Product).filter(
-            and_(
-                Product.is_active == True,
-                or_(
-                    Product.name.ilike(f"%{bom_item.name[:10]}%"),
-                    Product.description.ilike(f"%{bom_item.name[:10]}%")
-                )
+    return [
+        build_mapping_result(bom_item, [
+            ProductMatch(
+                confidence=match.confidence,
+                match_type=match.match_type,
+                store_product_id=match.product.id,
+                store_product_name=match.product.name,
+                store_product_brand=match.product.brand,
+                store_product_price=match.product.price,
+                quantity_available=match.product.stock_qty,
+                match_reasons=[match.reason]
             )
-        ).limit(5).all()
-        
-        for product in fuzzy_matches:
-            confidence = calculate_name_similarity(bom_item.name, product.name)
-            if confidence > 0.5:
-                matches.append(ProductMatch(
-                    confidence=confidence * 0.6,
-                    match_type="fuzzy",
-                    store_product_id=product.id,
-                    store_product_name=product.name,
-                    store_product_brand=product.brand,
-                    store_product_price=float(product.sale_price or product.price),
-                    quantity_available=product.stock_qty,
-                    match_reasons=["Name similarity"]
-                ))
-    
-    # Sort matches by confidence
-    matches.sort(key=lambda x: x.confidence, reverse=True)
+            for match in matches
+        ])
+        for bom_item, matches in zip(bom_items, item_matches)
+    ]
+
+def build_mapping_result(bom_item: BOMItem, matches: List[ProductMatch]) -> BOMMappingResult:
+    """Pick the best match and mapping status from matches sorted by confidence"""
     
     # Determine best match and status
     best_match = None
@@ -579,21 +521,8 @@ async def map_bom_item_to_products(db: Session, bom_item: BOMItem) -> BOMMapping
     )
 
 def calculate_name_similarity(name1: str, name2: str) -> float:
-    """Calculate similarity between two product names"""
-    name1 = name1.lower().strip()
-    name2 = name2.lower().strip()
-    
-    # Simple word overlap calculation
-    words1 = set(name1.split())
-    words2 = set(name2.split())
-    
-    if not words1 or not words2:
-        return 0.0
-    
-    overlap = len(words1.intersection(words2))
-    total = len(words1.union(words2))
-    
-    return overlap / total if total > 0 else 0.0
+    """Calculate similarity between two product names (word overlap)"""
+    return jaccard(name_tokens(name1), name_tokens(name2))
 
 async def get_or_create_user_cart(db: Session, user_id: str) -> Cart:
     """Get existing cart or create new one for user"""
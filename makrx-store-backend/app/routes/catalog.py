@@ -79,6 +79,21 @@ async def get_category_by_path(
         raise HTTPException(status_code=500, detail="Failed to retrieve category")
 
 # Product endpoints
+def _build_product_list(search: ProductSearch, products: List, total: Optional[int], has_more: bool) -> ProductList:
+    """Assemble a ProductList page, including the keyset cursor for the next page (None on the last page)"""
+    next_cursor = None
+    if products and has_more:
+        next_cursor = product_crud.encode_cursor(search, products[-1])
+    
+    return ProductList(
+        products=products,
+        total=total,
+        page=search.page,
+        per_page=search.per_page,
+        pages=(total + search.per_page - 1) // search.per_page if total is not None else None,
+        next_cursor=next_cursor
+    )
+
 @router.get("/products", response_model=ProductList)
 async def get_products(
     q: Optional[str] = Query(None, description="Search query"),
@@ -92,6 +107,7 @@ async def get_products(
     sort: str = Query("created_desc", description="Sort order"),
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(20, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Keyset cursor from a previous page (replaces page)"),
     db: AsyncSession = Depends(get_db)
 ):
     """Get products with filtering, searching, and pagination"""
@@ -113,19 +129,15 @@ async def get_products(
             filters=filters,
             sort=sort,
             page=page,
-            per_page=per_page
-        )
-        
-        products, total = await product_crud.search_products(db, search)
-        
-        return ProductList(
-            products=products,
-            total=total,
-            page=page,
             per_page=per_page,
-            pages=(total + per_page - 1) // per_page
+            cursor=cursor
         )
         
+        products, total, has_more = await product_crud.search_products(db, search)
+        return _build_product_list(search, products, total, has_more)
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to search products: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve products")
@@ -158,6 +170,7 @@ async def get_products_by_category(
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(20, ge=1, le=100, description="Items per page"),
     sort: str = Query("created_desc", description="Sort order"),
+    cursor: Optional[str] = Query(None, description="Keyset cursor from a previous page (replaces page)"),
     db: AsyncSession = Depends(get_db)
 ):
     """Get products in a specific category"""
@@ -172,21 +185,17 @@ async def get_products_by_category(
             filters=ProductFilter(category_id=category_id),
             sort=sort,
             page=page,
-            per_page=per_page
-        )
-        
-        products, total = await product_crud.search_products(db, search)
-        
-        return ProductList(
-            products=products,
-            total=total,
-            page=page,
             per_page=per_page,
-            pages=(total + per_page - 1) // per_page
+            cursor=cursor
         )
         
+        products, total, has_more = await product_crud.search_products(db, search)
+        return _build_product_list(search, products, total, has_more)
+        
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to get products by category: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve products")
@@ -3,9 +3,11 @@ Enhanced Catalog API Routes
 Advanced search, filtering, maker-specific features, and integration capabilities
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Path, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, BackgroundTasks, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_, or_, text, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, and_, or_, text, func, case, true, any_, bindparam, values, column, Integer, String
+from sqlalchemy.dialects.postgresql import ARRAY
 from typing import List, Optional, Dict, Any
 import logging
 import json
@@ -15,6 +17,8 @@ from app.core.db import get_db
 from app.models.commerce import Product, Category, Order, OrderItem
 from app.models.subscriptions import QuickReorder, BOMIntegration
 from app.models.reviews import Review, ProductRatingSummary
+from app.services.category_tree_cache import category_tree_cache, etag_matches
+from app.services.facet_index import facet_index
 from pydantic import BaseModel, Field
 
 logger = logging.getLogger(__name__)
@@ -80,117 +84,122 @@ class ProductRecommendationRequest(BaseModel):
     recommendation_type: str = Field("similar", description="similar, complementary, trending, personalized")
     limit: int = Field(10, ge=1, le=50)
 
-@router.post("/search/advanced", response_model=AdvancedSearchResponse)
-async def advanced_product_search(
-    request: AdvancedSearchRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
-):
-    """
-    Advanced product search with faceted search, filtering, and maker-specific features
-    """
-    start_time = datetime.now()
+# Filters that FacetIndex evaluates from its bitmaps
+FACET_FILTER_FIELDS = {"category_ids", "brands", "price_min", "price_max", "in_stock", "is_featured", "sale_items_only"}
+
+def build_search_conditions(
+    search_query: Optional[str],
+    filters: Optional[AdvancedProductFilter],
+    include_facet_filters: bool = True
+) -> List[Any]:
+    """WHERE conditions selecting active products that match the search text and filters"""
+    conditions = [Product.is_active == True]
     
-    try:
-        # Build base query
-        query = db.query(Product).filter(Product.is_active == True)
-        
-        # Apply text search
-        if request.query:
-            search_terms = request.query.strip().split()
-            search_conditions = []
-            
-            for term in search_terms:
-                term_condition = or_(
-                    Product.name.ilike(f"%{term}%"),
-                    Product.description.ilike(f"%{term}%"),
-                    Product.short_description.ilike(f"%{term}%"),
-                    Product.brand.ilike(f"%{term}%"),
-                    Product.tags.op('@>')([term.lower()]),  # JSONB contains
-                    Product.attributes.op('@>')({f"material": term.lower()})
-                )
-                search_conditions.append(term_condition)
-            
-            if search_conditions:
-                query = query.filter(and_(*search_conditions))
-        
-        # Apply filters
-        if request.filters:
-            filters = request.filters
-            
-            # Basic filters
+    # Apply text search
+    if search_query:
+        for term in search_query.strip().split():
+            conditions.append(or_(
+                Product.name.ilike(f"%{term}%"),
+                Product.description.ilike(f"%{term}%"),
+                Product.short_description.ilike(f"%{term}%"),
+                Product.brand.ilike(f"%{term}%"),
+                Product.tags.op('@>')([term.lower()]),  # JSONB contains
+                Product.attributes.op('@>')({f"material": term.lower()})
+            ))
+    
+    # Apply filters
+    if filters:
+        # Basic filters (facets; left out when counting facets over the candidate set)
+        if include_facet_filters:
             if filters.category_ids:
-                query = query.filter(Product.category_id.in_(filters.category_ids))
+                conditions.append(Product.category_id.in_(filters.category_ids))
             
             if filters.brands:
-                query = query.filter(Product.brand.in_(filters.brands))
+                conditions.append(Product.brand.in_(filters.brands))
             
             if filters.price_min is not None:
-                query = query.filter(
-                    func.coalesce(Product.sale_price, Product.price) >= filters.price_min
-                )
+                conditions.append(func.coalesce(Product.sale_price, Product.price) >= filters.price_min)
             
             if filters.price_max is not None:
-                query = query.filter(
-                    func.coalesce(Product.sale_price, Product.price) <= filters.price_max
-                )
+                conditions.append(func.coalesce(Product.sale_price, Product.price) <= filters.price_max)
             
             if filters.in_stock is not None:
                 if filters.in_stock:
-                    query = query.filter(Product.stock_qty > 0)
+                    conditions.append(Product.stock_qty > 0)
                 else:
-                    query = query.filter(Product.stock_qty <= 0)
+                    conditions.append(Product.stock_qty <= 0)
             
             if filters.is_featured is not None:
-                query = query.filter(Product.is_featured == filters.is_featured)
-            
-            # Maker-specific filters
-            if filters.material_types:
-                material_conditions = [
-                    Product.attributes['material'].astext.ilike(f"%{material}%")
-                    for material in filters.material_types
-                ]
-                query = query.filter(or_(*material_conditions))
-            
-            if filters.printer_compatibility:
-                compat_conditions = [
-                    Product.compatibility.op('@>')([printer])
-                    for printer in filters.printer_compatibility
-                ]
-                query = query.filter(or_(*compat_conditions))
-            
-            if filters.diameter:
-                diameter_conditions = [
-                    Product.attributes['diameter'].astext == diameter
-                    for diameter in filters.diameter
-                ]
-                query = query.filter(or_(*diameter_conditions))
-            
-            # Advanced filters
-            if filters.new_arrivals_days:
-                cutoff_date = datetime.now() - timedelta(days=filters.new_arrivals_days)
-                query = query.filter(Product.created_at >= cutoff_date)
+                conditions.append(Product.is_featured == filters.is_featured)
             
             if filters.sale_items_only:
-                query = query.filter(Product.sale_price.isnot(None))
-            
-            if filters.rating_min:
-                # Join with rating summary
-                query = query.join(ProductRatingSummary, Product.id == ProductRatingSummary.product_id)
-                query = query.filter(ProductRatingSummary.average_rating >= filters.rating_min)
-            
-            if filters.has_reviews:
-                review_subquery = db.query(Review.target_id).filter(
+                conditions.append(Product.sale_price.isnot(None))
+        
+        # Maker-specific filters
+        if filters.material_types:
+            conditions.append(or_(*(
+                Product.attributes['material'].astext.ilike(f"%{material}%")
+                for material in filters.material_types
+            )))
+        
+        if filters.printer_compatibility:
+            conditions.append(or_(*(
+                Product.compatibility.op('@>')([printer])
+                for printer in filters.printer_compatibility
+            )))
+        
+        if filters.diameter:
+            conditions.append(or_(*(
+                Product.attributes['diameter'].astext == diameter
+                for diameter in filters.diameter
+            )))
+        
+        # Advanced filters
+        if filters.new_arrivals_days:
+            cutoff_date = datetime.now() - timedelta(days=filters.new_arrivals_days)
+            conditions.append(Product.created_at >= cutoff_date)
+        
+        if filters.rating_min:
+            # One rating summary per product, so this matches the summary join
+            conditions.append(Product.id.in_(
+                select(ProductRatingSummary.product_id)
+                .where(ProductRatingSummary.average_rating >= filters.rating_min)
+            ))
+        
+        if filters.has_reviews:
+            conditions.append(Product.id.in_(
+                select(Review.target_id).where(
                     and_(
                         Review.target_type == "product",
                         Review.status == "published"
                     )
                 ).distinct()
-                
-                if filters.has_reviews:
-                    query = query.filter(Product.id.in_(review_subquery))
-                else:
-                    query = query.filter(~Product.id.in_(review_subquery))
+            ))
+    
+    return conditions
+
+def build_search_query(
+    db: Session,
+    search_query: Optional[str],
+    filters: Optional[AdvancedProductFilter],
+    include_facet_filters: bool = True
+):
+    """Active products matching the search text and filters"""
+    return db.query(Product).filter(*build_search_conditions(search_query, filters, include_facet_filters))
+
+@router.post("/search/advanced", response_model=AdvancedSearchResponse)
+async def advanced_product_search(
+    request: AdvancedSearchRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """
+    Advanced product search with faceted search, filtering, and maker-specific features
+    """
+    start_time = datetime.now()
+    
+    try:
+        query = build_search_query(db, request.query, request.filters)
         
         # Get total count before pagination
         total_count = query.count()
@@ -284,7 +293,7 @@ async def advanced_product_search(
         
         # Add facets if requested
         if request.include_facets:
-            facets = await build_search_facets(db, request.filters)
+            facets = await build_search_facets(db, request.query, request.filters)
             response.facets = facets
         
         return response
@@ -365,84 +374,156 @@ async def get_product_compatibility(
         logger.error(f"Compatibility check error: {e}")
         raise HTTPException(status_code=500, detail="Failed to get compatibility info")
 
+# Bulk search resolves every code in a fixed number of set-based queries
+BULK_SEARCH_SUGGESTION_LIMIT = 3
+
+def _bulk_product_summary(product: Product) -> Dict[str, Any]:
+    return {
+        "id": product.id,
+        "name": product.name,
+        "brand": product.brand,
+        "price": float(product.price),
+        "sale_price": float(product.sale_price) if product.sale_price else None,
+        "in_stock": product.stock_qty > 0,
+        "stock_qty": product.stock_qty
+    }
+
+def _bulk_code_table(codes: List[str], name: str):
+    """VALUES table of (idx, code, name/brand/model ILIKE patterns) to join products against"""
+    rows = []
+    for idx, code in enumerate(codes):
+        parts = code.split() if " " in code else []
+        brand, model = (parts[0], " ".join(parts[1:])) if len(parts) >= 2 else (None, None)
+        rows.append((
+            idx,
+            code,
+            f"%{code}%",
+            f"%{brand}%" if brand else None,
+            f"%{model}%" if model else None,
+            f"%{code[:5]}%",
+        ))
+    
+    return values(
+        column("idx", Integer),
+        column("code", String),
+        column("name_pattern", String),
+        column("brand_pattern", String),
+        column("model_pattern", String),
+        column("prefix_pattern", String),
+        name=name
+    ).data(rows)
+
+async def resolve_product_codes(db: AsyncSession, product_codes: List[str]) -> Dict[str, Any]:
+    """
+    Resolve product codes to products in three queries, however many codes there are:
+    SKU equality against the whole batch, one name / brand+model join for the
+    leftovers, then one trigram-ranked suggestion join for whatever is still unmatched.
+    """
+    codes = list(dict.fromkeys(product_codes))
+    matches: Dict[str, Product] = {}
+    
+    # 1. Search by SKU in attributes
+    if codes:
+        sku = Product.attributes['sku'].astext
+        rows = (await db.execute(
+            select(sku, Product)
+            .where(sku == any_(bindparam("codes", codes, type_=ARRAY(String))))
+            .order_by(Product.id)
+        )).all()
+        for code, product in rows:
+            matches.setdefault(code, product)
+    
+    # 2. Search by name, then by brand + model
+    leftovers = [code for code in codes if code not in matches]
+    if leftovers:
+        lookup = _bulk_code_table(leftovers, "bulk_codes")
+        name_match = Product.name.ilike(lookup.c.name_pattern)
+        rows = (await db.execute(
+            select(lookup.c.code, Product)
+            .join(Product, or_(
+                name_match,
+                and_(
+                    lookup.c.brand_pattern.isnot(None),
+                    Product.brand.ilike(lookup.c.brand_pattern),
+                    Product.name.ilike(lookup.c.model_pattern)
+                )
+            ))
+            .distinct(lookup.c.idx)
+            .order_by(lookup.c.idx, case((name_match, 0), else_=1), Product.id)
+        )).all()
+        for code, product in rows:
+            matches[code] = product
+    
+    # 3. Suggestions: partial matches on the first characters, plus trigram lookalikes
+    unmatched = [code for code in codes if code not in matches]
+    suggestions: Dict[str, List[Dict[str, Any]]] = {code: [] for code in unmatched}
+    if unmatched:
+        lookup = _bulk_code_table(unmatched, "unmatched_codes")
+        partial_match = or_(
+            Product.name.ilike(lookup.c.prefix_pattern),
+            Product.brand.ilike(lookup.c.prefix_pattern)
+        )
+        similarity = func.greatest(
+            func.word_similarity(lookup.c.code, Product.name),
+            func.coalesce(func.word_similarity(lookup.c.code, Product.brand), 0)
+        )
+        candidates = (
+            select(
+                Product.id,
+                Product.name,
+                Product.brand,
+                partial_match.label("partial_match")
+            )
+            .where(or_(
+                partial_match,
+                lookup.c.code.op("<%")(Product.name),
+                lookup.c.code.op("<%")(Product.brand)
+            ))
+            .order_by(partial_match.desc(), similarity.desc(), Product.id)
+            .limit(BULK_SEARCH_SUGGESTION_LIMIT)
+            .lateral("candidates")
+        )
+        rows = (await db.execute(
+            select(lookup.c.code, candidates)
+            .select_from(lookup.join(candidates, true()))
+            .order_by(lookup.c.idx)
+        )).all()
+        for row in rows:
+            suggestions[row.code].append({
+                "id": row.id,
+                "name": row.name,
+                "brand": row.brand,
+                "similarity_reason": "partial_match" if row.partial_match else "similar_name"
+            })
+    
+    results = {
+        "found": [],
+        "not_found": [],
+        "suggestions": suggestions
+    }
+    for code in product_codes:
+        product = matches.get(code)
+        if product:
+            results["found"].append({
+                "search_term": code,
+                "product": _bulk_product_summary(product)
+            })
+        else:
+            results["not_found"].append(code)
+    
+    return results
+
 @router.post("/bulk-search")
 async def bulk_product_search(
     product_codes: List[str],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Search for multiple products by SKU, name, or other identifiers
     Useful for BOM imports and bulk ordering
     """
     try:
-        results = {
-            "found": [],
-            "not_found": [],
-            "suggestions": {}
-        }
-        
-        for code in product_codes:
-            # Try different search strategies
-            product = None
-            
-            # 1. Search by SKU in attributes
-            product = db.query(Product).filter(
-                Product.attributes['sku'].astext == code
-            ).first()
-            
-            # 2. Search by name exact match
-            if not product:
-                product = db.query(Product).filter(
-                    Product.name.ilike(f"%{code}%")
-                ).first()
-            
-            # 3. Search by brand + model
-            if not product and " " in code:
-                parts = code.split()
-                if len(parts) >= 2:
-                    brand, model = parts[0], " ".join(parts[1:])
-                    product = db.query(Product).filter(
-                        and_(
-                            Product.brand.ilike(f"%{brand}%"),
-                            Product.name.ilike(f"%{model}%")
-                        )
-                    ).first()
-            
-            if product:
-                results["found"].append({
-                    "search_term": code,
-                    "product": {
-                        "id": product.id,
-                        "name": product.name,
-                        "brand": product.brand,
-                        "price": float(product.price),
-                        "sale_price": float(product.sale_price) if product.sale_price else None,
-                        "in_stock": product.stock_qty > 0,
-                        "stock_qty": product.stock_qty
-                    }
-                })
-            else:
-                results["not_found"].append(code)
-                
-                # Generate suggestions
-                suggestions = db.query(Product).filter(
-                    or_(
-                        Product.name.ilike(f"%{code[:5]}%"),
-                        Product.brand.ilike(f"%{code[:5]}%")
-                    )
-                ).limit(3).all()
-                
-                results["suggestions"][code] = [
-                    {
-                        "id": p.id,
-                        "name": p.name,
-                        "brand": p.brand,
-                        "similarity_reason": "partial_match"
-                    }
-                    for p in suggestions
-                ]
-        
-        return results
+        return await resolve_product_codes(db, product_codes)
         
     except Exception as e:
         logger.error(f"Bulk search error: {e}")
@@ -450,64 +531,25 @@ async def bulk_product_search(
 
 @router.get("/categories/tree")
 async def get_category_tree(
+    request: Request,
     include_product_counts: bool = Query(False),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get complete category tree with optional product counts
+    Served from a cached snapshot with an ETag, so unchanged trees revalidate with 304
     """
     try:
-        # Get all categories
-        categories = db.query(Category).filter(Category.is_active == True).all()
-        
-        # Build tree structure
-        category_dict = {}
-        root_categories = []
-        
-        for category in categories:
-            category_data = {
-                "id": category.id,
-                "name": category.name,
-                "slug": category.slug,
-                "description": category.description,
-                "image_url": category.image_url,
-                "sort_order": category.sort_order,
-                "children": []
-            }
-            
-            if include_product_counts:
-                product_count = db.query(Product).filter(
-                    and_(
-                        Product.category_id == category.id,
-                        Product.is_active == True
-                    )
-                ).count()
-                category_data["product_count"] = product_count
-            
-            category_dict[category.id] = category_data
-            
-            if category.parent_id:
-                if category.parent_id in category_dict:
-                    category_dict[category.parent_id]["children"].append(category_data)
-            else:
-                root_categories.append(category_data)
-        
-        # Sort categories by sort_order
-        def sort_categories(cats):
-            cats.sort(key=lambda x: x["sort_order"])
-            for cat in cats:
-                sort_categories(cat["children"])
-        
-        sort_categories(root_categories)
-        
-        return {
-            "categories": root_categories,
-            "total_categories": len(categories)
-        }
-        
+        snapshot = await category_tree_cache.get(db, include_product_counts)
     except Exception as e:
         logger.error(f"Category tree error: {e}")
         raise HTTPException(status_code=500, detail="Failed to get category tree")
+    
+    headers = {"ETag": snapshot.etag, "Cache-Control": "public, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
 
 # Helper Functions
 
@@ -531,49 +573,37 @@ async def get_search_suggestions(db: Session, query: str, limit: int = 5) -> Lis
     
     return suggestions[:limit]
 
-async def build_search_facets(db: Session, filters: Optional[AdvancedProductFilter]) -> List[SearchFacet]:
-    """Build facets for search filtering"""
-    facets = []
-    
-    # Category facet
-    categories = db.query(Category.id, Category.name, func.count(Product.id).label('count')).join(
-        Product, Category.id == Product.category_id
-    ).filter(Product.is_active == True).group_by(Category.id, Category.name).all()
-    
-    facets.append(SearchFacet(
-        name="categories",
-        type="checkbox",
-        values=[{"id": c.id, "name": c.name, "count": c.count} for c in categories]
-    ))
-    
-    # Brand facet
-    brands = db.query(Product.brand, func.count(Product.id).label('count')).filter(
-        and_(Product.is_active == True, Product.brand.isnot(None))
-    ).group_by(Product.brand).all()
-    
-    facets.append(SearchFacet(
-        name="brands",
-        type="checkbox",
-        values=[{"name": b.brand, "count": b.count} for b in brands]
-    ))
-    
-    # Price range facet
-    price_stats = db.query(
-        func.min(func.coalesce(Product.sale_price, Product.price)).label('min_price'),
-        func.max(func.coalesce(Product.sale_price, Product.price)).label('max_price')
-    ).filter(Product.is_active == True).first()
-    
-    if price_stats.min_price and price_stats.max_price:
-        facets.append(SearchFacet(
-            name="price",
-            type="range",
-            values=[{
-                "min": float(price_stats.min_price),
-                "max": float(price_stats.max_price)
-            }]
-        ))
+def has_candidate_filters(search_query: Optional[str], filters: Optional[AdvancedProductFilter]) -> bool:
+    """Whether the search narrows products beyond what FacetIndex can evaluate itself"""
+    if search_query and search_query.strip():
+        return True
+    if not filters:
+        return False
+    return bool(
+        filters.material_types or filters.printer_compatibility or filters.diameter
+        or filters.new_arrivals_days or filters.rating_min or filters.has_reviews
+    )
+
+async def build_search_facets(
+    db: AsyncSession,
+    search_query: Optional[str],
+    filters: Optional[AdvancedProductFilter]
+) -> List[SearchFacet]:
+    """Build facets for search filtering, counted over the products the search matches"""
+    await facet_index.ensure_fresh(db)
+    
+    # Only the ids matching the text and maker-specific filters come from the
+    # database; category/brand/price/flag filters are bitmap intersections
+    candidate_ids = None
+    if has_candidate_filters(search_query, filters):
+        conditions = build_search_conditions(search_query, filters, include_facet_filters=False)
+        candidate_ids = list((await db.execute(select(Product.id).where(*conditions))).scalars())
     
-    return facets
+    facet_filters = filters.dict(include=FACET_FILTER_FIELDS) if filters else {}
+    return [
+        SearchFacet(**facet)
+        for facet in facet_index.facets(candidate_ids=candidate_ids, **facet_filters)
+    ]
 
 async def get_similar_products(db: Session, product_id: int, limit: int) -> List[Dict[str, Any]]:
     """Get products similar to the given product"""
@@ -4,7 +4,9 @@ from pydantic import BaseModel, Field
 from typing import Dict, List, Optional, BinaryIO
 import os
 import uuid
+import asyncio
 import hashlib
+import tempfile
 import mimetypes
 from datetime import datetime, timedelta
 import boto3
@@ -15,6 +17,11 @@ from app.schemas import MessageResponse
 from app.core.db import get_db
 from app.core.security import get_current_user
 from app.models.services import Upload
+from app.services.analysis_pool import analysis_pool, AnalysisQueueFullError
+from app.services.analysis_cache import analysis_cache, hash_file, normalize_options
+from app.services.file_analysis_service import file_analysis_service
+from app.services.mesh_loader import load_mesh_file, probe_mesh_file
+from app.core.config import settings
 from sqlalchemy.orm import Session
 
 router = APIRouter()
@@ -126,12 +133,17 @@ class FileProcessor:
     
     @staticmethod
     def analyze_mesh_file(file_path: str) -> Dict[str, any]:
-        """Analyze 3D mesh file using trimesh"""
+        """Analyze 3D mesh file using trimesh (cached by file content hash)"""
         try:
             start_time = datetime.now()
             
-            # Load mesh
-            mesh = trimesh.load_mesh(file_path)
+            cache_key = analysis_cache.make_key(hash_file(file_path), {"analyzer": "basic"})
+            cached = analysis_cache.get_local(cache_key)
+            if cached is not None:
+                return cached
+            
+            # Load mesh (binary STL / 3MF are streamed)
+            mesh = load_mesh_file(file_path)
             
             if not isinstance(mesh, trimesh.Trimesh):
                 # Handle scene or multiple meshes
@@ -228,6 +240,7 @@ class FileProcessor:
             
             analysis["warnings"] = warnings
             
+            analysis_cache.set_local(cache_key, analysis)
             return analysis
             
         except Exception as e:
@@ -317,7 +330,7 @@ async def create_upload_url(
         # Store upload record in database
         upload_record = Upload(
             id=upload_id,
-            user_id=getattr(current_user, 'id', None),
+            user_id=current_user,
             filename=request.filename,
             file_key=file_key,
             content_type=request.content_type,
@@ -478,6 +491,106 @@ async def complete_upload(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to complete upload: {str(e)}")
 
+@router.post("/analyze")
+async def submit_analysis(
+    file: UploadFile = File(...),
+    material: str = Form("PLA"),
+    quality: str = Form("standard"),
+    infill: int = Form(20),
+    current_user = Depends(get_current_user)
+):
+    """Upload a model for analysis in the worker pool; poll /analysis/{job_id} for results"""
+    file_ext = os.path.splitext((file.filename or "").lower())[1]
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type: {file_ext}. Supported: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    
+    # Stream to a temp file the worker process can read, hashing as we go
+    bytes_written = 0
+    content_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as temp_file:
+        temp_path = temp_file.name
+        try:
+            while chunk := await file.read(1024 * 1024):
+                bytes_written += len(chunk)
+                if bytes_written > MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Maximum: {MAX_FILE_SIZE} bytes"
+                    )
+                content_hash.update(chunk)
+                temp_file.write(chunk)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+    
+    # Header-only preview: reject oversized meshes before queueing a full analysis
+    preview = await asyncio.to_thread(probe_mesh_file, temp_path)
+    if preview and preview["triangle_count"] > settings.ANALYSIS_MAX_TRIANGLES:
+        os.unlink(temp_path)
+        raise HTTPException(
+            status_code=413,
+            detail=f"Mesh has {preview['triangle_count']} triangles. Maximum: {settings.ANALYSIS_MAX_TRIANGLES}"
+        )
+    
+    options = normalize_options({"material": material, "quality": quality, "infill": infill})
+    # get_current_user returns the user id itself (None for anonymous uploads)
+    owner_id = current_user
+    
+    # Repeat uploads of the same model are answered from the analysis cache
+    cache_key = analysis_cache.make_key(content_hash.hexdigest(), options)
+    cached = await analysis_cache.get(cache_key)
+    if cached is not None:
+        request_fields = await asyncio.to_thread(file_analysis_service.request_fields, temp_path)
+        os.unlink(temp_path)
+        result = {**request_fields, **cached, "cache_hit": True}
+        job = analysis_pool.add_completed_job(result, owner_id=owner_id)
+        return {**job.to_dict(), "preview": preview}
+    
+    try:
+        job = analysis_pool.submit(
+            temp_path,
+            options,
+            owner_id=owner_id,
+            cache_key=cache_key,
+            delete_file_when_done=True
+        )
+    except AnalysisQueueFullError as e:
+        os.unlink(temp_path)
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return {**job.to_dict(include_result=False), "preview": preview}
+
+@router.get("/analysis/{job_id}")
+async def get_analysis_job(
+    job_id: str,
+    current_user = Depends(get_current_user)
+):
+    """Poll an analysis job for progress and results"""
+    job = analysis_pool.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    if job.owner_id is not None and job.owner_id != current_user:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return job.to_dict()
+
+@router.delete("/analysis/{job_id}")
+async def cancel_analysis_job(
+    job_id: str,
+    current_user = Depends(get_current_user)
+):
+    """Cancel a queued or running analysis job"""
+    job = analysis_pool.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    if job.owner_id is not None and job.owner_id != current_user:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not analysis_pool.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Analysis job already {job.status.value}")
+    return MessageResponse(message=f"Analysis job {job_id} cancelled")
+
 @router.get("/{upload_id}")
 async def get_upload_status(
     upload_id: str,
@@ -146,10 +146,11 @@ class Product(ProductBase, TimestampMixin):
 
 class ProductList(BaseModel):
     products: List[Product]
-    total: int
+    total: Optional[int] = None  # Not recomputed for cursor pages
     page: int
     per_page: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None  # Keyset cursor for the following page
 
 # Cart schemas
 class CartItemBase(BaseModel):
@@ -335,6 +336,7 @@ class ProductSort(str, Enum):
     CREATED_DESC = "created_desc"
     POPULARITY = "popularity"
     RATING = "rating"
+    RELEVANCE = "relevance"
 
 class ProductSearch(BaseModel):
     q: Optional[str] = Field(None, max_length=255)  # Search query
@@ -342,6 +344,7 @@ class ProductSearch(BaseModel):
     sort: ProductSort = ProductSort.CREATED_DESC
     page: int = Field(1, ge=1)
     per_page: int = Field(20, ge=1, le=100)
+    cursor: Optional[str] = None  # Keyset cursor from a previous page, replaces page
 
 # Update forward references
 Category.update_forward_refs()
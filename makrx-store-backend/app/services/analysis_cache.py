@@ -0,0 +1,154 @@
+"""Content-addressed cache for mesh analysis results"""
+import asyncio
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import logging
+
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.storage import calculate_file_hash
+
+logger = logging.getLogger(__name__)
+
+# Bump when the analysis output changes shape so stale entries are ignored
+CACHE_NAMESPACE = "mesh_analysis:v2"
+
+# Defaults applied by FileAnalysisService, so {} and explicit defaults share a key
+DEFAULT_ANALYSIS_OPTIONS = {"material": "PLA", "quality": "standard", "infill": 20}
+
+# Sections of a full analysis that depend only on the mesh and options. The
+# per-request fields (analysis_id, file_info, generated_at, timings) are not
+# cached; cache hits get fresh ones.
+CACHED_SECTIONS = (
+    "mesh_analysis", "geometric_analysis", "printability_analysis", "cost_analysis",
+    "time_analysis", "quality_analysis", "material_analysis",
+)
+
+
+def normalize_options(options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fill in analysis defaults so equivalent requests map to one cache entry"""
+    return {**DEFAULT_ANALYSIS_OPTIONS, **(options or {})}
+
+
+def cacheable_sections(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a full analysis result that is stored in the cache"""
+    return {key: result[key] for key in CACHED_SECTIONS if key in result}
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file on disk"""
+    with open(file_path, "rb") as file_obj:
+        return calculate_file_hash(file_obj)
+
+
+class AnalysisCache:
+    """Two-tier cache: a byte-bounded in-process LRU in front of Redis"""
+
+    def __init__(self, max_entries: int, max_bytes: int, redis_url: Optional[str], ttl_seconds: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self._redis = aioredis.from_url(redis_url) if redis_url else None
+        self.stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(file_hash: str, options: Optional[Dict[str, Any]] = None) -> str:
+        """Cache key from file content hash plus the normalized analysis options"""
+        options_json = json.dumps(normalize_options(options), sort_keys=True, default=str)
+        options_digest = hashlib.sha256(options_json.encode()).hexdigest()[:16]
+        return f"{CACHE_NAMESPACE}:{file_hash}:{options_digest}"
+
+    async def key_for_file(self, file_path: str, options: Optional[Dict[str, Any]] = None) -> str:
+        """Hash the file off the event loop and build its cache key"""
+        file_hash = await asyncio.to_thread(hash_file, file_path)
+        return self.make_key(file_hash, options)
+
+    def get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up the in-memory tier only"""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                return None
+            self._entries.move_to_end(key)
+            self.stats["memory_hits"] += 1
+        return json.loads(payload)
+
+    def set_local(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a result in the in-memory tier"""
+        self._store_local(key, json.dumps(value, default=str))
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up memory, then Redis (promoting Redis hits into memory)"""
+        value = self.get_local(key)
+        if value is not None:
+            return value
+
+        if self._redis is not None:
+            try:
+                payload = await self._redis.get(key)
+            except Exception as e:
+                logger.warning(f"Analysis cache read failed: {e}")
+                payload = None
+            if payload is not None:
+                payload = payload.decode() if isinstance(payload, bytes) else payload
+                self._store_local(key, payload)
+                self.stats["redis_hits"] += 1
+                return json.loads(payload)
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a result in both tiers"""
+        payload = json.dumps(value, default=str)
+        self._store_local(key, payload)
+
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, payload, ex=self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Analysis cache write failed: {e}")
+
+    def _store_local(self, key: str, payload: str) -> None:
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size_bytes -= len(previous)
+
+            self._entries[key] = payload
+            self._size_bytes += size
+
+            while len(self._entries) > self.max_entries or self._size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size_bytes -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "size_bytes": self._size_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "redis_enabled": self._redis is not None,
+        }
+
+
+# Global analysis cache instance
+analysis_cache = AnalysisCache(
+    max_entries=settings.ANALYSIS_CACHE_MAX_ENTRIES,
+    max_bytes=settings.ANALYSIS_CACHE_MAX_BYTES,
+    redis_url=getattr(settings, 'REDIS_URL', None),
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL
+)
@@ -0,0 +1,299 @@
+"""Process-pool engine for running mesh analysis off the event loop"""
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, Optional
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# How often the event loop checks a worker process for progress/results
+POLL_INTERVAL_SECONDS = 0.1
+
+# Finished jobs kept around so clients can poll their results
+MAX_FINISHED_JOBS = 500
+
+
+class AnalysisJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    TIMED_OUT = "timed_out"
+    CANCELLED = "cancelled"
+
+
+FINISHED_STATUSES = {
+    AnalysisJobStatus.COMPLETED,
+    AnalysisJobStatus.FAILED,
+    AnalysisJobStatus.TIMED_OUT,
+    AnalysisJobStatus.CANCELLED,
+}
+
+
+class AnalysisQueueFullError(Exception):
+    """Raised when the analysis queue has no free slots"""
+
+
+class AnalysisJobError(Exception):
+    """Raised when an awaited analysis job does not complete successfully"""
+
+
+@dataclass
+class AnalysisJob:
+    job_id: str
+    file_path: str
+    options: Dict[str, Any]
+    timeout: float
+    owner_id: Optional[str] = None
+    cache_key: Optional[str] = None
+    delete_file_when_done: bool = False
+    status: AnalysisJobStatus = AnalysisJobStatus.QUEUED
+    stage: Optional[str] = None
+    progress: float = 0.0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        """Serializable view of the job for polling endpoints"""
+        data = {
+            "job_id": self.job_id,
+            "status": self.status.value,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error:
+            data["error"] = self.error
+        if include_result and self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+def _analysis_worker(conn, file_path: str, options: Dict[str, Any]) -> None:
+    """Entry point of a worker process: run the analysis and report back over the pipe"""
+    try:
+        from app.services.file_analysis_service import file_analysis_service
+
+        def report_progress(stage: str, fraction: float) -> None:
+            conn.send(("progress", stage, fraction))
+
+        result = file_analysis_service.analyze_file_sync(file_path, options, report_progress)
+        conn.send(("result", result))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def _get_mp_context():
+    """Forkserver keeps workers cheap to start without forking the threaded server process"""
+    try:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["app.services.file_analysis_service"])
+        return context
+    except ValueError:
+        return multiprocessing.get_context("spawn")
+
+
+class MeshAnalysisPool:
+    """Bounded pool of analysis worker processes with per-job timeout and cancellation"""
+
+    def __init__(self, max_workers: int, max_queue_size: int, default_timeout: float):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.default_timeout = default_timeout
+        self.jobs: "OrderedDict[str, AnalysisJob]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._context = None
+
+    @property
+    def active_jobs(self) -> int:
+        return sum(1 for job in self.jobs.values() if job.status not in FINISHED_STATUSES)
+
+    def submit(
+        self,
+        file_path: str,
+        options: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        owner_id: Optional[str] = None,
+        cache_key: Optional[str] = None,
+        delete_file_when_done: bool = False
+    ) -> AnalysisJob:
+        """
+        Queue a file for analysis and return the job handle immediately.
+        When cache_key is given the result is stored in the analysis cache.
+        """
+        if self.active_jobs >= self.max_queue_size:
+            raise AnalysisQueueFullError(
+                f"Analysis queue is full ({self.max_queue_size} jobs pending)"
+            )
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+            self._context = _get_mp_context()
+
+        job = AnalysisJob(
+            job_id=str(uuid.uuid4()),
+            file_path=file_path,
+            options=options or {},
+            timeout=timeout or self.default_timeout,
+            owner_id=owner_id,
+            cache_key=cache_key,
+            delete_file_when_done=delete_file_when_done
+        )
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run_job(job))
+        self._prune_finished()
+        return job
+
+    def add_completed_job(self, result: Dict[str, Any], owner_id: Optional[str] = None) -> AnalysisJob:
+        """Register an already-known result (e.g. a cache hit) so clients can poll it like any job"""
+        now = time.time()
+        job = AnalysisJob(
+            job_id=str(uuid.uuid4()),
+            file_path="",
+            options={},
+            timeout=0,
+            owner_id=owner_id,
+            status=AnalysisJobStatus.COMPLETED,
+            progress=1.0,
+            result=result,
+            started_at=now,
+            finished_at=now
+        )
+        job.done.set()
+        self.jobs[job.job_id] = job
+        self._prune_finished()
+        return job
+
+    async def run(self, file_path: str, options: Optional[Dict[str, Any]] = None,
+                  timeout: Optional[float] = None, cache_key: Optional[str] = None) -> Dict[str, Any]:
+        """Submit a job and wait for its result"""
+        job = self.submit(file_path, options, timeout, cache_key=cache_key)
+        await job.done.wait()
+        if job.status != AnalysisJobStatus.COMPLETED:
+            raise AnalysisJobError(job.error or f"Analysis {job.status.value}")
+        return job.result
+
+    def get_job(self, job_id: str) -> Optional[AnalysisJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; returns False if it already finished"""
+        job = self.jobs.get(job_id)
+        if not job or job.status in FINISHED_STATUSES:
+            return False
+        job.task.cancel()
+        return True
+
+    async def _run_job(self, job: AnalysisJob) -> None:
+        process = None
+        parent_conn = None
+        try:
+            async with self._slots:
+                job.status = AnalysisJobStatus.RUNNING
+                job.started_at = time.time()
+                deadline = time.monotonic() + job.timeout
+
+                parent_conn, child_conn = self._context.Pipe(duplex=False)
+                process = self._context.Process(
+                    target=_analysis_worker,
+                    args=(child_conn, job.file_path, job.options),
+                    daemon=True
+                )
+                process.start()
+                child_conn.close()
+
+                while True:
+                    if parent_conn.poll():
+                        try:
+                            # Unpickling a large result can take a while; keep it off the event loop
+                            message = await asyncio.to_thread(parent_conn.recv)
+                        except EOFError:
+                            raise AnalysisJobError("Analysis worker exited unexpectedly")
+
+                        if message[0] == "progress":
+                            _, job.stage, job.progress = message
+                        elif message[0] == "result":
+                            job.result = message[1]
+                            job.progress = 1.0
+                            job.status = AnalysisJobStatus.COMPLETED
+                            break
+                        else:
+                            raise AnalysisJobError(message[1])
+                    elif not process.is_alive() and not parent_conn.poll():
+                        raise AnalysisJobError(
+                            f"Analysis worker exited with code {process.exitcode}"
+                        )
+                    elif time.monotonic() > deadline:
+                        job.status = AnalysisJobStatus.TIMED_OUT
+                        job.error = f"Analysis exceeded {job.timeout:g}s timeout"
+                        break
+                    else:
+                        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+            if job.cache_key and job.status == AnalysisJobStatus.COMPLETED:
+                # Imported lazily: worker processes import this module too
+                from app.services.analysis_cache import analysis_cache, cacheable_sections
+                await analysis_cache.set(job.cache_key, cacheable_sections(job.result))
+
+        except asyncio.CancelledError:
+            job.status = AnalysisJobStatus.CANCELLED
+            job.error = "Analysis cancelled"
+        except Exception as e:
+            logger.error(f"Analysis job {job.job_id} failed: {e}")
+            job.status = AnalysisJobStatus.FAILED
+            job.error = str(e)
+        finally:
+            if process is not None and process.is_alive():
+                process.kill()
+                process.join(timeout=1)
+            if parent_conn is not None:
+                parent_conn.close()
+            if job.delete_file_when_done:
+                try:
+                    os.unlink(job.file_path)
+                except OSError:
+                    pass
+            job.finished_at = time.time()
+            job.done.set()
+
+    def _prune_finished(self) -> None:
+        """Drop the oldest finished jobs beyond the retention limit"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status.value] = counts.get(job.status.value, 0) + 1
+        return {
+            "max_workers": self.max_workers,
+            "max_queue_size": self.max_queue_size,
+            "active_jobs": self.active_jobs,
+            "jobs_by_status": counts,
+        }
+
+
+# Global analysis pool instance
+analysis_pool = MeshAnalysisPool(
+    max_workers=settings.ANALYSIS_WORKERS,
+    max_queue_size=settings.ANALYSIS_QUEUE_SIZE,
+    default_timeout=settings.ANALYSIS_JOB_TIMEOUT
+)
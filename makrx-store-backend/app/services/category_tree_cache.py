@@ -0,0 +1,206 @@
+"""Cached category tree for storefront navigation"""
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from itertools import chain
+from typing import Any, Dict, Optional
+import logging
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.commerce import Category, Product
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CategoryTreeSnapshot:
+    """A built tree, serialized once and served as-is until the next invalidation"""
+    version: int
+    etag: str
+    body: bytes
+    built_at: float
+
+
+async def build_category_tree(db: AsyncSession, include_product_counts: bool) -> Dict[str, Any]:
+    """
+    Category tree from one category query plus (optionally) one grouped
+    product count. product_count is the category's own active products,
+    total_product_count includes every active descendant category.
+    """
+    categories = (await db.execute(
+        select(
+            Category.id,
+            Category.parent_id,
+            Category.name,
+            Category.slug,
+            Category.description,
+            Category.image_url,
+            Category.sort_order
+        ).where(Category.is_active == True)
+    )).all()
+
+    counts: Dict[int, int] = {}
+    if include_product_counts:
+        counts = dict((await db.execute(
+            select(Product.category_id, func.count(Product.id))
+            .where(Product.is_active == True)
+            .group_by(Product.category_id)
+        )).all())
+
+    nodes: Dict[int, Dict[str, Any]] = {}
+    for category in categories:
+        node = {
+            "id": category.id,
+            "name": category.name,
+            "slug": category.slug,
+            "description": category.description,
+            "image_url": category.image_url,
+            "sort_order": category.sort_order,
+            "children": []
+        }
+        if include_product_counts:
+            node["product_count"] = counts.get(category.id, 0)
+        nodes[category.id] = node
+
+    # Link in a second pass so children listed before their parent are kept;
+    # children of inactive parents stay hidden with them
+    root_categories = []
+    for category in categories:
+        if category.parent_id is None:
+            root_categories.append(nodes[category.id])
+        elif category.parent_id in nodes:
+            nodes[category.parent_id]["children"].append(nodes[category.id])
+
+    def sort_key(node):
+        return (node["sort_order"] or 0, node["name"])
+
+    # Sort and roll counts up children-first, without recursion
+    root_categories.sort(key=sort_key)
+    stack = [(node, False) for node in root_categories]
+    while stack:
+        node, children_done = stack.pop()
+        if not children_done:
+            node["children"].sort(key=sort_key)
+            stack.append((node, True))
+            stack.extend((child, False) for child in node["children"])
+        elif include_product_counts:
+            node["total_product_count"] = node["product_count"] + sum(
+                child["total_product_count"] for child in node["children"]
+            )
+
+    return {
+        "categories": root_categories,
+        "total_categories": len(categories)
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header covers the given ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class CategoryTreeCache:
+    """
+    Built trees per product-count flag, reused until a committed category or
+    product write bumps the version. The TTL bounds staleness from writes made by
+    other workers or bulk statements that skip the ORM.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._version = 0
+        self._snapshots: Dict[bool, CategoryTreeSnapshot] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "builds": 0, "invalidations": 0}
+
+    async def get(self, db: AsyncSession, include_product_counts: bool) -> CategoryTreeSnapshot:
+        """Current tree snapshot, building it if missing, invalidated or expired"""
+        snapshot = self._snapshots.get(include_product_counts)
+        if (
+            snapshot is not None
+            and snapshot.version == self._version
+            and time.monotonic() - snapshot.built_at < self.ttl_seconds
+        ):
+            self.stats["hits"] += 1
+            return snapshot
+
+        # Built against the version current at the start, so a write that
+        # lands mid-build leaves this snapshot already stale
+        version = self._version
+        tree = await build_category_tree(db, include_product_counts)
+        body = json.dumps(tree, separators=(",", ":"), default=str).encode()
+        snapshot = CategoryTreeSnapshot(
+            version=version,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            body=body,
+            built_at=time.monotonic()
+        )
+
+        with self._lock:
+            self._snapshots[include_product_counts] = snapshot
+            self.stats["builds"] += 1
+        return snapshot
+
+    def invalidate(self) -> None:
+        """Drop cached trees; the next request rebuilds"""
+        with self._lock:
+            self._version += 1
+            self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "version": self._version, "cached_trees": len(self._snapshots)}
+
+
+def _changes_category_tree(session: Session) -> bool:
+    """Whether a flush touches anything the tree (or its counts) is built from"""
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, (Category, Product)):
+            return True
+
+    for obj in session.dirty:
+        if isinstance(obj, Category) and session.is_modified(obj):
+            return True
+        if isinstance(obj, Product):
+            attrs = inspect(obj).attrs
+            if attrs.category_id.history.has_changes() or attrs.is_active.history.has_changes():
+                return True
+
+    return False
+
+
+# session.info key marking a transaction whose flushes touched the tree
+_PENDING_INVALIDATION = "category_tree_changed"
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_category_tree_changed(session: Session, flush_context) -> None:
+    # Not invalidated yet: a rebuild before the commit would read the old
+    # rows and stamp them with the new version
+    if _changes_category_tree(session):
+        session.info[_PENDING_INVALIDATION] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_category_tree(session: Session) -> None:
+    if session.info.pop(_PENDING_INVALIDATION, False):
+        category_tree_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_category_tree_change(session: Session) -> None:
+    session.info.pop(_PENDING_INVALIDATION, None)
+
+
+# Global category tree cache instance
+category_tree_cache = CategoryTreeCache(ttl_seconds=settings.CATEGORY_TREE_CACHE_TTL)
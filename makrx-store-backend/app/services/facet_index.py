@@ -0,0 +1,361 @@
+"""In-memory facet counts for catalog search, kept as product-id bitmaps"""
+from bisect import bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.commerce import Category, Product
+from app.services.product_index import IncrementalProductIndex
+
+# Upper bounds of the price range facet buckets; the last bucket is open-ended
+PRICE_BUCKET_BOUNDS = (100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def bitmap_from_ids(ids: Iterable[int]) -> int:
+    """Bitmap (as an int) with a bit set for every product id"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        buffer[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def iter_bitmap(bitmap: int) -> Iterator[int]:
+    """Product ids set in a bitmap, ascending"""
+    bits = bin(bitmap)[:1:-1]
+    position = bits.find("1")
+    while position != -1:
+        yield position
+        position = bits.find("1", position + 1)
+
+
+def price_bucket(price: float) -> int:
+    return bisect_right(PRICE_BUCKET_BOUNDS, price)
+
+
+@dataclass(frozen=True)
+class FacetEntry:
+    category_id: Optional[int]
+    brand: Optional[str]
+    price: float
+    bucket: int
+    in_stock: bool
+    is_featured: bool
+    on_sale: bool
+
+
+class FacetIndex(IncrementalProductIndex):
+    """
+    Category, brand and price bucket bitmaps over active products, plus
+    bitmaps for the stock/featured/sale flags. Facet counts for a search
+    are popcounts of each value's bitmap intersected with the search's
+    candidate set and the other facets' filters.
+    """
+
+    name = "facet index"
+
+    def __init__(self, refresh_interval: float, rebuild_interval: float):
+        super().__init__(refresh_interval, rebuild_interval)
+        self._entries: Dict[int, FacetEntry] = {}
+        self._category_names: Dict[int, str] = {}
+        self._building = False
+        self._reset()
+
+    # Maintenance
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        await self._load_category_names(db)
+        await super().rebuild(db)
+
+    async def refresh(self, db: AsyncSession) -> None:
+        await self._load_category_names(db)
+        await super().refresh(db)
+
+    async def _load_category_names(self, db: AsyncSession) -> None:
+        rows = (await db.execute(select(Category.id, Category.name))).all()
+        self._category_names = {row.id: row.name for row in rows}
+
+    def _columns(self):
+        return [
+            Product.category_id,
+            Product.brand,
+            Product.price,
+            Product.sale_price,
+            Product.stock_qty,
+            Product.is_featured,
+        ]
+
+    def _reset(self) -> None:
+        self._entries.clear()
+        self._all = 0
+        self._by_category: Dict[int, int] = defaultdict(int)
+        self._by_brand: Dict[str, int] = defaultdict(int)
+        self._by_bucket: List[int] = [0] * (len(PRICE_BUCKET_BOUNDS) + 1)
+        self._in_stock = 0
+        self._featured = 0
+        self._on_sale = 0
+        self._category_counts: Dict[int, int] = defaultdict(int)
+        self._brand_counts: Dict[str, int] = defaultdict(int)
+        self._bucket_counts: List[int] = [0] * len(self._by_bucket)
+        # Bitmaps are built in one go after a full load rather than bit by bit
+        self._building = True
+
+    def _loaded(self) -> None:
+        ids: Dict[Tuple[str, Any], List[int]] = defaultdict(list)
+        for product_id, entry in self._entries.items():
+            for key in self._keys(entry):
+                ids[key].append(product_id)
+
+        for (kind, value), product_ids in ids.items():
+            bitmap = bitmap_from_ids(product_ids)
+            if kind == "all":
+                self._all = bitmap
+            elif kind == "category":
+                self._by_category[value] = bitmap
+            elif kind == "brand":
+                self._by_brand[value] = bitmap
+            elif kind == "bucket":
+                self._by_bucket[value] = bitmap
+            else:
+                setattr(self, f"_{kind}", bitmap)
+        self._building = False
+
+    @staticmethod
+    def _keys(entry: FacetEntry) -> List[Tuple[str, Any]]:
+        keys = [("all", None), ("bucket", entry.bucket)]
+        if entry.category_id is not None:
+            keys.append(("category", entry.category_id))
+        if entry.brand is not None:
+            keys.append(("brand", entry.brand))
+        if entry.in_stock:
+            keys.append(("in_stock", None))
+        if entry.is_featured:
+            keys.append(("featured", None))
+        if entry.on_sale:
+            keys.append(("on_sale", None))
+        return keys
+
+    def _add(self, row) -> None:
+        price = float(row.sale_price if row.sale_price is not None else row.price)
+        entry = FacetEntry(
+            category_id=row.category_id,
+            brand=row.brand,
+            price=price,
+            bucket=price_bucket(price),
+            in_stock=(row.stock_qty or 0) > 0,
+            is_featured=bool(row.is_featured),
+            on_sale=row.sale_price is not None
+        )
+        self._entries[row.id] = entry
+        self._count(entry, 1)
+        if not self._building:
+            self._set_bits(row.id, entry, True)
+
+    def _remove(self, product_id: int) -> None:
+        entry = self._entries.pop(product_id, None)
+        if entry is None:
+            return
+        self._count(entry, -1)
+        self._set_bits(product_id, entry, False)
+
+    def _count(self, entry: FacetEntry, delta: int) -> None:
+        if entry.category_id is not None:
+            self._category_counts[entry.category_id] += delta
+            if not self._category_counts[entry.category_id]:
+                del self._category_counts[entry.category_id]
+        if entry.brand is not None:
+            self._brand_counts[entry.brand] += delta
+            if not self._brand_counts[entry.brand]:
+                del self._brand_counts[entry.brand]
+        self._bucket_counts[entry.bucket] += delta
+
+    def _set_bits(self, product_id: int, entry: FacetEntry, value: bool) -> None:
+        bit = 1 << product_id
+        update = (lambda bitmap: bitmap | bit) if value else (lambda bitmap: bitmap & ~bit)
+        for kind, key in self._keys(entry):
+            if kind == "category":
+                self._by_category[key] = update(self._by_category[key])
+                if not self._by_category[key]:
+                    del self._by_category[key]
+            elif kind == "brand":
+                self._by_brand[key] = update(self._by_brand[key])
+                if not self._by_brand[key]:
+                    del self._by_brand[key]
+            elif kind == "bucket":
+                self._by_bucket[key] = update(self._by_bucket[key])
+            else:
+                setattr(self, f"_{kind}", update(getattr(self, f"_{kind}")))
+
+    # Facets
+
+    def facets(
+        self,
+        candidate_ids: Optional[Iterable[int]] = None,
+        category_ids: Optional[List[int]] = None,
+        brands: Optional[List[str]] = None,
+        price_min: Optional[float] = None,
+        price_max: Optional[float] = None,
+        in_stock: Optional[bool] = None,
+        is_featured: Optional[bool] = None,
+        sale_items_only: Optional[bool] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Category, brand and price facets for a search. candidate_ids limits
+        the counts to products matching the non-facet part of the search
+        (text, maker-specific filters); None means every active product.
+        Each facet is counted with every other facet's filter applied but
+        not its own, so selecting a brand still shows the other brands.
+        """
+        with self._lock:
+            base = self._all
+            if candidate_ids is not None:
+                base &= bitmap_from_ids(candidate_ids)
+            if in_stock is not None:
+                base &= self._in_stock if in_stock else ~self._in_stock
+            if is_featured is not None:
+                base &= self._featured if is_featured else ~self._featured
+            if sale_items_only:
+                base &= self._on_sale
+
+            category_filter = self._union(self._by_category, category_ids)
+            brand_filter = self._union(self._by_brand, brands)
+            price_filter = self._price_bitmap(price_min, price_max)
+
+            category_scope = self._scope(base, brand_filter, price_filter)
+            brand_scope = self._scope(base, category_filter, price_filter)
+            price_scope = self._scope(base, category_filter, brand_filter)
+
+            if category_scope is None:
+                category_counts = dict(self._category_counts)
+            else:
+                category_counts = self._counts(self._by_category, category_scope)
+
+            if brand_scope is None:
+                brand_counts = dict(self._brand_counts)
+            else:
+                brand_counts = self._counts(self._by_brand, brand_scope)
+
+            if price_scope is None:
+                bucket_counts = list(self._bucket_counts)
+                price_scope = self._all
+            else:
+                bucket_counts = [(bitmap & price_scope).bit_count() for bitmap in self._by_bucket]
+
+            price_range = self._price_range(price_scope, bucket_counts)
+
+            facets = [
+                {
+                    "name": "categories",
+                    "type": "checkbox",
+                    "values": [
+                        {"id": category_id, "name": self._category_names.get(category_id), "count": count}
+                        for category_id, count in sorted(category_counts.items())
+                    ]
+                },
+                {
+                    "name": "brands",
+                    "type": "checkbox",
+                    "values": [
+                        {"name": brand, "count": count}
+                        for brand, count in sorted(brand_counts.items())
+                    ]
+                },
+            ]
+
+            if price_range:
+                facets.append({
+                    "name": "price",
+                    "type": "range",
+                    "values": [{"min": price_range[0], "max": price_range[1]}]
+                })
+
+            facets.append({
+                "name": "price_ranges",
+                "type": "checkbox",
+                "values": [
+                    {
+                        "min": PRICE_BUCKET_BOUNDS[bucket - 1] if bucket else 0,
+                        "max": PRICE_BUCKET_BOUNDS[bucket] if bucket < len(PRICE_BUCKET_BOUNDS) else None,
+                        "count": count
+                    }
+                    for bucket, count in enumerate(bucket_counts)
+                    if count
+                ]
+            })
+
+        return facets
+
+    def _scope(self, base: int, *filters: Optional[int]) -> Optional[int]:
+        """Bitmap a facet is counted over; None when that is all active products"""
+        scope = base
+        for bitmap in filters:
+            if bitmap is not None:
+                scope &= bitmap
+        return None if scope == self._all else scope
+
+    @staticmethod
+    def _union(bitmaps: Dict[Any, int], values: Optional[List[Any]]) -> Optional[int]:
+        if not values:
+            return None
+        result = 0
+        for value in values:
+            result |= bitmaps.get(value, 0)
+        return result
+
+    @staticmethod
+    def _counts(bitmaps: Dict[Any, int], scope: int) -> Dict[Any, int]:
+        counts = {}
+        for value, bitmap in bitmaps.items():
+            count = (bitmap & scope).bit_count()
+            if count:
+                counts[value] = count
+        return counts
+
+    def _price_bitmap(self, price_min: Optional[float], price_max: Optional[float]) -> Optional[int]:
+        """Products priced within [price_min, price_max]; only the edge buckets are checked per product"""
+        if price_min is None and price_max is None:
+            return None
+
+        low = price_bucket(price_min) if price_min is not None else 0
+        high = price_bucket(price_max) if price_max is not None else len(self._by_bucket) - 1
+        result = 0
+        for bucket in range(low, high + 1):
+            bitmap = self._by_bucket[bucket]
+            if bucket in (low, high):
+                bitmap = bitmap_from_ids(
+                    product_id for product_id in iter_bitmap(bitmap)
+                    if (price_min is None or self._entries[product_id].price >= price_min)
+                    and (price_max is None or self._entries[product_id].price <= price_max)
+                )
+            result |= bitmap
+        return result
+
+    def _price_range(self, scope: int, bucket_counts: List[int]) -> Optional[Tuple[float, float]]:
+        """Exact min/max price in scope, looking only inside the lowest and highest non-empty buckets"""
+        buckets = [bucket for bucket, count in enumerate(bucket_counts) if count]
+        if not buckets:
+            return None
+        lowest = min(self._entries[product_id].price for product_id in iter_bitmap(self._by_bucket[buckets[0]] & scope))
+        highest = max(self._entries[product_id].price for product_id in iter_bitmap(self._by_bucket[buckets[-1]] & scope))
+        return lowest, highest
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **super().get_stats(),
+            "products": len(self._entries),
+            "categories": len(self._category_counts),
+            "brands": len(self._brand_counts),
+        }
+
+
+# Global facet index instance
+facet_index = FacetIndex(
+    refresh_interval=settings.FACET_INDEX_REFRESH_INTERVAL,
+    rebuild_interval=settings.FACET_INDEX_REBUILD_INTERVAL
+)
@@ -1,20 +1,105 @@
 """Advanced 3D file analysis service with real mesh processing"""
 import os
 import asyncio
-import tempfile
 import trimesh
 import numpy as np
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Callable
 from datetime import datetime
 import logging
+import time
+from contextlib import contextmanager
+from functools import cached_property
 from pathlib import Path
-import zipfile
 import magic
 from PIL import Image
 import io
 
+from app.services.mesh_loader import load_stl, load_3mf, probe_mesh_file
+
 logger = logging.getLogger(__name__)
 
+class MeshAnalysisContext:
+    """
+    Derived mesh properties shared by every analysis stage.
+    Each property is computed on first use and reused, so one analyze_file
+    call reads e.g. edge lengths or face normals from trimesh only once.
+    """
+    
+    def __init__(self, mesh: trimesh.Trimesh):
+        self.mesh = mesh
+        self.stage_timings: Dict[str, float] = {}
+    
+    @contextmanager
+    def timed(self, stage: str):
+        """Record the wall time of an analysis stage in milliseconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings[stage] = round((time.perf_counter() - start) * 1000, 3)
+    
+    @cached_property
+    def vertices(self) -> np.ndarray:
+        return self.mesh.vertices.view(np.ndarray)
+    
+    @cached_property
+    def vertex_count(self) -> int:
+        return len(self.vertices)
+    
+    @cached_property
+    def face_count(self) -> int:
+        return len(self.mesh.faces)
+    
+    @cached_property
+    def face_normals(self) -> np.ndarray:
+        return self.mesh.face_normals.view(np.ndarray)
+    
+    @cached_property
+    def bounds(self) -> np.ndarray:
+        return np.asarray(self.mesh.bounds)
+    
+    @cached_property
+    def dimensions(self) -> np.ndarray:
+        return self.bounds[1] - self.bounds[0]
+    
+    @cached_property
+    def area(self) -> float:
+        return float(self.mesh.area)
+    
+    @cached_property
+    def volume(self) -> float:
+        return float(self.mesh.volume)
+    
+    @cached_property
+    def is_watertight(self) -> bool:
+        return bool(self.mesh.is_watertight)
+    
+    @cached_property
+    def is_winding_consistent(self) -> bool:
+        return bool(self.mesh.is_winding_consistent)
+    
+    @cached_property
+    def edges_unique_length(self) -> np.ndarray:
+        return self.mesh.edges_unique_length.view(np.ndarray)
+    
+    @cached_property
+    def min_edge_length(self) -> Optional[float]:
+        lengths = self.edges_unique_length
+        return float(lengths.min()) if len(lengths) else None
+    
+    @cached_property
+    def outline(self):
+        """Boundary loops of the mesh (empty for watertight meshes)"""
+        try:
+            return self.mesh.outline()
+        except Exception as e:
+            logger.warning(f"Outline extraction failed: {e}")
+            return None
+    
+    @cached_property
+    def features(self) -> Dict[str, bool]:
+        return FileAnalysisService._detect_features(self)
+
 class FileAnalysisService:
     """Advanced 3D file analysis with real mesh processing"""
     
@@ -49,58 +134,28 @@ class FileAnalysisService:
         }
     
     async def analyze_file(self, file_path: str, analysis_options: Optional[Dict] = None) -> Dict[str, Any]:
-        """Comprehensive 3D file analysis"""
+        """
+        Comprehensive 3D file analysis, run in the analysis worker pool.
+        Results are cached by file content hash and options.
+        """
+        from app.services.analysis_pool import analysis_pool
+        from app.services.analysis_cache import analysis_cache, normalize_options
         start_time = datetime.now()
         
         try:
-            # Basic file validation
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"File not found: {file_path}")
-            
-            file_ext = Path(file_path).suffix.lower()
-            if file_ext not in self.supported_formats:
-                raise ValueError(f"Unsupported file format: {file_ext}")
-            
-            # Get file info
-            file_info = self._get_file_info(file_path)
-            
-            # Load and analyze mesh
-            mesh_analysis = await self._analyze_mesh(file_path, file_ext)
-            
-            # Geometric analysis
-            geometric_analysis = self._analyze_geometry(mesh_analysis['mesh'])
-            
-            # Printability analysis
-            printability_analysis = self._analyze_printability(mesh_analysis['mesh'])
-            
-            # Cost estimation
-            cost_analysis = self._analyze_cost_factors(mesh_analysis['mesh'], analysis_options or {})
-            
-            # Time estimation
-            time_analysis = self._estimate_print_time(mesh_analysis['mesh'], analysis_options or {})
-            
-            # Quality recommendations
-            quality_analysis = self._analyze_quality_requirements(mesh_analysis['mesh'])
-            
-            # Material recommendations
-            material_analysis = self._recommend_materials(mesh_analysis['mesh'], printability_analysis)
-            
-            processing_time = (datetime.now() - start_time).total_seconds()
-            
-            return {
-                "analysis_id": f"analysis_{int(datetime.now().timestamp())}",
-                "file_info": file_info,
-                "mesh_analysis": mesh_analysis,
-                "geometric_analysis": geometric_analysis,
-                "printability_analysis": printability_analysis,
-                "cost_analysis": cost_analysis,
-                "time_analysis": time_analysis,
-                "quality_analysis": quality_analysis,
-                "material_analysis": material_analysis,
-                "processing_time_seconds": round(processing_time, 3),
-                "generated_at": datetime.now().isoformat()
-            }
+            options = normalize_options(analysis_options)
+            cache_key = await analysis_cache.key_for_file(file_path, options)
+            cached = await analysis_cache.get(cache_key)
+            if cached is not None:
+                request_fields = await asyncio.to_thread(self.request_fields, file_path)
+                return {
+                    **request_fields,
+                    **cached,
+                    "cache_hit": True,
+                    "processing_time_seconds": round((datetime.now() - start_time).total_seconds(), 3)
+                }
             
+            return await analysis_pool.run(file_path, options, cache_key=cache_key)
         except Exception as e:
             logger.error(f"File analysis failed: {e}")
             return {
@@ -109,6 +164,100 @@ class FileAnalysisService:
                 "processing_time_seconds": (datetime.now() - start_time).total_seconds()
             }
     
+    def analyze_file_sync(
+        self,
+        file_path: str,
+        analysis_options: Optional[Dict] = None,
+        progress_callback: Optional[Callable[[str, float], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Comprehensive 3D file analysis (blocking).
+        Runs inside an analysis worker process; call analyze_file from async code.
+        """
+        start_time = datetime.now()
+        options = analysis_options or {}
+        
+        def report(stage: str, fraction: float):
+            if progress_callback:
+                progress_callback(stage, fraction)
+        
+        # Basic file validation
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        file_ext = Path(file_path).suffix.lower()
+        if file_ext not in self.supported_formats:
+            raise ValueError(f"Unsupported file format: {file_ext}")
+        
+        # Get file info
+        report("file_info", 0.0)
+        file_info = self._get_file_info(file_path)
+        
+        # Load mesh
+        report("load", 0.05)
+        load_start = time.perf_counter()
+        mesh = self._load_mesh(file_path, file_ext)
+        ctx = MeshAnalysisContext(mesh)
+        ctx.stage_timings["load"] = round((time.perf_counter() - load_start) * 1000, 3)
+        
+        # Basic mesh analysis
+        report("mesh", 0.3)
+        with ctx.timed("mesh"):
+            mesh_analysis = self._analyze_mesh(ctx)
+        
+        # Geometric analysis
+        report("geometry", 0.45)
+        with ctx.timed("geometry"):
+            geometric_analysis = self._analyze_geometry(ctx)
+        
+        # Printability analysis
+        report("printability", 0.6)
+        with ctx.timed("printability"):
+            printability_analysis = self._analyze_printability(ctx)
+        
+        # Cost estimation
+        report("cost", 0.7)
+        with ctx.timed("cost"):
+            cost_analysis = self._analyze_cost_factors(ctx, options)
+        
+        # Time estimation
+        report("time", 0.8)
+        with ctx.timed("time"):
+            time_analysis = self._estimate_print_time(ctx, options)
+        
+        # Quality recommendations
+        report("quality", 0.9)
+        with ctx.timed("quality"):
+            quality_analysis = self._analyze_quality_requirements(ctx)
+        
+        # Material recommendations
+        report("materials", 0.95)
+        with ctx.timed("materials"):
+            material_analysis = self._recommend_materials(ctx, printability_analysis)
+        
+        processing_time = (datetime.now() - start_time).total_seconds()
+        
+        return {
+            **self.request_fields(file_path, file_info),
+            "mesh_analysis": mesh_analysis,
+            "geometric_analysis": geometric_analysis,
+            "printability_analysis": printability_analysis,
+            "cost_analysis": cost_analysis,
+            "time_analysis": time_analysis,
+            "quality_analysis": quality_analysis,
+            "material_analysis": material_analysis,
+            "stage_timings_ms": ctx.stage_timings,
+            "processing_time_seconds": round(processing_time, 3)
+        }
+    
+    def request_fields(self, file_path: str, file_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Result fields that describe this request rather than the mesh (never cached)"""
+        return {
+            "analysis_id": f"analysis_{int(datetime.now().timestamp())}",
+            "file_info": file_info or self._get_file_info(file_path),
+            "generated_at": datetime.now().isoformat()
+        }
+    
     def _get_file_info(self, file_path: str) -> Dict[str, Any]:
         """Get basic file information"""
         stat = os.stat(file_path)
@@ -126,48 +275,41 @@ class FileAnalysisService:
             "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat()
         }
     
-    async def _analyze_mesh(self, file_path: str, file_ext: str) -> Dict[str, Any]:
-        """Load and perform basic mesh analysis"""
+    def probe_file(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """Fast triangle count and bounding box without a full mesh load (STL/3MF only)"""
+        return probe_mesh_file(file_path)
+    
+    def _load_mesh(self, file_path: str, file_ext: str) -> trimesh.Trimesh:
+        """Load a mesh using the loader for its format"""
         try:
-            # Load mesh using appropriate method
-            analysis_func = self.supported_formats[file_ext]
-            mesh = await analysis_func(file_path)
-            
-            if mesh is None:
-                raise ValueError("Failed to load mesh from file")
-            
-            # Basic mesh properties
-            vertex_count = len(mesh.vertices)
-            face_count = len(mesh.faces)
-            edge_count = len(mesh.edges_unique)
-            
-            # Volume and surface area
-            volume_mm3 = abs(mesh.volume) if mesh.is_watertight else 0
-            surface_area_mm2 = mesh.area
-            
-            # Bounding box
-            bounds = mesh.bounds
-            dimensions = bounds[1] - bounds[0]
-            
-            # Mesh quality checks
-            is_watertight = mesh.is_watertight
-            is_winding_consistent = mesh.is_winding_consistent
+            mesh = self.supported_formats[file_ext](file_path)
+        except Exception as e:
+            logger.error(f"Mesh loading failed: {e}")
+            raise ValueError(f"Mesh analysis failed: {str(e)}")
+        
+        if mesh is None:
+            raise ValueError("Failed to load mesh from file")
+        return mesh
+    
+    def _analyze_mesh(self, ctx: MeshAnalysisContext) -> Dict[str, Any]:
+        """Perform basic mesh analysis"""
+        try:
+            # Volume only makes sense for closed meshes
+            volume_mm3 = abs(ctx.volume) if ctx.is_watertight else 0
+            bounds = ctx.bounds
+            dimensions = ctx.dimensions
             
             # Find holes and non-manifold edges
             holes = []
-            if not is_watertight:
-                holes = self._find_holes(mesh)
-            
-            # Center of mass
-            center_of_mass = mesh.center_mass.tolist()
+            if not ctx.is_watertight:
+                holes = self._find_holes(ctx)
             
             return {
-                "mesh": mesh,  # Keep for further analysis
-                "vertex_count": vertex_count,
-                "face_count": face_count,
-                "edge_count": edge_count,
+                "vertex_count": ctx.vertex_count,
+                "face_count": ctx.face_count,
+                "edge_count": len(ctx.edges_unique_length),
                 "volume_mm3": float(volume_mm3),
-                "surface_area_mm2": float(surface_area_mm2),
+                "surface_area_mm2": ctx.area,
                 "dimensions": {
                     "length_mm": float(dimensions[0]),
                     "width_mm": float(dimensions[1]),
@@ -175,10 +317,10 @@ class FileAnalysisService:
                     "bounding_box_min": bounds[0].tolist(),
                     "bounding_box_max": bounds[1].tolist()
                 },
-                "center_of_mass": center_of_mass,
+                "center_of_mass": ctx.mesh.center_mass.tolist(),
                 "mesh_quality": {
-                    "is_watertight": is_watertight,
-                    "is_winding_consistent": is_winding_consistent,
+                    "is_watertight": ctx.is_watertight,
+                    "is_winding_consistent": ctx.is_winding_consistent,
                     "has_holes": len(holes) > 0,
                     "hole_count": len(holes),
                     "holes": holes
@@ -189,87 +331,71 @@ class FileAnalysisService:
             logger.error(f"Mesh analysis failed: {e}")
             raise ValueError(f"Mesh analysis failed: {str(e)}")
     
-    async def _analyze_stl(self, file_path: str) -> trimesh.Trimesh:
-        """Analyze STL file"""
-        return trimesh.load_mesh(file_path)
+    def _analyze_stl(self, file_path: str) -> trimesh.Trimesh:
+        """Analyze STL file (binary STL is streamed through a memory map)"""
+        return load_stl(file_path)
     
-    async def _analyze_obj(self, file_path: str) -> trimesh.Trimesh:
+    def _analyze_obj(self, file_path: str) -> trimesh.Trimesh:
         """Analyze OBJ file"""
         return trimesh.load_mesh(file_path)
     
-    async def _analyze_ply(self, file_path: str) -> trimesh.Trimesh:
+    def _analyze_ply(self, file_path: str) -> trimesh.Trimesh:
         """Analyze PLY file"""
         return trimesh.load_mesh(file_path)
     
-    async def _analyze_3mf(self, file_path: str) -> trimesh.Trimesh:
+    def _analyze_3mf(self, file_path: str) -> trimesh.Trimesh:
         """Analyze 3MF file (Microsoft 3D Manufacturing Format)"""
-        # 3MF files are ZIP archives containing XML and mesh data
-        try:
-            with zipfile.ZipFile(file_path, 'r') as zip_file:
-                # Look for 3D model files in the archive
-                for filename in zip_file.namelist():
-                    if filename.endswith('.model'):
-                        # Extract and parse 3MF model file
-                        # This is a simplified implementation
-                        # Full 3MF support would require XML parsing
-                        with tempfile.NamedTemporaryFile(suffix='.stl') as temp_file:
-                            # Convert 3MF to STL (simplified)
-                            return trimesh.load_mesh(file_path)
-                            
-            raise ValueError("No valid 3D model found in 3MF file")
-        except Exception as e:
-            logger.warning(f"3MF parsing failed, trying as mesh: {e}")
-            return trimesh.load_mesh(file_path)
+        # 3MF files are ZIP archives containing XML mesh data, parsed incrementally
+        return load_3mf(file_path)
     
-    async def _analyze_amf(self, file_path: str) -> trimesh.Trimesh:
+    def _analyze_amf(self, file_path: str) -> trimesh.Trimesh:
         """Analyze AMF file (Additive Manufacturing Format)"""
         # AMF files are XML-based
         return trimesh.load_mesh(file_path)
     
-    async def _analyze_off(self, file_path: str) -> trimesh.Trimesh:
+    def _analyze_off(self, file_path: str) -> trimesh.Trimesh:
         """Analyze OFF file (Object File Format)"""
         return trimesh.load_mesh(file_path)
     
-    async def _analyze_x3d(self, file_path: str) -> trimesh.Trimesh:
+    def _analyze_x3d(self, file_path: str) -> trimesh.Trimesh:
         """Analyze X3D file"""
         return trimesh.load_mesh(file_path)
     
-    def _find_holes(self, mesh: trimesh.Trimesh) -> List[Dict[str, Any]]:
+    def _find_holes(self, ctx: MeshAnalysisContext) -> List[Dict[str, Any]]:
         """Find holes in the mesh"""
         holes = []
         try:
-            # Find boundary loops (holes)
-            if hasattr(mesh, 'outline'):
-                outlines = mesh.outline()
-                if hasattr(outlines, 'entities'):
-                    for i, entity in enumerate(outlines.entities):
-                        if hasattr(entity, 'points'):
-                            hole_perimeter = np.linalg.norm(np.diff(entity.points, axis=0), axis=1).sum()
-                            holes.append({
-                                "hole_id": i,
-                                "perimeter_mm": float(hole_perimeter),
-                                "point_count": len(entity.points)
-                            })
+            # Boundary loops (holes) of the mesh outline
+            outlines = ctx.outline
+            if outlines is not None and hasattr(outlines, 'entities'):
+                vertices = np.asarray(outlines.vertices)
+                for i, entity in enumerate(outlines.entities):
+                    if hasattr(entity, 'points'):
+                        points = vertices[entity.points]
+                        hole_perimeter = np.linalg.norm(np.diff(points, axis=0), axis=1).sum()
+                        holes.append({
+                            "hole_id": i,
+                            "perimeter_mm": float(hole_perimeter),
+                            "point_count": len(entity.points)
+                        })
         except Exception as e:
             logger.warning(f"Hole detection failed: {e}")
         
         return holes
     
-    def _analyze_geometry(self, mesh: trimesh.Trimesh) -> Dict[str, Any]:
+    def _analyze_geometry(self, ctx: MeshAnalysisContext) -> Dict[str, Any]:
         """Analyze geometric properties"""
         try:
             # Calculate complexity metrics
-            vertex_density = len(mesh.vertices) / mesh.area if mesh.area > 0 else 0
-            face_density = len(mesh.faces) / mesh.area if mesh.area > 0 else 0
+            area = ctx.area
+            vertex_density = ctx.vertex_count / area if area > 0 else 0
+            face_density = ctx.face_count / area if area > 0 else 0
             
             # Surface roughness estimation
-            surface_roughness = self._estimate_surface_roughness(mesh)
+            surface_roughness = self._estimate_surface_roughness(ctx)
             
             # Symmetry analysis
-            symmetry_analysis = self._analyze_symmetry(mesh)
-            
-            # Feature detection
-            features = self._detect_features(mesh)
+            symmetry_analysis = self._analyze_symmetry(ctx)
             
             return {
                 "complexity_metrics": {
@@ -279,41 +405,41 @@ class FileAnalysisService:
                     "geometric_complexity": min(10, vertex_density / 100)  # Scale to 1-10
                 },
                 "symmetry": symmetry_analysis,
-                "features": features
+                "features": ctx.features
             }
             
         except Exception as e:
             logger.error(f"Geometry analysis failed: {e}")
             return {"error": str(e)}
     
-    def _estimate_surface_roughness(self, mesh: trimesh.Trimesh) -> float:
+    def _estimate_surface_roughness(self, ctx: MeshAnalysisContext) -> float:
         """Estimate surface roughness from mesh properties"""
         try:
             # Calculate face normal variation as roughness indicator
-            if len(mesh.face_normals) > 1:
-                normal_variations = np.std(mesh.face_normals, axis=0)
+            if len(ctx.face_normals) > 1:
+                normal_variations = np.std(ctx.face_normals, axis=0)
                 roughness_score = np.mean(normal_variations) * 10  # Scale to 0-10
                 return float(min(10, max(0, roughness_score)))
             return 0.0
         except:
             return 0.0
     
-    def _analyze_symmetry(self, mesh: trimesh.Trimesh) -> Dict[str, Any]:
+    def _analyze_symmetry(self, ctx: MeshAnalysisContext) -> Dict[str, Any]:
         """Analyze mesh symmetry"""
         try:
-            bounds = mesh.bounds
+            bounds = ctx.bounds
             center = (bounds[0] + bounds[1]) / 2
             
-            # Check for approximate symmetry along each axis
+            # Count vertices on either side of the center along all axes at once
+            vertices = ctx.vertices
+            positive_counts = np.count_nonzero(vertices > center, axis=0)
+            negative_counts = np.count_nonzero(vertices < center, axis=0)
+            
             symmetry_scores = {}
             for axis, name in enumerate(['x', 'y', 'z']):
-                # Simple symmetry check by comparing vertices on either side of center
-                vertices_positive = mesh.vertices[mesh.vertices[:, axis] > center[axis]]
-                vertices_negative = mesh.vertices[mesh.vertices[:, axis] < center[axis]]
-                
-                if len(vertices_positive) > 0 and len(vertices_negative) > 0:
-                    ratio = min(len(vertices_positive), len(vertices_negative)) / max(len(vertices_positive), len(vertices_negative))
-                    symmetry_scores[f"{name}_axis"] = float(ratio)
+                positive, negative = positive_counts[axis], negative_counts[axis]
+                if positive > 0 and negative > 0:
+                    symmetry_scores[f"{name}_axis"] = float(min(positive, negative) / max(positive, negative))
                 else:
                     symmetry_scores[f"{name}_axis"] = 0.0
             
@@ -326,8 +452,9 @@ class FileAnalysisService:
             logger.warning(f"Symmetry analysis failed: {e}")
             return {"error": str(e)}
     
-    def _detect_features(self, mesh: trimesh.Trimesh) -> Dict[str, Any]:
-        """Detect geometric features that affect printing"""
+    @staticmethod
+    def _detect_features(ctx: MeshAnalysisContext) -> Dict[str, Any]:
+        """Detect geometric features that affect printing (use ctx.features for the cached result)"""
         features = {
             "thin_walls": False,
             "overhangs": False,
@@ -337,26 +464,20 @@ class FileAnalysisService:
         }
         
         try:
+            min_edge_length = ctx.min_edge_length
+            
             # Detect thin walls by analyzing edge lengths
-            if hasattr(mesh, 'edges_unique_length'):
-                min_edge_length = np.min(mesh.edges_unique_length)
-                if min_edge_length < 0.8:  # Less than 0.8mm
-                    features["thin_walls"] = True
-            
-            # Detect overhangs by analyzing face normals
-            if len(mesh.face_normals) > 0:
-                # Faces with normal Z component < -0.5 are potential overhangs
-                overhang_faces = mesh.face_normals[:, 2] < -0.5
-                if np.any(overhang_faces):
-                    features["overhangs"] = True
+            if min_edge_length is not None and min_edge_length < 0.8:  # Less than 0.8mm
+                features["thin_walls"] = True
+            
+            # Faces with normal Z component < -0.5 are potential overhangs
+            if len(ctx.face_normals) > 0 and np.any(ctx.face_normals[:, 2] < -0.5):
+                features["overhangs"] = True
             
             # Detect small details by analyzing feature size relative to bounding box
-            bounds = mesh.bounds
-            max_dimension = np.max(bounds[1] - bounds[0])
-            if hasattr(mesh, 'edges_unique_length'):
-                smallest_feature = np.min(mesh.edges_unique_length)
-                if smallest_feature < max_dimension * 0.001:  # Less than 0.1% of max dimension
-                    features["small_details"] = True
+            max_dimension = np.max(ctx.dimensions)
+            if min_edge_length is not None and min_edge_length < max_dimension * 0.001:  # Less than 0.1% of max dimension
+                features["small_details"] = True
             
             # Detect potential bridges (simplified)
             # This would require more sophisticated analysis in practice
@@ -364,9 +485,9 @@ class FileAnalysisService:
                 features["bridges"] = True
             
             # Detect hollow sections (simplified check)
-            if mesh.is_watertight and mesh.volume > 0:
+            if ctx.is_watertight and ctx.volume > 0:
                 # Calculate approximate wall thickness
-                surface_to_volume_ratio = mesh.area / mesh.volume
+                surface_to_volume_ratio = ctx.area / ctx.volume
                 if surface_to_volume_ratio > 10:  # High ratio suggests hollow
                     features["hollow_sections"] = True
                     
@@ -375,7 +496,7 @@ class FileAnalysisService:
         
         return features
     
-    def _analyze_printability(self, mesh: trimesh.Trimesh) -> Dict[str, Any]:
+    def _analyze_printability(self, ctx: MeshAnalysisContext) -> Dict[str, Any]:
         """Analyze how printable the mesh is"""
         try:
             printability_score = 100  # Start with perfect score
@@ -383,17 +504,16 @@ class FileAnalysisService:
             warnings = []
             
             # Check mesh quality
-            if not mesh.is_watertight:
+            if not ctx.is_watertight:
                 printability_score -= 30
                 issues.append("Mesh is not watertight - may cause slicing issues")
             
-            if not mesh.is_winding_consistent:
+            if not ctx.is_winding_consistent:
                 printability_score -= 20
                 issues.append("Inconsistent face winding detected")
             
             # Check dimensions
-            bounds = mesh.bounds
-            dimensions = bounds[1] - bounds[0]
+            dimensions = ctx.dimensions
             
             # Check if model fits in typical print bed (200x200x200mm)
             print_bed_size = [200, 200, 200]
@@ -404,8 +524,8 @@ class FileAnalysisService:
                     issues.append(f"Model exceeds typical printer {axis_name} limit ({dim:.1f}mm > {limit}mm)")
             
             # Check minimum feature size
-            if hasattr(mesh, 'edges_unique_length'):
-                min_feature = np.min(mesh.edges_unique_length)
+            min_feature = ctx.min_edge_length
+            if min_feature is not None:
                 if min_feature < 0.4:  # 0.4mm minimum for most printers
                     printability_score -= 25
                     issues.append(f"Features smaller than 0.4mm detected (min: {min_feature:.2f}mm)")
@@ -414,7 +534,7 @@ class FileAnalysisService:
                     warnings.append(f"Small features detected (min: {min_feature:.2f}mm) - may not print clearly")
             
             # Check for overhangs
-            features = self._detect_features(mesh)
+            features = ctx.features
             if features.get("overhangs"):
                 printability_score -= 15
                 warnings.append("Overhangs detected - supports may be required")
@@ -428,7 +548,7 @@ class FileAnalysisService:
                 warnings.append("Very small details may not print clearly")
             
             # Volume check
-            if mesh.volume < 100:  # Less than 0.1 cm³
+            if ctx.volume < 100:  # Less than 0.1 cm³
                 printability_score -= 5
                 warnings.append("Very small object - consider scaling up")
             
@@ -452,15 +572,15 @@ class FileAnalysisService:
                 "issues": issues,
                 "warnings": warnings,
                 "supports_recommended": features.get("overhangs", False),
-                "brim_recommended": features.get("small_details", False) or min(dimensions) < 10,
-                "scaling_recommended": mesh.volume < 100
+                "brim_recommended": bool(features.get("small_details", False) or min(dimensions) < 10),
+                "scaling_recommended": ctx.volume < 100
             }
             
         except Exception as e:
             logger.error(f"Printability analysis failed: {e}")
             return {"error": str(e)}
     
-    def _analyze_cost_factors(self, mesh: trimesh.Trimesh, options: Dict) -> Dict[str, Any]:
+    def _analyze_cost_factors(self, ctx: MeshAnalysisContext, options: Dict) -> Dict[str, Any]:
         """Analyze factors that affect printing cost"""
         try:
             material = options.get('material', 'PLA')
@@ -468,11 +588,11 @@ class FileAnalysisService:
             quality = options.get('quality', 'standard')
             
             # Material volume calculation
-            solid_volume = mesh.volume if mesh.volume > 0 else 0
+            solid_volume = ctx.volume if ctx.volume > 0 else 0
             infill_volume = solid_volume * (infill / 100)
             
             # Support material estimate
-            features = self._detect_features(mesh)
+            features = ctx.features
             support_volume = 0
             if features.get('overhangs'):
                 support_volume = solid_volume * 0.15  # 15% of model volume
@@ -509,7 +629,7 @@ class FileAnalysisService:
                 },
                 "cost_factors": {
                     "quality_multiplier": quality_multiplier,
-                    "complexity_multiplier": 1.0 + (len(mesh.vertices) / 50000),  # More vertices = more complex
+                    "complexity_multiplier": 1.0 + (ctx.vertex_count / 50000),  # More vertices = more complex
                     "support_required": features.get('overhangs', False),
                     "estimated_waste_factor": 1.1  # 10% waste
                 }
@@ -519,7 +639,7 @@ class FileAnalysisService:
             logger.error(f"Cost analysis failed: {e}")
             return {"error": str(e)}
     
-    def _estimate_print_time(self, mesh: trimesh.Trimesh, options: Dict) -> Dict[str, Any]:
+    def _estimate_print_time(self, ctx: MeshAnalysisContext, options: Dict) -> Dict[str, Any]:
         """Estimate printing time based on geometry and settings"""
         try:
             quality = options.get('quality', 'standard')
@@ -530,13 +650,12 @@ class FileAnalysisService:
             print_speed = profile['speed_mm_s']
             
             # Calculate number of layers
-            bounds = mesh.bounds
-            height = bounds[1][2] - bounds[0][2]  # Z dimension
+            height = ctx.dimensions[2]  # Z dimension
             layer_count = max(1, int(height / layer_height))
             
             # Estimate print path length
-            perimeter_length = self._estimate_perimeter_length(mesh)
-            infill_length = self._estimate_infill_length(mesh, options.get('infill', 20))
+            perimeter_length = self._estimate_perimeter_length(ctx)
+            infill_length = self._estimate_infill_length(ctx, options.get('infill', 20))
             
             total_extrusion_length = (perimeter_length + infill_length) * layer_count
             
@@ -576,26 +695,25 @@ class FileAnalysisService:
             logger.error(f"Time estimation failed: {e}")
             return {"error": str(e)}
     
-    def _estimate_perimeter_length(self, mesh: trimesh.Trimesh) -> float:
+    def _estimate_perimeter_length(self, ctx: MeshAnalysisContext) -> float:
         """Estimate perimeter length per layer"""
         try:
             # Simplified: use mesh outline
-            if hasattr(mesh, 'outline'):
-                outline = mesh.outline()
-                if hasattr(outline, 'length'):
-                    return float(outline.length)
+            outline = ctx.outline
+            if outline is not None and hasattr(outline, 'length'):
+                return float(outline.length)
             
             # Fallback: estimate from surface area
-            return float(np.sqrt(mesh.area) * 4)  # Rough approximation
+            return float(np.sqrt(ctx.area) * 4)  # Rough approximation
             
         except:
-            return float(np.sqrt(mesh.area) * 4)
+            return float(np.sqrt(ctx.area) * 4)
     
-    def _estimate_infill_length(self, mesh: trimesh.Trimesh, infill_percentage: float) -> float:
+    def _estimate_infill_length(self, ctx: MeshAnalysisContext, infill_percentage: float) -> float:
         """Estimate infill extrusion length per layer"""
         try:
-            bounds = mesh.bounds
-            layer_area = (bounds[1][0] - bounds[0][0]) * (bounds[1][1] - bounds[0][1])
+            dimensions = ctx.dimensions
+            layer_area = dimensions[0] * dimensions[1]
             
             # Infill pattern affects length - using rectangular pattern estimate
             infill_density = infill_percentage / 100
@@ -609,10 +727,10 @@ class FileAnalysisService:
         except:
             return 0.0
     
-    def _analyze_quality_requirements(self, mesh: trimesh.Trimesh) -> Dict[str, Any]:
+    def _analyze_quality_requirements(self, ctx: MeshAnalysisContext) -> Dict[str, Any]:
         """Analyze what quality settings are needed"""
         try:
-            features = self._detect_features(mesh)
+            features = ctx.features
             
             recommended_quality = "standard"
             recommendations = []
@@ -627,13 +745,12 @@ class FileAnalysisService:
                 recommendations.append("High quality recommended for thin walls")
             
             # Check surface complexity
-            if len(mesh.vertices) > 100000:
+            if ctx.vertex_count > 100000:
                 recommended_quality = "high"
                 recommendations.append("High quality recommended for complex geometry")
             
             # Layer height recommendations
-            bounds = mesh.bounds
-            min_dimension = np.min(bounds[1] - bounds[0])
+            min_dimension = np.min(ctx.dimensions)
             
             if min_dimension < 5:  # Very small objects
                 layer_height = 0.1
@@ -648,19 +765,18 @@ class FileAnalysisService:
                 "recommended_layer_height": layer_height,
                 "recommendations": recommendations,
                 "supports_needed": features.get("overhangs", False),
-                "brim_needed": features.get("small_details", False) or min_dimension < 10
+                "brim_needed": bool(features.get("small_details", False) or min_dimension < 10)
             }
             
         except Exception as e:
             logger.error(f"Quality analysis failed: {e}")
             return {"error": str(e)}
     
-    def _recommend_materials(self, mesh: trimesh.Trimesh, printability: Dict) -> Dict[str, Any]:
+    def _recommend_materials(self, ctx: MeshAnalysisContext, printability: Dict) -> Dict[str, Any]:
         """Recommend suitable materials based on geometry"""
         try:
-            features = self._detect_features(mesh)
-            bounds = mesh.bounds
-            dimensions = bounds[1] - bounds[0]
+            features = ctx.features
+            max_dimension = np.max(ctx.dimensions)
             
             material_scores = {}
             
@@ -688,7 +804,6 @@ class FileAnalysisService:
                         reasons.append("May not capture fine details as well")
                 
                 # Size considerations
-                max_dimension = np.max(dimensions)
                 if max_dimension > 100:  # Large objects
                     if material == "ABS":
                         score += 10
@@ -698,7 +813,7 @@ class FileAnalysisService:
                         reasons.append("May warp on large prints")
                 
                 # Strength requirements (based on volume/wall thickness)
-                if mesh.volume > 50000 or features.get("thin_walls"):
+                if ctx.volume > 50000 or features.get("thin_walls"):
                     strength_materials = ["ABS", "PETG", "CARBON_FIBER"]
                     if material in strength_materials:
                         score += 15
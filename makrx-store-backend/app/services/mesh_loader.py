@@ -0,0 +1,263 @@
+"""Memory-bounded loaders for binary STL and 3MF uploads"""
+import math
+import os
+import struct
+import zipfile
+from array import array
+from typing import Any, Dict, Iterator, Optional, Tuple
+import xml.etree.ElementTree as ET
+import logging
+
+import numpy as np
+import trimesh
+
+logger = logging.getLogger(__name__)
+
+# Binary STL layout: 80-byte header, uint32 triangle count, then 50-byte records
+STL_HEADER_BYTES = 84
+STL_RECORD_DTYPE = np.dtype([
+    ("normal", "<f4", (3,)),
+    ("vertices", "<f4", (3, 3)),
+    ("attribute", "<u2"),
+])
+
+# Triangles processed per chunk; bounds the temporary copies made while deduplicating
+DEFAULT_CHUNK_TRIANGLES = 1 << 18
+
+
+def binary_stl_triangle_count(file_path: str) -> Optional[int]:
+    """Triangle count of a binary STL, or None if the file is not binary STL"""
+    file_size = os.path.getsize(file_path)
+    if file_size < STL_HEADER_BYTES:
+        return None
+
+    with open(file_path, "rb") as f:
+        header = f.read(STL_HEADER_BYTES)
+    (triangle_count,) = struct.unpack("<I", header[80:84])
+
+    # ASCII files can start with "solid" too, so trust the size check only
+    if file_size != STL_HEADER_BYTES + triangle_count * STL_RECORD_DTYPE.itemsize:
+        return None
+    return triangle_count
+
+
+def _map_stl_records(file_path: str, triangle_count: int) -> np.memmap:
+    """Read-only memory map of the STL triangle records (no data is copied)"""
+    return np.memmap(
+        file_path, dtype=STL_RECORD_DTYPE, mode="r",
+        offset=STL_HEADER_BYTES, shape=(triangle_count,)
+    )
+
+
+def probe_stl(file_path: str, chunk_triangles: int = DEFAULT_CHUNK_TRIANGLES) -> Optional[Dict[str, Any]]:
+    """
+    Header-only summary of a binary STL: triangle count and bounding box.
+    The bounding box is reduced chunk by chunk over the memory map.
+    """
+    triangle_count = binary_stl_triangle_count(file_path)
+    if triangle_count is None:
+        return None
+    if triangle_count == 0:
+        return {"format": "binary_stl", "triangle_count": 0, "bounds": None}
+
+    triangles = _map_stl_records(file_path, triangle_count)["vertices"]
+    lower = np.full(3, np.inf, dtype=np.float32)
+    upper = np.full(3, -np.inf, dtype=np.float32)
+    for start in range(0, triangle_count, chunk_triangles):
+        chunk = triangles[start:start + chunk_triangles]
+        np.minimum(lower, chunk.min(axis=(0, 1)), out=lower)
+        np.maximum(upper, chunk.max(axis=(0, 1)), out=upper)
+
+    return {
+        "format": "binary_stl",
+        "triangle_count": triangle_count,
+        "bounds": [lower.tolist(), upper.tolist()],
+        "dimensions": (upper - lower).tolist(),
+    }
+
+
+def load_binary_stl(
+    file_path: str,
+    chunk_triangles: int = DEFAULT_CHUNK_TRIANGLES
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Load a binary STL into deduplicated float32 vertices and int64 faces.
+
+    Records are read through a memory map. Vertices are deduplicated per
+    chunk by their raw 12-byte value, then the (much smaller) per-chunk
+    unique sets are merged, so peak memory stays proportional to the chunk
+    size plus the output arrays rather than to the whole file.
+    """
+    triangle_count = binary_stl_triangle_count(file_path)
+    if triangle_count is None:
+        return None
+
+    triangles = _map_stl_records(file_path, triangle_count)["vertices"]
+    vertex_key = np.dtype((np.void, 12))
+
+    chunk_uniques = []
+    chunk_inverses = []
+    for start in range(0, triangle_count, chunk_triangles):
+        corners = np.ascontiguousarray(triangles[start:start + chunk_triangles]).reshape(-1, 3)
+        unique, inverse = np.unique(corners.view(vertex_key).ravel(), return_inverse=True)
+        chunk_uniques.append(unique)
+        chunk_inverses.append(inverse.astype(np.int64, copy=False))
+
+    if not chunk_uniques:
+        return np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int64)
+
+    merged, merged_inverse = np.unique(np.concatenate(chunk_uniques), return_inverse=True)
+
+    faces = np.empty((triangle_count, 3), dtype=np.int64)
+    offset = 0
+    for index, (unique, inverse) in enumerate(zip(chunk_uniques, chunk_inverses)):
+        start = index * chunk_triangles
+        faces[start:start + len(inverse) // 3] = merged_inverse[offset + inverse].reshape(-1, 3)
+        offset += len(unique)
+
+    # Zero-copy reinterpretation of the 12-byte keys as xyz floats
+    vertices = merged.view(np.float32).reshape(-1, 3)
+    return vertices, faces
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _iter_3mf_mesh(file_path: str) -> Iterator[Tuple[str, tuple]]:
+    """
+    Stream ("vertex", (x, y, z)) and ("triangle", (v1, v2, v3)) records out of a
+    3MF archive, with triangle indices offset to be global across mesh objects.
+    The model XML is read incrementally and parsed elements are discarded as we go.
+    """
+    vertex_count = 0
+    vertex_offset = 0
+
+    with zipfile.ZipFile(file_path, "r") as archive:
+        model_names = [name for name in archive.namelist() if name.endswith(".model")]
+        for model_name in model_names:
+            with archive.open(model_name) as model_file:
+                container = None
+                for event, elem in ET.iterparse(model_file, events=("start", "end")):
+                    name = _local_name(elem.tag)
+                    if event == "start":
+                        if name == "mesh":
+                            vertex_offset = vertex_count
+                        elif name in ("vertices", "triangles"):
+                            container = elem
+                        continue
+
+                    if name == "vertex":
+                        attrib = elem.attrib
+                        vertex_count += 1
+                        yield "vertex", (float(attrib["x"]), float(attrib["y"]), float(attrib["z"]))
+                    elif name == "triangle":
+                        attrib = elem.attrib
+                        yield "triangle", (
+                            int(attrib["v1"]) + vertex_offset,
+                            int(attrib["v2"]) + vertex_offset,
+                            int(attrib["v3"]) + vertex_offset
+                        )
+                    else:
+                        continue
+
+                    # Drop the parsed child so the tree never holds the whole mesh
+                    if container is not None:
+                        container.clear()
+
+
+def parse_3mf(file_path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream the mesh objects out of a 3MF archive into float32 vertices and int64 faces.
+    Build-item transforms and component references are not applied.
+    """
+    vertex_values = array("f")
+    face_values = array("q")
+    for kind, values in _iter_3mf_mesh(file_path):
+        if kind == "vertex":
+            vertex_values.extend(values)
+        else:
+            face_values.extend(values)
+
+    if not face_values:
+        return None
+
+    vertices = np.frombuffer(vertex_values, dtype=np.float32).reshape(-1, 3)
+    faces = np.frombuffer(face_values, dtype=np.int64).reshape(-1, 3)
+    return vertices, faces
+
+
+def probe_3mf(file_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Triangle count and bounding box of a 3MF archive in one streaming pass.
+    Only running counts and bounds are kept; no vertex or face arrays are built.
+    """
+    triangle_count = 0
+    lower = [math.inf] * 3
+    upper = [-math.inf] * 3
+    for kind, values in _iter_3mf_mesh(file_path):
+        if kind == "triangle":
+            triangle_count += 1
+            continue
+        for axis, value in enumerate(values):
+            if value < lower[axis]:
+                lower[axis] = value
+            if value > upper[axis]:
+                upper[axis] = value
+
+    if triangle_count == 0:
+        return None
+    return {
+        "format": "3mf",
+        "triangle_count": triangle_count,
+        "bounds": [lower, upper],
+        "dimensions": [high - low for low, high in zip(lower, upper)],
+    }
+
+
+def probe_mesh_file(file_path: str) -> Optional[Dict[str, Any]]:
+    """Cheap triangle count / bounding box preview, or None when the format needs a full load"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if file_ext == ".stl":
+            return probe_stl(file_path)
+        if file_ext == ".3mf":
+            return probe_3mf(file_path)
+    except Exception as e:
+        logger.warning(f"Mesh probe failed for {file_path}: {e}")
+    return None
+
+
+def _to_trimesh(vertices: np.ndarray, faces: np.ndarray) -> trimesh.Trimesh:
+    # Vertices are already merged, so skip trimesh's own processing pass
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+
+
+def load_stl(file_path: str) -> trimesh.Trimesh:
+    """Load an STL, streaming binary files and falling back to trimesh for ASCII"""
+    loaded = load_binary_stl(file_path)
+    if loaded is None:
+        return trimesh.load_mesh(file_path)
+    return _to_trimesh(*loaded)
+
+
+def load_3mf(file_path: str) -> trimesh.Trimesh:
+    """Load a 3MF archive, streaming its model XML and falling back to trimesh"""
+    try:
+        loaded = parse_3mf(file_path)
+        if loaded is not None:
+            return _to_trimesh(*loaded)
+        logger.warning("No mesh objects found in 3MF, trying trimesh")
+    except Exception as e:
+        logger.warning(f"3MF parsing failed, trying trimesh: {e}")
+    return trimesh.load_mesh(file_path)
+
+
+def load_mesh_file(file_path: str) -> trimesh.Trimesh:
+    """Load any supported mesh file, using the streaming readers where available"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == ".stl":
+        return load_stl(file_path)
+    if file_ext == ".3mf":
+        return load_3mf(file_path)
+    return trimesh.load_mesh(file_path)
@@ -0,0 +1,143 @@
+"""Base class for in-memory product indexes kept current from the products table"""
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+import logging
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.commerce import Product
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalProductIndex:
+    """
+    Loads active products once, then applies rows whose
+    coalesce(updated_at, created_at) moved past the last seen watermark.
+    Rebuilt in full periodically so hard deletes drop out. Subclasses list
+    the columns they need and implement _reset, _add and _remove.
+    """
+
+    name = "product index"
+
+    def __init__(self, refresh_interval: float, rebuild_interval: float):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._watermark: Optional[datetime] = None
+        self._watermark_ids: Set[int] = set()
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        self._load_lock = asyncio.Lock()
+        self.stats = {"rebuilds": 0, "refreshes": 0, "products_updated": 0}
+
+    async def ensure_fresh(self, db: AsyncSession) -> None:
+        """Rebuild or pick up changed products if the index is due for it"""
+        if not self._due():
+            return
+        # Concurrent requests wait for one load instead of each running their own
+        async with self._load_lock:
+            now = time.monotonic()
+            if not self._built_at or now - self._built_at >= self.rebuild_interval:
+                await self.rebuild(db)
+            elif now - self._checked_at >= self.refresh_interval:
+                await self.refresh(db)
+
+    def _due(self) -> bool:
+        now = time.monotonic()
+        return (
+            not self._built_at
+            or now - self._built_at >= self.rebuild_interval
+            or now - self._checked_at >= self.refresh_interval
+        )
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        """Load every active product from scratch"""
+        rows = (await db.execute(self._product_rows().where(Product.is_active == True))).all()
+        # Indexing the whole catalog is CPU-bound; keep it off the event loop
+        await asyncio.to_thread(self._load_all, rows)
+        logger.info(f"{self.name.capitalize()} built with {len(rows)} products")
+
+    def _load_all(self, rows) -> None:
+        with self._lock:
+            self._reset()
+            self._watermark = None
+            self._watermark_ids.clear()
+            for row in rows:
+                self._apply(row)
+            self._loaded()
+            self._built_at = self._checked_at = time.monotonic()
+            self.stats["rebuilds"] += 1
+
+    async def refresh(self, db: AsyncSession) -> None:
+        """Apply products created, updated or deactivated since the last load"""
+        query = self._product_rows()
+        if self._watermark is not None:
+            # >= so rows stamped in the same instant as the watermark are not missed
+            query = query.where(self._changed_at() >= self._watermark)
+        rows = [
+            row for row in (await db.execute(query)).all()
+            if not (row.changed_at == self._watermark and row.id in self._watermark_ids)
+        ]
+
+        with self._lock:
+            for row in rows:
+                self._apply(row)
+            self._checked_at = time.monotonic()
+            self.stats["refreshes"] += 1
+            self.stats["products_updated"] += len(rows)
+
+    def invalidate(self) -> None:
+        """Force a full rebuild on the next lookup"""
+        self._built_at = 0.0
+
+    @staticmethod
+    def _changed_at():
+        return func.coalesce(Product.updated_at, Product.created_at)
+
+    def _product_rows(self):
+        return select(
+            Product.id,
+            Product.is_active,
+            self._changed_at().label("changed_at"),
+            *self._columns()
+        )
+
+    def _apply(self, row) -> None:
+        self._remove(row.id)
+        if row.changed_at is not None:
+            if self._watermark is None or row.changed_at > self._watermark:
+                self._watermark = row.changed_at
+                self._watermark_ids = {row.id}
+            elif row.changed_at == self._watermark:
+                self._watermark_ids.add(row.id)
+        if row.is_active:
+            self._add(row)
+
+    # Subclass hooks
+
+    def _columns(self) -> List[Any]:
+        """Extra columns to load for each product row"""
+        raise NotImplementedError
+
+    def _reset(self) -> None:
+        """Drop all indexed products"""
+        raise NotImplementedError
+
+    def _add(self, row) -> None:
+        """Index an active product row"""
+        raise NotImplementedError
+
+    def _remove(self, product_id: int) -> None:
+        """Remove a product if it is indexed"""
+        raise NotImplementedError
+
+    def _loaded(self) -> None:
+        """Called after a full load, before the index is used"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
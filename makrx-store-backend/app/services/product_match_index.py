@@ -0,0 +1,241 @@
+"""In-memory product match index for mapping BOM items to store products"""
+import math
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.models.commerce import Product
+from app.services.product_index import IncrementalProductIndex
+
+_PART_NUMBER_STRIP_RE = re.compile(r"[^0-9A-Z]+")
+
+# Confidence rules, as applied by the per-item query matcher this index replaces
+EXACT_CONFIDENCE = 0.95
+PARTIAL_MIN_SIMILARITY = 0.7
+PARTIAL_WEIGHT = 0.8
+FUZZY_MIN_SIMILARITY = 0.5
+FUZZY_WEIGHT = 0.6
+FUZZY_CANDIDATES = 5
+
+
+def normalize_part_number(value: Optional[str]) -> Optional[str]:
+    """Uppercase and drop separators so "ab-123 x" and "AB123X" compare equal"""
+    if not value:
+        return None
+    normalized = _PART_NUMBER_STRIP_RE.sub("", str(value).upper())
+    return normalized or None
+
+
+def name_tokens(name: Optional[str]) -> FrozenSet[str]:
+    """Word set used for name similarity"""
+    return frozenset((name or "").lower().split())
+
+
+def jaccard(tokens1: FrozenSet[str], tokens2: FrozenSet[str]) -> float:
+    """Word overlap between two token sets"""
+    if not tokens1 or not tokens2:
+        return 0.0
+    overlap = len(tokens1 & tokens2)
+    return overlap / (len(tokens1) + len(tokens2) - overlap)
+
+
+@dataclass(frozen=True)
+class IndexedProduct:
+    id: int
+    name: str
+    brand: Optional[str]
+    price: float
+    stock_qty: int
+    name_lower: str
+    brand_lower: str
+    tokens: FrozenSet[str]
+    part_numbers: FrozenSet[str]
+
+
+@dataclass(frozen=True)
+class IndexMatch:
+    product: IndexedProduct
+    confidence: float
+    match_type: str  # exact, partial, fuzzy
+    reason: str
+
+
+class ProductMatchIndex(IncrementalProductIndex):
+    """
+    Active products keyed for BOM matching: normalized part numbers, a
+    token -> product inverted index with document frequencies, and a brand
+    dictionary.
+    """
+
+    name = "product match index"
+
+    def __init__(self, refresh_interval: float, rebuild_interval: float):
+        super().__init__(refresh_interval, rebuild_interval)
+        self._products: Dict[int, IndexedProduct] = {}
+        self._by_part_number: Dict[str, Set[int]] = defaultdict(set)
+        self._by_token: Dict[str, Set[int]] = defaultdict(set)
+        self._by_brand: Dict[str, Set[int]] = defaultdict(set)
+
+    # Maintenance
+
+    def _columns(self):
+        return [
+            Product.name,
+            Product.brand,
+            Product.price,
+            Product.sale_price,
+            Product.stock_qty,
+            Product.attributes['part_number'].astext.label("part_number"),
+            Product.attributes['sku'].astext.label("sku"),
+        ]
+
+    def _reset(self) -> None:
+        self._products.clear()
+        self._by_part_number.clear()
+        self._by_token.clear()
+        self._by_brand.clear()
+
+    def _add(self, row) -> None:
+        product = IndexedProduct(
+            id=row.id,
+            name=row.name,
+            brand=row.brand,
+            price=float(row.sale_price or row.price),
+            stock_qty=row.stock_qty or 0,
+            name_lower=row.name.lower(),
+            brand_lower=(row.brand or "").lower(),
+            tokens=name_tokens(row.name),
+            part_numbers=frozenset(
+                pn for pn in (normalize_part_number(row.part_number), normalize_part_number(row.sku)) if pn
+            )
+        )
+        self._products[product.id] = product
+        for part_number in product.part_numbers:
+            self._by_part_number[part_number].add(product.id)
+        for token in product.tokens:
+            self._by_token[token].add(product.id)
+        if product.brand_lower:
+            self._by_brand[product.brand_lower].add(product.id)
+
+    def _remove(self, product_id: int) -> None:
+        product = self._products.pop(product_id, None)
+        if product is None:
+            return
+        for index, keys in (
+            (self._by_part_number, product.part_numbers),
+            (self._by_token, product.tokens),
+            (self._by_brand, (product.brand_lower,) if product.brand_lower else ()),
+        ):
+            for key in keys:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del index[key]
+
+    # Matching
+
+    def match_items(self, items: Iterable[Tuple[str, Optional[str], Optional[str]]]) -> List[List[IndexMatch]]:
+        """
+        Score a whole BOM against the index in one pass. Each item is
+        (name, manufacturer, part_number); repeated items are scored once.
+        Returns matches per item, best first.
+        """
+        with self._lock:
+            total = len(self._products)
+
+            def idf(token: str) -> float:
+                return math.log((1 + total) / (1 + len(self._by_token.get(token, ()))))
+
+            brand_cache: Dict[str, Set[int]] = {}
+            scored: Dict[Tuple[str, Optional[str], Optional[str]], List[IndexMatch]] = {}
+            results = []
+
+            for item in items:
+                if item not in scored:
+                    scored[item] = self._match_item(*item, idf=idf, brand_cache=brand_cache)
+                results.append(scored[item])
+
+        return results
+
+    def _match_item(self, name, manufacturer, part_number, idf, brand_cache) -> List[IndexMatch]:
+        # Exact part number / SKU
+        normalized = normalize_part_number(part_number)
+        if normalized and normalized in self._by_part_number:
+            return self._ranked([
+                IndexMatch(self._products[pid], EXACT_CONFIDENCE, "exact", "Exact part number match")
+                for pid in self._by_part_number[normalized]
+            ])
+
+        tokens = name_tokens(name)
+
+        # Manufacturer and name match
+        if manufacturer:
+            manufacturer_lower = manufacturer.lower()
+            if manufacturer_lower not in brand_cache:
+                brand_cache[manufacturer_lower] = set().union(*(
+                    ids for brand, ids in self._by_brand.items() if manufacturer_lower in brand
+                ))
+            name_prefix = name[:20].lower()
+            matches = []
+            for pid in self._candidates(tokens, PARTIAL_MIN_SIMILARITY) & brand_cache[manufacturer_lower]:
+                product = self._products[pid]
+                if name_prefix not in product.name_lower:
+                    continue
+                similarity = jaccard(tokens, product.tokens)
+                if similarity > PARTIAL_MIN_SIMILARITY:
+                    matches.append(IndexMatch(
+                        product, similarity * PARTIAL_WEIGHT, "partial", "Brand and name similarity"
+                    ))
+            if matches:
+                return self._ranked(matches)
+
+        # Fuzzy name match over the inverted index
+        scored = []
+        for pid in self._candidates(tokens, FUZZY_MIN_SIMILARITY):
+            product = self._products[pid]
+            similarity = jaccard(tokens, product.tokens)
+            if similarity > FUZZY_MIN_SIMILARITY:
+                weight = sum(idf(token) for token in tokens & product.tokens)
+                scored.append((similarity, weight, product))
+        scored.sort(key=lambda entry: (-entry[0], -entry[1], entry[2].id))
+
+        return [
+            IndexMatch(product, similarity * FUZZY_WEIGHT, "fuzzy", "Name similarity")
+            for similarity, _, product in scored[:FUZZY_CANDIDATES]
+        ]
+
+    def _candidates(self, tokens: FrozenSet[str], min_similarity: float) -> Set[int]:
+        """
+        Products that can beat min_similarity: any such product shares one of
+        the item's rarest tokens, so only those posting lists are scanned.
+        """
+        if not tokens:
+            return set()
+        required_overlap = math.floor(min_similarity * len(tokens)) + 1
+        by_rarity = sorted(tokens, key=lambda token: (len(self._by_token.get(token, ())), token))
+        return set().union(*(
+            self._by_token.get(token, ()) for token in by_rarity[:len(tokens) - required_overlap + 1]
+        ))
+
+    @staticmethod
+    def _ranked(matches: List[IndexMatch]) -> List[IndexMatch]:
+        return sorted(matches, key=lambda match: (-match.confidence, match.product.id))
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **super().get_stats(),
+            "products": len(self._products),
+            "tokens": len(self._by_token),
+            "part_numbers": len(self._by_part_number),
+            "brands": len(self._by_brand),
+        }
+
+
+# Global product match index instance
+product_match_index = ProductMatchIndex(
+    refresh_interval=settings.BOM_MATCH_INDEX_REFRESH_INTERVAL,
+    rebuild_interval=settings.BOM_MATCH_INDEX_REBUILD_INTERVAL
+)
@@ -0,0 +1,79 @@
+"""
+Database migration for product full-text search
+Adds a generated tsvector column with a GIN index, plus trigram indexes
+on name and brand for prefix matching and typo tolerance
+"""
+
+from sqlalchemy import text
+from app.core.db import engine
+
+
+def upgrade():
+    """Apply the migration"""
+    
+    sql_statements = [
+        # Trigram support for fuzzy matching
+        """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        """,
+        
+        # Weighted search document kept in sync by PostgreSQL
+        """
+        ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(brand, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(short_description, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'C')
+        ) STORED;
+        """,
+        
+        # Create search indexes
+        """
+        CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING gin(search_vector);
+        CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin(name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_products_brand_trgm ON products USING gin(brand gin_trgm_ops);
+        """,
+    ]
+    
+    # Execute all statements
+    with engine.connect() as conn:
+        for sql in sql_statements:
+            try:
+                conn.execute(text(sql))
+                conn.commit()
+                print(f"✓ Executed: {sql[:50]}...")
+            except Exception as e:
+                print(f"✗ Failed: {sql[:50]}... - {e}")
+                conn.rollback()
+
+
+def downgrade():
+    """Reverse the migration"""
+    
+    sql_statements = [
+        "DROP INDEX IF EXISTS ix_products_brand_trgm;",
+        "DROP INDEX IF EXISTS ix_products_name_trgm;",
+        "DROP INDEX IF EXISTS ix_products_search_vector;",
+        "ALTER TABLE products DROP COLUMN IF EXISTS search_vector;",
+    ]
+    
+    with engine.connect() as conn:
+        for sql in sql_statements:
+            try:
+                conn.execute(text(sql))
+                conn.commit()
+                print(f"✓ Reverted: {sql[:50]}...")
+            except Exception as e:
+                print(f"✗ Failed to revert: {sql[:50]}... - {e}")
+                conn.rollback()
+
+
+if __name__ == "__main__":
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()